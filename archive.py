@@ -0,0 +1,109 @@
+"""Archive of removed clients.
+
+Removing a client moves it from clients to deleted_clients (see
+ClientRepository.remove), so the client list, uniqueness checks and search
+only ever see current clients. archive_deleted_clients moves the clients that
+were removed more than ARCHIVE_AFTER_DAYS ago on to a separate archive
+database, in batches, so the main database stays small as well.
+
+Each batch is stored as one zlib-compressed JSON blob; a small index of client
+id and phone per batch makes archived clients easy to look up again.
+"""
+import json
+import sqlite3
+import time
+import zlib
+from typing import List, Optional
+
+from repositories import DeletedClient
+from storage import DATABASE_URL, client_session
+
+ARCHIVE_PATH = "bike_rental_archive.db"
+ARCHIVE_AFTER_DAYS = 30
+BATCH_SIZE = 1000
+
+
+class ArchiveCancelled(Exception):
+    pass
+
+
+class ClientArchive:
+    def __init__(self, path: str = ARCHIVE_PATH):
+        self.conn = sqlite3.connect(path, timeout=30)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    archived_at INTEGER NOT NULL,
+                    clients INTEGER NOT NULL,
+                    data BLOB NOT NULL)""")
+            # A client archived twice (after an interrupted run) points to its last batch
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS archived_clients (
+                    client_id INTEGER PRIMARY KEY,
+                    phone TEXT,
+                    batch_id INTEGER NOT NULL REFERENCES batches (id))""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_archived_clients_phone ON archived_clients (phone)")
+
+    def store(self, clients: List[DeletedClient]) -> int:
+        """Store one batch of removed clients and return its id."""
+        data = zlib.compress(json.dumps([list(client) for client in clients]).encode(), 9)
+        with self.conn:
+            batch_id = self.conn.execute("INSERT INTO batches (archived_at, clients, data) VALUES (?, ?, ?)",
+                                         (int(time.time()), len(clients), data)).lastrowid
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO archived_clients (client_id, phone, batch_id) VALUES (?, ?, ?)",
+                [(client.id, client.phone, batch_id) for client in clients])
+        return batch_id
+
+    def _load(self, batch_id: int) -> List[DeletedClient]:
+        data = self.conn.execute("SELECT data FROM batches WHERE id = ?", (batch_id,)).fetchone()[0]
+        return [DeletedClient(*row) for row in json.loads(zlib.decompress(data))]
+
+    def get(self, client_id: int) -> Optional[DeletedClient]:
+        row = self.conn.execute("SELECT batch_id FROM archived_clients WHERE client_id = ?", (client_id,)).fetchone()
+        if row is None:
+            return None
+        return next(client for client in self._load(row[0]) if client.id == client_id)
+
+    def find_by_phone(self, phone: str) -> List[DeletedClient]:
+        rows = self.conn.execute("SELECT client_id, batch_id FROM archived_clients WHERE phone = ? ORDER BY client_id",
+                                 (phone,)).fetchall()
+        return [client for client_id, batch_id in rows for client in self._load(batch_id) if client.id == client_id]
+
+    def count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM archived_clients").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+def archive_deleted_clients(older_than_days=ARCHIVE_AFTER_DAYS, progress=None, cancel_event=None,
+                            batch_size=BATCH_SIZE, db_path=DATABASE_URL, archive_path=ARCHIVE_PATH, now=None):
+    """Move clients removed more than older_than_days ago to the archive; returns how many.
+
+    Every batch is committed to the archive before it is deleted from the
+    main database, so an interrupted run never loses clients; at worst the
+    next run archives a batch again. Each delete is a short transaction, the
+    terminals keep working in between. progress and cancel_event work as in
+    exporter.export_clients; a cancelled run keeps the batches already moved.
+    """
+    cutoff = int(now if now is not None else time.time()) - older_than_days * 24 * 3600
+    archive = ClientArchive(archive_path)
+    try:
+        with client_session(db_path) as clients:
+            total = clients.count_deleted_before(cutoff)
+            done = 0
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ArchiveCancelled()
+                batch = clients.deleted_before(cutoff, batch_size)
+                if not batch:
+                    return done
+                archive.store(batch)
+                clients.purge_deleted(client.id for client in batch)
+                done += len(batch)
+                if progress is not None:
+                    progress(done, total)
+    finally:
+        archive.close()
@@ -0,0 +1,72 @@
+"""Online backups of the database while the terminals keep working.
+
+The SQLite backup API copies BACKUP_PAGES pages per step and sleeps between
+steps, so other connections are never locked out for long. The copy runs in a
+read transaction: in WAL mode that pins one consistent snapshot, whereas
+without it every commit by a terminal would restart the backup from the first
+page. Backups are written next to each other in BACKUP_DIR, the oldest ones
+beyond BACKUPS_KEPT are removed.
+"""
+import glob
+import os
+import sqlite3
+from datetime import datetime
+
+from repositories import open_connection
+from storage import DATABASE_URL, is_postgres
+
+BACKUP_DIR = "backups"
+BACKUP_PAGES = 1024  # 4 MB per step with the default page size
+BACKUP_SLEEP = 0.005  # seconds between steps
+BACKUPS_KEPT = 10
+
+
+class BackupCancelled(Exception):
+    pass
+
+
+def backup_database(db_path=DATABASE_URL, backup_dir=BACKUP_DIR, progress=None, cancel_event=None,
+                    pages=BACKUP_PAGES, keep=BACKUPS_KEPT):
+    """Copy db_path to a new timestamped file in backup_dir and return its path.
+
+    progress is called as progress(done, total) in pages after every step.
+    Setting cancel_event stops the backup, removes the partial file and
+    raises BackupCancelled. Only for SQLite: a PostgreSQL server is backed up
+    on the server itself, with pg_dump or its own backup tooling.
+    """
+    if is_postgres(db_path):
+        raise ValueError("Backups van een PostgreSQL database maak je op de server, bijvoorbeeld met pg_dump")
+    os.makedirs(backup_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    path = os.path.join(backup_dir, f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.db")
+    tmp_path = path + ".tmp"
+
+    def step(status, remaining, total):
+        if cancel_event is not None and cancel_event.is_set():
+            raise BackupCancelled()
+        if progress is not None:
+            progress(total - remaining, total)
+
+    source = open_connection(db_path)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # starts the read transaction
+        source.backup(target, pages=pages, progress=step, sleep=BACKUP_SLEEP)
+        result = target.execute("PRAGMA quick_check").fetchone()[0]
+        if result != "ok":
+            raise sqlite3.DatabaseError(f"Backup is beschadigd: {result}")
+        target.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        target.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        source.close()
+
+    # Timestamps sort by name, oldest first
+    for old_path in sorted(glob.glob(os.path.join(backup_dir, f"{stem}-*.db")))[:-keep]:
+        os.remove(old_path)
+    return path
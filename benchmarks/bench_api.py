@@ -0,0 +1,56 @@
+"""Throughput of the HTTP/JSON API: client lookups and list pages over
+keep-alive connections, with the client in the same process. See conftest.py
+for how to run them."""
+import asyncio
+import json
+import random
+
+from rental_service import AuthService, ClientCache, ClientService
+from rental_service.api import MAX_HEADER_SIZE, ApiServer
+from repositories import EmployeeRepository
+
+CONNECTIONS = 16
+REQUESTS = 2000  # per round, spread over the connections
+
+
+async def _get(reader, writer, path, token):
+    writer.write(f"GET {path} HTTP/1.1\r\nAuthorization: Bearer {token}\r\n\r\n".encode())
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) != b"\r\n":
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    json.loads(await reader.readexactly(length))
+    return status
+
+
+def test_api_requests(measure, client_repo, client_count):
+    clients = ClientService(client_repo, ClientCache(client_repo.data_version))
+    auth = AuthService(EmployeeRepository(client_repo.conn))
+    server = ApiServer(clients, auth)
+    # Skips the login, the KDF is not what is measured here
+    token = auth.create_session(EmployeeRepository(client_repo.conn).find_by_username("admin")[0])
+
+    # Half single clients, half list pages of 20
+    rng = random.Random(4)
+    paths = [f"/clients/{rng.randrange(1, client_count)}" if i % 2 else
+             f"/clients?after_id={rng.randrange(client_count)}&limit=20" for i in range(REQUESTS)]
+
+    async def connection(address, paths):
+        reader, writer = await asyncio.open_connection(*address)
+        try:
+            for path in paths:
+                assert await _get(reader, writer, path, token) == 200
+        finally:
+            writer.close()
+
+    async def run_all():
+        listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0, limit=MAX_HEADER_SIZE)
+        address = listener.sockets[0].getsockname()[:2]
+        try:
+            await asyncio.gather(*(connection(address, paths[i::CONNECTIONS]) for i in range(CONNECTIONS)))
+        finally:
+            listener.close()
+            await listener.wait_closed()
+
+    measure(asyncio.run, rows=REQUESTS, setup=lambda: (run_all(),), rounds=3)
@@ -0,0 +1,136 @@
+"""Benchmarks of the client data paths: registration, lookups, list pages,
+search, export and import. See conftest.py for how to run them."""
+import csv
+import itertools
+import random
+import sqlite3
+import statistics
+import timeit
+from functools import partial
+
+import metrics
+from exporter import export_clients
+from importer import import_clients
+from repositories import ClientRepository
+from rental_service.clients import validate_batch
+
+from .generate import free_phone_for, generate_clients, phone_for
+
+LIST_PAGE_SIZE = 200  # CLIENT_PAGE_SIZE of the client list
+IMPORT_ROWS = 5000
+MAX_METRICS_OVERHEAD = 1.02  # instrumented / plain time of a list page
+
+def test_register_client(measure, writing_client_service):
+    # Every registration gets a new phone
+    phones = (free_phone_for(i) for i in itertools.count(1_000_000))
+
+    def register():
+        return writing_client_service.register("Bench Klant", "bench@example.com", next(phones), "Bike")
+
+    measure(register)
+
+
+def test_phone_unique(measure, client_service, client_count):
+    # Half registered, half free
+    rng = random.Random(1)
+    phones = [phone_for(rng.randrange(client_count)) for _ in range(50)]
+    phones += [free_phone_for(i) for i in range(50)]
+
+    def check_all():
+        return [client_service.is_phone_unique(phone) for phone in phones]
+
+    measure(check_all, rows=len(phones))
+
+
+def test_get_client(measure, client_service, client_count):
+    client_ids = random.Random(2).sample(range(1, client_count), 100)
+
+    def get_all():
+        return [client_service.get(client_id) for client_id in client_ids]
+
+    measure(get_all, rows=len(client_ids))
+
+
+def test_get_many(measure, client_service, client_count):
+    client_ids = random.Random(3).sample(range(1, client_count), 100)
+    measure(client_service.get_many, client_ids, rows=len(client_ids))
+
+
+def test_list_page(measure, client_repo, client_count):
+    # Keyset pages deep into the table cost the same as the first page
+    after_id = client_count // 2
+    measure(client_repo.list_page, after_id, LIST_PAGE_SIZE, rows=LIST_PAGE_SIZE)
+
+
+def _overhead_ratio(baseline, candidate, pairs=300, number=10):
+    # Median of back to back timings, which share the machine's noise; that
+    # noise is larger than the overhead when the two run as separate tests.
+    # Every other pair starts with the candidate, so warm caches favour neither
+    ratios = []
+    for i in range(pairs):
+        if i % 2:
+            seconds = timeit.timeit(candidate, number=number)
+            ratios.append(seconds / timeit.timeit(baseline, number=number))
+        else:
+            seconds = timeit.timeit(baseline, number=number)
+            ratios.append(timeit.timeit(candidate, number=number) / seconds)
+    return statistics.median(ratios)
+
+
+def test_list_page_with_metrics(measure, benchmark, client_repo, database, client_count):
+    # test_list_page on an instrumented connection, compared with a plain one
+    after_id = client_count // 2
+    conn = sqlite3.connect(database, factory=metrics.InstrumentedConnection)
+    try:
+        instrumented = ClientRepository(conn)
+        measure(instrumented.list_page, after_id, LIST_PAGE_SIZE, rows=LIST_PAGE_SIZE)
+        ratio = _overhead_ratio(partial(client_repo.list_page, after_id, LIST_PAGE_SIZE),
+                                partial(instrumented.list_page, after_id, LIST_PAGE_SIZE))
+    finally:
+        conn.close()
+    benchmark.extra_info["overhead_ratio"] = round(ratio, 3)
+    assert ratio < MAX_METRICS_OVERHEAD, f"metrics make a list page {ratio - 1:.1%} slower"
+
+
+def test_search(measure, client_repo):
+    texts = ["jan", "de vries", "guus stouten", "emma@", "0651234", "fietsverhuur"]
+
+    def search_all():
+        return [client_repo.search(text) for text in texts]
+
+    measure(search_all, rows=len(texts))
+
+
+def test_export_csv(measure, database, client_count, tmp_path):
+    path = str(tmp_path / "clients.csv")
+    measure(partial(export_clients, path, "csv", db_path=database), rows=client_count)
+
+
+def test_export_xlsx(measure, database, client_count, tmp_path):
+    path = str(tmp_path / "clients.xlsx")
+    # Slow enough that a single round is representative
+    measure(partial(export_clients, path, "xlsx", db_path=database), rows=client_count,
+            setup=lambda: (), rounds=1)
+
+
+def test_validate_batch(measure):
+    # The rules of an import batch on their own, without file or database
+    rows = [tuple(row) for row in generate_clients(IMPORT_ROWS, start=0)]
+    measure(lambda: validate_batch(range(len(rows)), rows, set(), set()), rows=len(rows))
+
+
+def test_import_csv(measure, database_copy, client_count, tmp_path):
+    paths = itertools.count()
+
+    def write_file():
+        # New phones every round, otherwise the second round only finds duplicates
+        start = client_count + next(paths) * IMPORT_ROWS
+        path = tmp_path / f"import_{start}.csv"
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("name", "email", "phone", "rental_type"))
+            writer.writerows(generate_clients(IMPORT_ROWS, start=start))
+        return (str(path),)
+
+    result = measure(partial(import_clients, db_path=database_copy), rows=IMPORT_ROWS, setup=write_file)
+    assert not result.rejected
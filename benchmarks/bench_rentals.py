@@ -0,0 +1,28 @@
+"""Benchmarks of bike availability and check-out/check-in against a 5k bike
+fleet with a long rental history. See conftest.py for how to run them."""
+from .generate import HOUR, NOW
+
+DAY = 24 * HOUR
+
+
+def test_count_available(measure, rental_service):
+    # "How many bikes of each type are free this afternoon"
+    measure(rental_service.count_available, NOW, NOW + 3 * HOUR)
+
+
+def test_count_available_last_month(measure, rental_service):
+    # Windows in the past read all history returned since then
+    measure(rental_service.count_available, NOW - 30 * DAY, NOW - 30 * DAY + 3 * HOUR)
+
+
+def test_available_bikes(measure, rental_service):
+    measure(rental_service.available, "Electric Bike", NOW + DAY, NOW + DAY + 3 * HOUR, 20)
+
+
+def test_check_out_and_in(measure, writing_rental_service):
+    def rent_and_return():
+        rental = writing_rental_service.check_out(1, "Bike", NOW + 2 * HOUR)
+        bike = writing_rental_service.bikes.get(rental.bike_id)
+        return writing_rental_service.check_in(bike.code)
+
+    measure(rent_and_return)
@@ -0,0 +1,202 @@
+"""Fixtures for the benchmark suite.
+
+Run from the repository root with:
+
+    python -m pytest benchmarks                           # 10k clients
+    python -m pytest benchmarks --clients 10000,100000,1000000
+    python -m pytest benchmarks --rentals 100000          # smaller rental history
+
+Every benchmark runs against a temporary database filled by generate.py. Next
+to the pytest-benchmark timings it records throughput (rows per second) and
+the peak of Python allocations (tracemalloc, sqlite's own page cache is not
+included) in the saved results. A benchmark fails when it is slower than its
+budget in BUDGETS or uses more memory. Every run is saved in .benchmarks; once
+there is a saved run, this also fails when the fastest round of a benchmark got
+more than 30% slower than in the last one (the fastest round is the one least
+disturbed by the rest of the machine, compare on an otherwise idle machine):
+
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=min:30%
+
+Without a saved run, for example in a fresh clone, pytest-benchmark refuses
+--benchmark-compare-fail, so run once without it first.
+
+The generated databases are shared by the whole session. Benchmarks that write
+get a copy of their own (database_copy, writing_client_service,
+writing_rental_service), so what they add doesn't change what the others
+measure.
+"""
+import sqlite3
+import tracemalloc
+
+import pytest
+
+from repositories import BikeRepository, ClientRepository, RentalRepository, open_connection
+from rental_service import ClientCache, ClientService, RentalService
+
+from .generate import NOW, SIZES, build_database
+
+FLEET_CLIENTS = 10_000
+FLEET_BIKES = 5000
+
+# Test name -> (max mean seconds per row, max peak of Python allocations in KiB).
+# The indexed operations must not get slower as the table grows, the budgets
+# hold for 1M clients. Export and import are budgeted per row.
+BUDGETS = {
+    "test_register_client": (0.002, 64),
+    "test_phone_unique": (0.0005, 128),
+    "test_get_client": (0.0001, 128),
+    "test_get_many": (0.0001, 256),
+    "test_list_page": (0.00002, 512),
+    "test_list_page_with_metrics": (0.00002, 512),
+    "test_search": (0.02, 1024),
+    "test_export_csv": (0.00002, 8 * 1024),
+    "test_export_xlsx": (0.0002, 16 * 1024),
+    "test_import_csv": (0.0002, 8 * 1024),
+    "test_validate_batch": (0.00001, 4 * 1024),
+    "test_count_available": (0.02, 256),
+    "test_count_available_last_month": (0.05, 256),
+    "test_available_bikes": (0.02, 256),
+    "test_check_out_and_in": (0.01, 64),
+    # Per request, 2000 requests per second with the test client in the same process
+    "test_api_requests": (0.0005, 8 * 1024),
+}
+
+
+def pytest_addoption(parser):
+    parser.addoption("--clients", default=str(SIZES[0]),
+                     help=f"comma separated database sizes, for example {','.join(map(str, SIZES))}")
+    parser.addoption("--rentals", type=int, default=1_000_000,
+                     help=f"rental history of the {FLEET_BIKES} bike fleet")
+
+
+def pytest_generate_tests(metafunc):
+    if "database" in metafunc.fixturenames:
+        sizes = [int(size) for size in metafunc.config.getoption("clients").split(",")]
+        metafunc.parametrize("database", sizes, indirect=True, scope="session",
+                             ids=[f"{size // 1000}k" for size in sizes])
+
+
+@pytest.fixture(scope="session")
+def database(request, tmp_path_factory):
+    """Path of a generated database with request.param clients."""
+    path = tmp_path_factory.getbasetemp() / f"clients_{request.param}.db"
+    if not path.exists():
+        build_database(str(path), request.param)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def fleet_database(request, tmp_path_factory):
+    """Path of a generated database with a 5k bike fleet and its rental history."""
+    rentals = request.config.getoption("rentals")
+    path = tmp_path_factory.getbasetemp() / f"fleet_{rentals}.db"
+    if not path.exists():
+        build_database(str(path), FLEET_CLIENTS, bikes=FLEET_BIKES, rentals=rentals)
+    return str(path)
+
+
+def _copy_database(path, tmp_path):
+    copy = str(tmp_path / "copy.db")
+    source, target = sqlite3.connect(path), sqlite3.connect(copy)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+    return copy
+
+
+@pytest.fixture
+def database_copy(database, tmp_path):
+    """Path of a copy of database that the test may write to."""
+    return _copy_database(database, tmp_path)
+
+
+def _rental_service(path):
+    conn = open_connection(path)
+    clients = ClientService(ClientRepository(conn))
+    yield RentalService(BikeRepository(conn), RentalRepository(conn), clients, clock=lambda: NOW)
+    conn.close()
+
+
+@pytest.fixture
+def rental_service(fleet_database):
+    yield from _rental_service(fleet_database)
+
+
+@pytest.fixture
+def writing_rental_service(fleet_database, tmp_path):
+    yield from _rental_service(_copy_database(fleet_database, tmp_path))
+
+
+@pytest.fixture
+def client_count(request):
+    return request.node.callspec.params["database"]
+
+
+@pytest.fixture
+def connection(database):
+    conn = open_connection(database)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def client_repo(connection):
+    return ClientRepository(connection)
+
+
+def _client_service(client_repo, cached):
+    cache = ClientCache(client_repo.data_version) if cached else None
+    return ClientService(client_repo, cache)
+
+
+@pytest.fixture(params=[False, True], ids=["db", "cache"])
+def client_service(request, client_repo):
+    return _client_service(client_repo, request.param)
+
+
+@pytest.fixture(params=[False, True], ids=["db", "cache"])
+def writing_client_service(request, database_copy):
+    conn = open_connection(database_copy)
+    yield _client_service(ClientRepository(conn), request.param)
+    conn.close()
+
+
+def _peak_kib(fn, args):
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.fixture
+def measure(benchmark, request):
+    """Benchmark fn(*args) for rows rows per call and check it against BUDGETS.
+
+    With setup, fn is called as fn(*setup()) in rounds rounds and the setup is
+    not timed; use it for calls that can't run twice on the same data.
+    """
+    def run(fn, *args, rows=1, setup=None, rounds=5):
+        if setup is None:
+            result = benchmark(fn, *args)
+        else:
+            result = benchmark.pedantic(fn, setup=lambda: (setup(), {}), rounds=rounds)
+        if benchmark.disabled:
+            return result
+
+        mean = benchmark.stats.stats.mean
+        peak = _peak_kib(fn, setup() if setup is not None else args)
+        benchmark.extra_info["rows_per_second"] = round(rows / mean)
+        benchmark.extra_info["peak_kib"] = round(peak)
+
+        max_seconds, max_kib = BUDGETS[request.node.originalname]
+        assert mean / rows <= max_seconds, \
+            f"{mean / rows * 1e6:.1f} us per row, budget is {max_seconds * 1e6:.1f} us"
+        assert peak <= max_kib, f"peak {peak:.0f} KiB, budget is {max_kib} KiB"
+        return result
+
+    return run
+
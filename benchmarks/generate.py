@@ -0,0 +1,140 @@
+"""Deterministic synthetic clients, bikes and rentals for the benchmarks.
+
+The same counts and seed always give the same rows, so timings of different
+runs are comparable. Build a database from the command line with:
+
+    python -m benchmarks.generate 100000 bench_100k.db --bikes 5000 --rentals 1000000
+"""
+import argparse
+import os
+import random
+import time
+from itertools import islice
+
+from migrations import migrate
+from repositories import BikeRepository, ClientRepository, RentalRepository, open_connection
+from validation import RENTAL_TYPES
+
+SEED = 2024
+SIZES = (10_000, 100_000, 1_000_000)
+
+# "Now" of the generated rental history (2024-06-01 10:00 UTC); pass it as the
+# clock of RentalService so the open rentals are not all overdue
+NOW = 1_717_236_000
+HOUR = 3600
+
+FIRST_NAMES = ("Anna", "Bram", "Daan", "Emma", "Fenna", "Guus", "Hugo", "Iris", "Jan", "Julia",
+               "Lars", "Lotte", "Milan", "Noah", "Olivia", "Pieter", "Sanne", "Sem", "Tess", "Vera",
+               "Willem", "Yara", "Zoe", "Luuk", "Mila", "Finn", "Sophie", "Ruben", "Eva", "Thijs")
+LAST_NAMES = ("de Jong", "Jansen", "de Vries", "van den Berg", "van Dijk", "Bakker", "Janssen",
+              "Visser", "Smit", "Meijer", "de Boer", "Mulder", "de Groot", "Bos", "Vos", "Peters",
+              "Hendriks", "van Leeuwen", "Dekker", "Brouwer", "de Wit", "Dijkstra", "Smits",
+              "de Graaf", "van der Meer", "Stouten", "Kok", "Jacobs", "Vermeulen", "van Dam")
+DOMAINS = ("example.com", "mail.nl", "fietsverhuur.nl", "post.nl", "test.org")
+
+# The dummy clients of the first migration use other prefixes, so these never collide
+PHONE_PREFIX = "065"
+FREE_PHONE_PREFIX = "066"  # never generated, for lookups of unregistered phones
+
+
+def phone_for(i: int) -> str:
+    return f"{PHONE_PREFIX}{i:07d}"
+
+
+def free_phone_for(i: int) -> str:
+    return f"{FREE_PHONE_PREFIX}{i:07d}"
+
+
+def generate_clients(count: int, seed: int = SEED, start: int = 0):
+    """Yield count (name, email, phone, rental_type) rows; phone i is phone_for(start + i)."""
+    rng = random.Random(seed + start)
+    for i in range(start, start + count):
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        email = f"{first}.{last.replace(' ', '')}{i}@{rng.choice(DOMAINS)}".lower()
+        yield f"{first} {last}", email, phone_for(i), rng.choice(RENTAL_TYPES)
+
+
+def generate_bikes(count: int):
+    # One in three bikes is electric
+    for i in range(count):
+        yield f"F{i:05d}", RENTAL_TYPES[1] if i % 3 == 0 else RENTAL_TYPES[0]
+
+
+def generate_rentals(count: int, bike_ids, client_count: int, seed: int = SEED):
+    """Yield count (bike_id, client_id, start_at, due_at, returned_at) rows ending at NOW.
+
+    Every bike gets an equal share of back-to-back history; about a third of
+    the bikes are out at NOW with an open rental.
+    """
+    rng = random.Random(seed)
+    per_bike, extra = divmod(count, len(bike_ids))
+    for index, bike_id in enumerate(bike_ids):
+        rentals = per_bike + (index < extra)
+        end = NOW - rng.randrange(0, 4 * HOUR)
+        history = []
+        for _ in range(rentals):
+            duration = rng.randrange(1, 9) * HOUR
+            start = end - duration - rng.randrange(0, 12 * HOUR)
+            history.append([bike_id, rng.randrange(1, client_count + 1), start, start + duration, end])
+            end = start - rng.randrange(0, 24 * HOUR)
+        if history and rng.random() < 1 / 3:
+            # The most recent rental is still out
+            latest = history[0]
+            latest[2] = NOW - rng.randrange(1, 4) * HOUR
+            latest[3] = latest[2] + rng.randrange(2, 9) * HOUR
+            latest[4] = None
+        yield from map(tuple, reversed(history))
+
+
+def build_database(path: str, count: int, seed: int = SEED, batch_size: int = 50_000,
+                   bikes: int = 0, rentals: int = 0) -> str:
+    """Create a migrated database at path with count generated clients.
+
+    With bikes, the fleet gets that many generated bikes and rentals rows of
+    rental history.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    conn = open_connection(path)
+    try:
+        migrate(conn)
+        clients = ClientRepository(conn)
+        rows = generate_clients(count, seed)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            clients.add_many(batch)
+        if bikes:
+            BikeRepository(conn).add_many(list(generate_bikes(bikes)))
+            bike_ids = [row[0] for row in conn.execute("SELECT id FROM bikes WHERE code LIKE 'F%' ORDER BY id")]
+            history = generate_rentals(rentals, bike_ids, count, seed)
+            while True:
+                batch = list(islice(history, batch_size))
+                if not batch:
+                    break
+                RentalRepository(conn).add_many(batch)
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maak een database met gegenereerde klanten")
+    parser.add_argument("count", type=int, help=f"aantal klanten, bijvoorbeeld {', '.join(map(str, SIZES))}")
+    parser.add_argument("path", help="pad van de nieuwe database")
+    parser.add_argument("--bikes", type=int, default=0, help="aantal fietsen")
+    parser.add_argument("--rentals", type=int, default=0, help="aantal verhuringen in de geschiedenis")
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    build_database(args.path, args.count, args.seed, bikes=args.bikes, rentals=args.rentals)
+    print(f"{args.count} klanten in {args.path} ({time.perf_counter() - started:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Streaming export of the clients table to xlsx, csv or parquet.
+
+Rows are read from the database in batches and written straight to the output
+file, so memory use stays flat no matter how many clients there are. The
+export is meant to run in a background thread: it reports progress through a
+callback and stops between batches when its cancel event is set.
+"""
+import csv
+import os
+
+from storage import DATABASE_URL, client_session
+
+# Column name in the database -> header in the exported file
+EXPORT_COLUMNS = {
+    "id": "ID",
+    "name": "Name",
+    "email": "Email",
+    "phone": "Phone",
+    "rental_type": "Rental Type",
+}
+
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+
+BATCH_SIZE = 5000
+
+# An xlsx sheet holds at most 1,048,576 rows; larger exports continue on
+# "Clients 2", "Clients 3", ... below a header of their own
+XLSX_SHEET_ROWS = 1_048_575  # data rows, without the header
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class _XlsxWriter:
+    def __init__(self, path, headers):
+        # openpyxl is only needed for exports, so it is imported here
+        from openpyxl import Workbook
+
+        self.path = path
+        self.headers = headers
+        # Write-only mode streams rows to disk instead of building the sheet in memory
+        self.workbook = Workbook(write_only=True)
+        self.sheets = 0
+        self.new_sheet()
+
+    def new_sheet(self):
+        self.sheets += 1
+        self.sheet = self.workbook.create_sheet("Clients" if self.sheets == 1 else f"Clients {self.sheets}")
+        self.sheet.append(self.headers)
+        self.rows_left = XLSX_SHEET_ROWS
+
+    def write(self, rows):
+        for row in rows:
+            if not self.rows_left:
+                self.new_sheet()
+            self.sheet.append(row)
+            self.rows_left -= 1
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class _CsvWriter:
+    def __init__(self, path, headers):
+        # utf-8-sig so Excel opens names with accents correctly
+        self.file = open(path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(headers)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path, headers, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Voor Parquet export is het pakket 'pyarrow' nodig")
+
+        self.pa = pa
+        self.headers = headers
+        types = {"id": pa.int64()}
+        self.schema = pa.schema([(header, types.get(column, pa.string()))
+                                 for column, header in zip(columns, headers)])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        # Each batch becomes one row group
+        arrays = [self.pa.array(values, type=field.type)
+                  for values, field in zip(zip(*rows), self.schema)]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def _open_writer(path, fmt, columns):
+    headers = [EXPORT_COLUMNS[column] for column in columns]
+    if fmt == "xlsx":
+        return _XlsxWriter(path, headers)
+    if fmt == "csv":
+        return _CsvWriter(path, headers)
+    if fmt == "parquet":
+        return _ParquetWriter(path, headers, columns)
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+def export_clients(path, fmt="xlsx", columns=None, rental_type=None, progress=None,
+                   cancel_event=None, batch_size=BATCH_SIZE, db_path=DATABASE_URL):
+    """Export clients to path and return the number of rows written.
+
+    columns is a list of keys from EXPORT_COLUMNS (default: all of them) and
+    rental_type optionally limits the export to one rental type. progress is
+    called as progress(done, total) after every batch. Setting cancel_event
+    stops the export, removes the partial file and raises ExportCancelled.
+    db_path is a SQLite file or a postgresql:// URL (see storage.py).
+    """
+    columns = list(columns or EXPORT_COLUMNS)
+    if not columns:
+        raise ValueError("Select at least one column to export")
+
+    # A dedicated connection: the export runs in its own thread and reads one
+    # consistent snapshot while the terminal keeps working
+    writer = None
+    with client_session(db_path, snapshot=True) as clients:
+        try:
+            total = clients.count(rental_type)
+            done = 0
+            writer = _open_writer(path, fmt, columns)
+            for rows in clients.iter_batches(columns, rental_type, batch_size):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ExportCancelled()
+                writer.write(rows)
+                done += len(rows)
+                if progress is not None:
+                    progress(done, total)
+            writer.close()
+            writer = None
+            return done
+        except BaseException:
+            if writer is not None:
+                try:
+                    writer.close()
+                finally:
+                    if os.path.exists(path):
+                        os.remove(path)
+            raise
@@ -0,0 +1,149 @@
+"""Bulk import of clients from csv or xlsx files.
+
+The file is read in batches and every batch goes through
+ClientService.register_many: it is validated column by column, phone numbers
+are checked against the rest of the file and the database in one set-based
+query, and the valid rows are inserted with executemany in a single
+transaction. Rejected rows are collected with their line number and reason.
+"""
+import csv
+import os
+from typing import List, NamedTuple, Optional
+
+from rental_service import ClientService, RejectedRow
+from storage import DATABASE_URL, client_session
+
+BATCH_SIZE = 5000
+
+IMPORT_COLUMNS = ("name", "email", "phone", "rental_type")
+
+# Accepted headers, lower case: database column names and the export headers
+HEADER_ALIASES = {
+    "name": "name", "naam": "name",
+    "email": "email",
+    "phone": "phone", "telefoon": "phone",
+    "rental_type": "rental_type", "rental type": "rental_type", "type fiets": "rental_type",
+}
+
+
+class ImportResult(NamedTuple):
+    imported: int
+    rejected: List[RejectedRow]
+    report_path: Optional[str] = None  # where the rejected rows were written, if any
+
+
+def _read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.reader(f)
+
+
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        # A phone typed as a number loses its leading 0 in Excel: 0612345678
+        # is stored as 612345678, and sometimes as 612345678.0
+        text = str(value)
+        return "0" + text if len(text) == 9 else text
+    return str(value)
+
+
+def _read_xlsx(path):
+    # openpyxl is only needed for imports, so it is imported here
+    from openpyxl import load_workbook
+
+    # Read-only mode streams the sheet instead of loading it into memory
+    workbook = load_workbook(path, read_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield [_cell_text(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def _read_rows(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return _read_csv(path)
+    if extension in (".xlsx", ".xlsm"):
+        return _read_xlsx(path)
+    raise ValueError(f"Onbekend bestandstype: {extension}")
+
+
+def _column_positions(header):
+    positions = {}
+    for index, title in enumerate(header):
+        column = HEADER_ALIASES.get(str(title).strip().lower())
+        if column is not None and column not in positions:
+            positions[column] = index
+    missing = [column for column in IMPORT_COLUMNS if column not in positions]
+    if missing:
+        raise ValueError(f"Kolommen ontbreken in het bestand: {', '.join(missing)}")
+    return [positions[column] for column in IMPORT_COLUMNS]
+
+
+def _batches(rows, positions, batch_size):
+    # Yields lists of (line number, (name, email, phone, rental_type))
+    batch = []
+    for line, row in enumerate(rows, start=2):
+        values = tuple(row[index].strip() if index < len(row) else "" for index in positions)
+        if not any(values):
+            continue  # skip empty lines
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_clients(path, progress=None, cancel_event=None, batch_size=BATCH_SIZE, db_path=DATABASE_URL,
+                   report_path=None):
+    """Import clients from a csv or xlsx file and return an ImportResult.
+
+    The first row must be a header with name, email, phone and rental type
+    columns. progress is called as progress(imported, rejected) after every
+    batch. Setting cancel_event stops the import after the current batch.
+    Batches that were committed stay imported if the import stops early.
+    db_path is a SQLite file or a postgresql:// URL (see storage.py).
+
+    With report_path the rejected rows are written there as well, see
+    write_rejected_report; a large report is written in the import's own
+    thread instead of the caller's.
+    """
+    rows = iter(_read_rows(path))
+    header = next(rows, None)
+    if header is None:
+        return ImportResult(0, [])
+    positions = _column_positions(header)
+
+    # Own connection, the import runs in a background thread
+    with client_session(db_path) as repository:
+        clients = ClientService(repository)
+        seen_phones = set()
+        imported = 0
+        rejected = []
+        for batch in _batches(rows, positions, batch_size):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            lines, values = zip(*batch)
+            count, batch_rejected = clients.register_many(values, lines, seen_phones)
+            imported += count
+            rejected.extend(batch_rejected)
+            if progress is not None:
+                progress(imported, len(rejected))
+    if rejected and report_path is not None:
+        write_rejected_report(report_path, rejected)
+        return ImportResult(imported, rejected, report_path)
+    return ImportResult(imported, rejected)
+
+
+def write_rejected_report(path, rejected):
+    # Writes the rejected rows as csv so they can be corrected and imported again
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        writer.writerow(("regel", "reden") + IMPORT_COLUMNS)
+        for row in rejected:
+            writer.writerow((row.line, row.reason) + tuple(row.row))
@@ -1,11 +1,71 @@
+import startup  # first, so the startup report includes the other imports
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox
+import logging
+import os
 import sqlite3
-import re
-from hashlib import sha256
-import pandas as pd
-import openpyxl
+import threading
+from datetime import date, datetime, timedelta
+from functools import partial
 
+# exporter, importer, backup, archive and tkinter.filedialog are only used by
+# admins and are imported when first needed, to keep them out of the startup time
+import metrics
+from rental_service import (AuthService, ClientCache, ClientEdits, ClientService, RentalService, ReportService,
+                            ServiceError)
+from storage import DATABASE_URL, get_storage, is_postgres
+from validation import RENTAL_TYPES, is_valid_email
+from workers import TaskRunner, io_executor, kdf_executor
+
+logger = logging.getLogger(__name__)
+
+# Milliseconds between writes of the metrics file, when metrics are enabled
+METRICS_WRITE_MS = 15000
+
+# Number of clients fetched per page for the client list
+CLIENT_PAGE_SIZE = 200
+# The client list holds at most this many pages; rows at the far end from
+# where the user is scrolling are dropped and fetched again when needed
+CLIENT_PAGES_KEPT = 5
+
+# Milliseconds to wait after the last keystroke before searching
+SEARCH_DEBOUNCE_MS = 250
+
+# Milliseconds between checks of the change journal for changes made on other terminals
+CHANGE_POLL_MS = 500
+
+# Entries of the change journal kept when the application starts; a terminal
+# that falls further behind reloads its list
+CHANGES_KEPT = 100000
+
+# Times in the rental screens are entered as "14:00" (today) or "2024-06-01 14:00"
+TIME_FORMATS = ("%H:%M", "%Y-%m-%d %H:%M")
+DEFAULT_RENTAL_HOURS = 3
+
+# Rental type filter value that exports every client
+ALL_RENTAL_TYPES = "Alle"
+
+
+def parse_time(text, today=None):
+    """Return the unix time of "HH:MM" today or "YYYY-MM-DD HH:MM", or None."""
+    text = text.strip()
+    today = today or datetime.now()
+    for fmt in TIME_FORMATS:
+        try:
+            value = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+        if fmt == "%H:%M":
+            value = today.replace(hour=value.hour, minute=value.minute, second=0, microsecond=0)
+        return int(value.timestamp())
+    return None
+
+
+def format_time(timestamp):
+    value = datetime.fromtimestamp(timestamp)
+    if value.date() == datetime.now().date():
+        return value.strftime("%H:%M")
+    return value.strftime("%Y-%m-%d %H:%M")
 
 
 class LoginWindow(tk.Tk):
@@ -18,14 +78,26 @@ class LoginWindow(tk.Tk):
         # Center the window
         self.center_window()
 
-        # Create database and tables
-        self.conn = sqlite3.connect('bike_rental.db')
-        self.cursor = self.conn.cursor()
-        self.create_tables() # Creates tables needed to run and use the application
-        self.create_admin_account()  # Creates default admin account if it doesn't exist
+        self.auth = None
+        self.tasks = TaskRunner(self)
 
         # Create login form
         self.create_login_form()
+        startup.mark("login form created")
+        self.after_idle(startup.mark, "first frame")
+
+        # Open the database and bring the schema up to date in the background,
+        # login is possible once it is done
+        self.tasks.submit(open_database, on_success=self.on_database_ready, on_error=self.on_database_error,
+                          busy=False)
+        if metrics.ENABLED:
+            self.after(METRICS_WRITE_MS, self.write_metrics)
+
+    def write_metrics(self):
+        # For the Prometheus node exporter's textfile collector
+        self.tasks.submit(metrics.write_prometheus, busy=False, executor=io_executor,
+                          on_error=lambda e: logger.warning("Could not write metrics: %s", e))
+        self.after(METRICS_WRITE_MS, self.write_metrics)
 
     def center_window(self):
         screen_width = self.winfo_screenwidth()
@@ -36,39 +108,6 @@ class LoginWindow(tk.Tk):
         y = (screen_height - window_height) // 2
         self.geometry(f"{window_width}x{window_height}+{x}+{y}")
 
-    def create_tables(self):
-        # Create employees table
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS employees (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            is_admin BOOLEAN DEFAULT 0
-        )""")
-        self.conn.commit()
-
-    def create_admin_account(self):
-        # Create default admin account if it doesn't exist
-        admin_username = "admin"
-        admin_password = "admin123"
-        employee_username = "employee"
-        employee_password = "employee123"
-        hashed_admin_password = sha256(admin_password.encode()).hexdigest()
-        hashed_employee_password = sha256(employee_password.encode()).hexdigest()
-
-        accounts = [
-            (admin_username, hashed_admin_password, 1),
-            (employee_username, hashed_employee_password, 0)
-        ]
-
-        try:
-            self.cursor.executemany("""
-            INSERT OR IGNORE INTO employees (username, password, is_admin) 
-            VALUES (?, ?, ?)""", accounts)
-            self.conn.commit()
-        except sqlite3.Error as e:
-            print(f"Fout bij het maken van admin-account: {e}")
-
     def create_login_form(self):
         # Create main frame
         main_frame = tk.Frame(self, bg="#f0f0f0", padx=20, pady=20)
@@ -101,18 +140,32 @@ class LoginWindow(tk.Tk):
         self.password_entry = tk.Entry(password_frame, show="*", font=("Arial", 12))
         self.password_entry.pack(fill="x", pady=(5, 0))
 
-        # Login button
-        login_button = tk.Button(main_frame, text="Login",
-                                 command=self.login,
-                                 bg="#4CAF50", fg="white",
-                                 font=("Arial", 12, "bold"),
-                                 padx=30, pady=5)
-        login_button.pack(pady=20)
+        # Login button, enabled once the database is ready
+        self.login_button = tk.Button(main_frame, text="Login",
+                                      command=self.login,
+                                      bg="#4CAF50", fg="white",
+                                      font=("Arial", 12, "bold"),
+                                      padx=30, pady=5, state=tk.DISABLED)
+        self.login_button.pack(pady=20)
 
         # Bind Enter key to login function
         self.bind('<Return>', lambda event: self.login())
 
+    def on_database_ready(self, storage):
+        self.auth = AuthService(storage.employees)
+        self.login_button.config(state=tk.NORMAL)
+        startup.mark("database ready")
+
+    def on_database_error(self, error):
+        messagebox.showerror("Error", f"Database error: {error}")
+        self.tasks.close()
+        self.destroy()
+
+    @metrics.timed
     def login(self):
+        if self.auth is None or self.tasks.busy:
+            return  # Database not ready yet or a login is already being checked
+
         username = self.username_entry.get()
         password = self.password_entry.get()
 
@@ -120,31 +173,46 @@ class LoginWindow(tk.Tk):
             messagebox.showerror("Error", "Vul alle velden in")
             return
 
-        hashed_password = sha256(password.encode()).hexdigest()
-
-        try:
-            self.cursor.execute("""
-            SELECT id, username, is_admin FROM employees 
-            WHERE username = ? AND password = ?""", (username, hashed_password))
-
-            employee = self.cursor.fetchone()
+        # AuthService.login in three steps: only the lookup and saving a new
+        # hash use the database thread, the password check (scrypt) runs apart
+        self.login_button.config(state=tk.DISABLED)
+        self.tasks.submit(self.auth.lookup, username,
+                          on_success=partial(self.on_credentials_found, username, password),
+                          on_error=self.on_login_error)
+
+    def on_credentials_found(self, username, password, credentials):
+        self.tasks.submit(self.auth.verify, username, password, credentials, executor=kdf_executor,
+                          on_success=self.on_password_checked, on_error=self.on_login_error)
+
+    def on_password_checked(self, result):
+        employee, new_hash = result
+        if new_hash is None:
+            self.on_login_checked(employee)
+            return
+        self.tasks.submit(self.auth.save_hash, employee.id, new_hash,
+                          on_success=lambda _: self.on_login_checked(employee), on_error=self.on_login_error)
+
+    def on_login_checked(self, employee):
+        self.login_button.config(state=tk.NORMAL)
+        if employee:
+            self.withdraw()  # Hide login window
+            bike_rental_app = BikeRentalApp(employee, self)
+            bike_rental_app.protocol("WM_DELETE_WINDOW",
+                                     lambda: self.on_rental_app_close(bike_rental_app))
+        else:
+            messagebox.showerror("Error", "Ongeldige gebruikersnaam of wachtwoord")
 
-            if employee:
-                self.withdraw()  # Hide login window
-                bike_rental_app = BikeRentalApp(employee, self)
-                bike_rental_app.protocol("WM_DELETE_WINDOW",
-                                         lambda: self.on_rental_app_close(bike_rental_app))
-            else:
-                messagebox.showerror("Error", "Ongeldige gebruikersnaam of wachtwoord")
-        except sqlite3.Error as e:
-            messagebox.showerror("Error", f"Database error: {e}")
+    def on_login_error(self, error):
+        self.login_button.config(state=tk.NORMAL)
+        if isinstance(error, ServiceError):
+            messagebox.showerror("Error", str(error))  # too many attempts
+        else:
+            messagebox.showerror("Error", f"Database error: {error}")
 
     def on_rental_app_close(self, rental_app):
-        rental_app.destroy()
-        self.deiconify()  # Show login window again
-        self.username_entry.delete(0, tk.END)
-        self.password_entry.delete(0, tk.END)
-        self.username_entry.focus()
+        # Also stops the change polling; shows the login window again. Logging
+        # in again within a few minutes skips the password hashing (AuthService)
+        rental_app.on_closing()
 
 
 class BikeRentalApp(tk.Toplevel):
@@ -169,15 +237,50 @@ class BikeRentalApp(tk.Toplevel):
                                        padx=10, pady=5)
         self.logout_button.pack(side=tk.RIGHT, padx=20)
 
+        # Busy indicator, shown while database or file work is running
+        self.busy_frame = tk.Frame(self.top_frame, bg="#f0f0f0")
+        self.busy_bar = ttk.Progressbar(self.busy_frame, mode="indeterminate", length=120)
+        self.busy_bar.pack(side=tk.LEFT, padx=5)
+        tk.Button(self.busy_frame, text="Annuleer", command=self.cancel_work,
+                  font=("Arial", 10), padx=5, pady=2).pack(side=tk.LEFT, padx=5)
+
+        self.rental_button = tk.Button(self.top_frame, text="Verhuur",
+                                       command=self.open_rental_dialog,
+                                       bg="#4CAF50", fg="white",
+                                       font=("Arial", 10),
+                                       padx=10, pady=5)
+        self.rental_button.pack(side=tk.RIGHT, padx=20)
+
         # Add export button for admin users
         if self.employee[2]:  # Check if user is admin
-            self.export_button = tk.Button(self.top_frame, text="Exporteer naar Excel",
-                                           command=self.export_to_excel,
+            self.export_button = tk.Button(self.top_frame, text="Exporteer klanten",
+                                           command=self.open_export_dialog,
                                            bg="#2196F3", fg="white",
                                            font=("Arial", 10),
                                            padx=10, pady=5)
             self.export_button.pack(side=tk.RIGHT, padx=20)
 
+            self.dashboard_button = tk.Button(self.top_frame, text="Dashboard",
+                                              command=self.open_dashboard,
+                                              bg="#2196F3", fg="white",
+                                              font=("Arial", 10),
+                                              padx=10, pady=5)
+            self.dashboard_button.pack(side=tk.RIGHT, padx=20)
+
+            self.import_button = tk.Button(self.top_frame, text="Importeer klanten",
+                                           command=self.import_clients,
+                                           bg="#2196F3", fg="white",
+                                           font=("Arial", 10),
+                                           padx=10, pady=5)
+            self.import_button.pack(side=tk.RIGHT, padx=20)
+
+            self.maintenance_button = tk.Button(self.top_frame, text="Onderhoud",
+                                                command=self.open_maintenance_dialog,
+                                                bg="#2196F3", fg="white",
+                                                font=("Arial", 10),
+                                                padx=10, pady=5)
+            self.maintenance_button.pack(side=tk.RIGHT, padx=20)
+
         self.form_frame = tk.Frame(self, bg="#f0f0f0", padx=20)
         self.form_frame.pack(side=tk.LEFT, pady=20, fill=tk.BOTH, expand=True)
 
@@ -187,10 +290,13 @@ class BikeRentalApp(tk.Toplevel):
         # Initialize scrollable frame for client list
         self.init_client_list_frame()
 
-        # Create database connection
-        self.conn = sqlite3.connect('bike_rental.db')
-        self.cursor = self.conn.cursor()
-        self.create_table()
+        # Use the shared storage of the process; queries run on the database thread.
+        # Lookups by id and phone are cached until this window closes
+        storage = get_storage()
+        self.clients = ClientService(storage.clients, ClientCache(storage.clients.data_version))
+        self.rentals = RentalService(storage.bikes, storage.rentals, self.clients)
+        self.reports = ReportService(storage.reports)
+        self.tasks = TaskRunner(self, on_busy_changed=self.on_busy_changed, on_error=self.show_error)
 
         # Create form fields
         tk.Label(self.top_frame, text="Klant Registratie", font=("Arial", 18), bg="#f0f0f0").pack(side=tk.LEFT)
@@ -208,7 +314,7 @@ class BikeRentalApp(tk.Toplevel):
         self.phone_entry.grid(row=2, column=1, padx=10, pady=10)
 
         tk.Label(self.form_frame, text="Type Fiets:", bg="#f0f0f0").grid(row=3, column=0, padx=10, pady=10, sticky="e")
-        self.rental_type = ttk.Combobox(self.form_frame, values=["Bike", "Electric Bike"], font=("Arial", 12))
+        self.rental_type = ttk.Combobox(self.form_frame, values=RENTAL_TYPES, font=("Arial", 12))
         self.rental_type.grid(row=3, column=1, padx=10, pady=10)
 
         self.register_button = tk.Button(self.form_frame, text="Registreer Klant", command=self.register_client,
@@ -225,138 +331,236 @@ class BikeRentalApp(tk.Toplevel):
 
         self.register_button.grid(row=6, column=0, columnspan=2, padx=10, pady=20)
 
+        # Buttons that start database work, disabled while work is in flight
+        self.action_buttons = [self.register_button, self.update_button, self.remove_button,
+                               self.edit_mode_button, self.apply_form_button, self.queue_remove_button,
+                               self.save_edits_button]
+        if self.employee[2]:
+            self.action_buttons.append(self.import_button)
+
+        self.bind("<Control-z>", lambda event: self.undo_edit())
+        self.bind("<Control-y>", lambda event: self.redo_edit())
+
+        # Hidden metrics panel for admins, see metrics.py
+        if self.employee[2] and metrics.ENABLED:
+            self.bind("<Control-Shift-M>", lambda event: MetricsDialog(self))
+
+        # Changes made on other terminals are read from the change journal and
+        # patched into the list. The journal position is read before the
+        # first page, so nothing changed in between is missed
+        self.change_seq = None
+        self.change_poll_pending = False
+        self.tasks.submit(self.clients.latest_change, busy=False, on_success=self.set_change_seq)
+        self.tasks.submit(self.clients.phone_conflicts, busy=False, on_success=self.show_phone_conflicts)
+        self.change_poll_id = self.after(CHANGE_POLL_MS, self.poll_changes)
+
         # Initial update of client list
         self.update_client_list()
 
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
     def log_out(self):
-        self.destroy()
-        LoginWindow()
+        # Return to the existing login window instead of creating a new one
+        self.on_closing()
 
     def on_closing(self):
+        if self.edits is not None and len(self.edits) and not messagebox.askyesno(
+                "Niet opgeslagen", "Er zijn niet opgeslagen wijzigingen. Toch sluiten?", parent=self):
+            return
+        self.after_cancel(self.change_poll_id)
+        self.tasks.close()
         self.destroy()
         self.login_window.deiconify()  # Show login window
         self.login_window.username_entry.delete(0, tk.END)
         self.login_window.password_entry.delete(0, tk.END)
         self.login_window.username_entry.focus()
 
-    def export_to_excel(self):
-        try:
-            # Fetch all clients from database
-            self.cursor.execute("SELECT id, name, email, phone, rental_type FROM clients")
-            clients = self.cursor.fetchall()
+    def open_export_dialog(self):
+        ExportDialog(self)
 
-            if not clients:
-                messagebox.showinfo("Info", "Geen klanten om te exporteren")
-                return
+    def open_rental_dialog(self):
+        RentalDialog(self, self.rentals)
+
+    def open_dashboard(self):
+        DashboardDialog(self, self.reports)
 
-            # Create DataFrame
-            df = pd.DataFrame(clients, columns=['ID', 'Name', 'Email', 'Phone', 'Rental Type'])
+    def open_maintenance_dialog(self):
+        MaintenanceDialog(self)
 
-            # Ask user for save location
-            file_path = filedialog.asksaveasfilename(
-                defaultextension='.xlsx',
-                filetypes=[("Excel files", "*.xlsx")],
-                initialfile="bike_rental_clients.xlsx"
-            )
+    def on_busy_changed(self, busy):
+        state = tk.DISABLED if busy else tk.NORMAL
+        for button in self.action_buttons:
+            button.config(state=state)
+        if busy:
+            self.busy_frame.pack(side=tk.RIGHT, padx=20)
+            self.busy_bar.start(15)
+        else:
+            self.busy_bar.stop()
+            self.busy_frame.pack_forget()
+
+    def cancel_work(self):
+        self.tasks.cancel_all(busy_only=True)
+
+    def show_error(self, error):
+        # Default error handler for background work
+        if isinstance(error, ServiceError):
+            messagebox.showerror("Error", str(error), parent=self)
+        elif isinstance(error, sqlite3.Error):
+            messagebox.showerror("Error", f"Database error: {error}", parent=self)
+        else:
+            messagebox.showerror("Error", "Er is een onverwachte fout opgetreden", parent=self)
+            logger.error("Unexpected error", exc_info=error)
+        metrics.count_error("ui")
 
-            if file_path:
-                # Export to Excel
-                df.to_excel(file_path, index=False, sheet_name='Clients')
-                messagebox.showinfo("Success", "Klantgegevens succesvol geëxporteerd!")
-        except Exception as e:
-            messagebox.showerror("Error", f"Er is een fout opgetreden bij het exporteren: {str(e)}")
+    def import_clients(self):
+        from tkinter import filedialog
+        from importer import import_clients
 
-    def init_client_list_frame(self):
-        # Create a canvas and scrollbar for the client list
-        self.client_canvas = tk.Canvas(self.client_list_frame, bg="#f0f0f0")
-        self.scrollbar = ttk.Scrollbar(self.client_list_frame, orient=tk.VERTICAL, command=self.client_canvas.yview)
-
-        # Create a frame inside the canvas to hold the client list
-        self.scrollable_frame = tk.Frame(self.client_canvas, bg="#f0f0f0")
-        self.scrollable_frame.bind(
-            "<Configure>",
-            lambda e: self.client_canvas.configure(scrollregion=self.client_canvas.bbox("all"))
+        file_path = filedialog.askopenfilename(
+            parent=self,
+            filetypes=[("Excel/CSV files", "*.xlsx *.csv"), ("Excel files", "*.xlsx"), ("CSV files", "*.csv")]
         )
+        if not file_path:
+            return
 
-        # Create window inside canvas to hold the scrollable frame
-        self.client_canvas.create_window((0, 0), window=self.scrollable_frame, anchor="nw")
-        self.client_canvas.configure(yscrollcommand=self.scrollbar.set)
+        # The rejected rows are written next to the file by the import task,
+        # a large report would otherwise freeze the window
+        report_path = os.path.splitext(file_path)[0] + "_afgewezen.csv"
+        cancel_event = threading.Event()
+        self.tasks.submit(partial(import_clients, file_path, cancel_event=cancel_event, report_path=report_path),
+                          on_success=self.on_import_done,
+                          on_error=lambda e: messagebox.showerror(
+                              "Error", f"Er is een fout opgetreden bij het importeren: {e}", parent=self),
+                          # Batches imported before cancelling stay, so show them
+                          on_cancelled=self.update_client_list,
+                          executor=io_executor, cancel_event=cancel_event)
+
+    def on_import_done(self, result):
+        # Refresh the list once for the whole import
+        self.update_client_list()
+        message = f"{result.imported} klanten geïmporteerd."
+        if result.report_path is not None:
+            message += f"\n{len(result.rejected)} regels afgewezen, zie {result.report_path}"
+        messagebox.showinfo("Import", message, parent=self)
 
-        # Pack the canvas and scrollbar
-        self.client_canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    def init_client_list_frame(self):
+        # Header above the client list
+        tk.Label(self.client_list_frame, text="Geregistreerde Klanten", font=("Arial", 16),
+                 bg="#f0f0f0").pack(side=tk.TOP, pady=10)
+
+        # Search box, searches while typing
+        search_frame = tk.Frame(self.client_list_frame, bg="#f0f0f0")
+        search_frame.pack(side=tk.TOP, fill=tk.X, pady=(0, 10))
+        tk.Label(search_frame, text="Zoeken:", bg="#f0f0f0").pack(side=tk.LEFT, padx=(0, 10))
+        self.search_entry = tk.Entry(search_frame, font=("Arial", 12))
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.search_entry.bind("<KeyRelease>", self.on_search_changed)
+        self.search_after_id = None
+        self.search_query = ""
+
+        # Clients from before the phone check that share their phone with
+        # another client; they can only be saved with another number
+        self.phone_conflicts = set()
+        self.phone_conflict_label = tk.Label(self.client_list_frame, bg="#f0f0f0", fg="#e65100")
+
+        # Remove button acts on the selected row(s) of the list
+        self.remove_button = tk.Button(self.client_list_frame, text="Verwijder geselecteerde klant",
+                                       command=self.remove_selected_client,
+                                       bg="#f44336", fg="white", font=("Arial", 10),
+                                       padx=5, pady=2)
+        self.remove_button.pack(side=tk.BOTTOM, pady=10)
+
+        # Edit mode: changes to the selected clients are queued in a
+        # ClientEdits, can be undone and are saved together in one transaction
+        self.edits = None  # ClientEdits while in edit mode
+        self.edit_mode_button = tk.Button(self.client_list_frame, text="Meerdere klanten bewerken",
+                                          command=self.toggle_edit_mode, font=("Arial", 10), padx=5, pady=2)
+        self.edit_mode_button.pack(side=tk.BOTTOM)
+        self.edit_bar = tk.Frame(self.client_list_frame, bg="#f0f0f0")
+        tk.Label(self.edit_bar, text="Selecteer klanten met Ctrl/Shift+klik:", bg="#f0f0f0").pack(side=tk.LEFT)
+        self.apply_form_button = tk.Button(self.edit_bar, text="Formulier toepassen", command=self.queue_form_edit,
+                                           font=("Arial", 10), padx=5, pady=2)
+        self.queue_remove_button = tk.Button(self.edit_bar, text="Verwijder", command=self.queue_remove,
+                                             font=("Arial", 10), padx=5, pady=2)
+        self.undo_button = tk.Button(self.edit_bar, text="Ongedaan maken", command=self.undo_edit,
+                                     font=("Arial", 10), padx=5, pady=2)
+        self.redo_button = tk.Button(self.edit_bar, text="Opnieuw", command=self.redo_edit,
+                                     font=("Arial", 10), padx=5, pady=2)
+        self.save_edits_button = tk.Button(self.edit_bar, text="Opslaan", command=self.save_edits,
+                                           bg="#4CAF50", fg="white", font=("Arial", 10), padx=5, pady=2)
+        self.discard_edits_button = tk.Button(self.edit_bar, text="Alles terugdraaien", command=self.discard_edits,
+                                              font=("Arial", 10), padx=5, pady=2)
+        for button in (self.apply_form_button, self.queue_remove_button, self.undo_button, self.redo_button,
+                       self.save_edits_button, self.discard_edits_button):
+            button.pack(side=tk.LEFT, padx=5)
+
+        # A Treeview only draws the visible rows, so it stays fast for large client tables
+        columns = ("id", "name", "email", "phone", "rental_type")
+        headings = ("ID", "Name", "Email", "Phone", "Rental")
+        self.client_tree = ttk.Treeview(self.client_list_frame, columns=columns, show="headings")
+        # Queued, not yet saved edits
+        self.client_tree.tag_configure("edited", background="#fff3c4")
+        self.client_tree.tag_configure("removed", foreground="#9e9e9e", background="#fde0dc")
+        self.client_tree.tag_configure("phone_conflict", background="#ffe0b2")
+        for column, heading in zip(columns, headings):
+            self.client_tree.heading(column, text=heading)
+            self.client_tree.column(column, width=80 if column == "id" else 200, anchor="w")
+
+        self.scrollbar = ttk.Scrollbar(self.client_list_frame, orient=tk.VERTICAL, command=self.client_tree.yview)
+        self.client_tree.configure(yscrollcommand=self.on_client_list_scroll)
+
+        self.empty_label = tk.Label(self.client_list_frame, text="Nog geen klanten geregistreerd",
+                                    bg="#f0f0f0", font=("Arial", 14))
+
+        # Pack the list and scrollbar
+        self.client_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
-    def create_table(self):
-        self.cursor.execute("""CREATE TABLE IF NOT EXISTS clients (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            name TEXT,
-                            email TEXT,
-                            phone TEXT UNIQUE,
-                            rental_type TEXT)""")
-        dummy_clients = [
-            ("Guus S", "guus@guus.com", "123", "Bike"),
-            ("John Doe", "john.doe@example.com", "0612345678", "Bike"),
-            ("Emma Smith", "emma.smith@example.com", "0687654321", "Electric Bike"),
-            ("Michael Johnson", "michael.j@example.com", "0623456789", "Bike"),
-            ("Sarah Williams", "sarah.w@example.com", "0698765432", "Electric Bike"),
-            ("David Brown", "david.brown@example.com", "0643210987", "Bike")
-        ]
-
-        # Insert dummy data
-        try:
-            self.cursor.executemany("""
-                   INSERT OR IGNORE INTO clients (name, email, phone, rental_type) 
-                   VALUES (?, ?, ?, ?)""", dummy_clients)
-            self.conn.commit()
-        except sqlite3.Error as e:
-            print(f"Error inserting dummy data: {e}")
+        # Keyset pagination state: the loaded window of ids and whether it
+        # reaches the start and the end of the table
+        self.first_loaded_id = 0
+        self.last_loaded_id = 0
+        self.start_loaded = True
+        self.all_clients_loaded = False
+        self.page_loading = False
+        # Results of list queries started before the last reset are ignored
+        self.list_generation = 0
+        self.list_task = None
 
     def is_valid_email(self, email):
-        # Regular expression for email validation
-        email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        return re.match(email_pattern, email) is not None
+        return is_valid_email(email)
 
-    def is_phone_unique(self, phone):
-        self.cursor.execute("SELECT COUNT(*) FROM clients WHERE phone = ?", (phone,))
-        count = self.cursor.fetchone()[0]
-        return count == 0
+    def read_form(self):
+        return (self.name_entry.get().strip(), self.email_entry.get().strip(),
+                self.phone_entry.get().strip(), self.rental_type.get())
 
     def register_client(self):
-        name = self.name_entry.get().strip()
-        email = self.email_entry.get().strip()
-        phone = self.phone_entry.get().strip()
-        rental_type = self.rental_type.get()
-
-        # Validate all fields are filled
-        if not all([name, email, phone, rental_type]):
-            messagebox.showerror("Error", "Voer alle velden in")
-            return
-
-        # Validate email format
-        if not self.is_valid_email(email):
-            messagebox.showerror("Error", "Vul een geldig email adres in")
-            return
+        # Look for clients that are probably the same person first; the
+        # validation and the insert run on the database thread as well
+        form = self.read_form()
+        self.tasks.submit(self.clients.duplicates, *form[:3],
+                          on_success=partial(self.confirm_register, form), on_error=self.on_register_error)
+
+    def confirm_register(self, form, duplicates):
+        if duplicates:
+            names = "\n".join(f"{client.id}: {client.name}, {client.email}, {client.phone}" for client in duplicates[:5])
+            if not messagebox.askyesno("Dubbele klant?", f"Deze klant lijkt op:\n{names}\n\nToch registreren?"):
+                return
+        self.tasks.submit(self.clients.register, *form,
+                          on_success=self.on_client_registered, on_error=self.on_register_error)
 
-        # Check if phone is unique
-        if not self.is_phone_unique(phone):
-            messagebox.showerror("Error", "Dit nummer is al geregistreerd")
-            return
+    def on_client_registered(self, client):
+        self.clear_form()
+        self.patch_client_rows({client.id: client})
+        messagebox.showinfo("Success", "Klant geregistreerd")
 
-        try:
-            self.cursor.execute("INSERT INTO clients (name, email, phone, rental_type) VALUES (?, ?, ?, ?)",
-                                (name, email, phone, rental_type))
-            self.conn.commit()
-            self.clear_form()
-            self.update_client_list()
-            messagebox.showinfo("Success", "Klant geregistreerd")
-        except sqlite3.IntegrityError as e:
+    def on_register_error(self, error):
+        if isinstance(error, sqlite3.IntegrityError):
             messagebox.showerror("Error", "Er is een fout opgetreden bij het registreren van de klant. Probeer opnieuw.")
-            print(f"Database error: {e}")
-        except Exception as e:
-            messagebox.showerror("Error", "Er is een onverwachte fout opgetreden: ")
-            print(f"Unexpected error: {e}")
+            logger.error("Database error while registering a client", exc_info=error)
+            metrics.count_error("ui")
+        else:
+            self.show_error(error)
 
     def update_client(self):
         # Get the client ID from the entry
@@ -366,46 +570,20 @@ class BikeRentalApp(tk.Toplevel):
             messagebox.showerror("Error", "Voer een geldig ID in: ")
             return
 
-        name = self.name_entry.get().strip()
-        email = self.email_entry.get().strip()
-        phone = self.phone_entry.get().strip()
-        rental_type = self.rental_type.get()
-
-        # Validate all fields are filled
-        if not all([name, email, phone, rental_type]):
-            messagebox.showerror("Error", "Vul alle velden in.")
-            return
-
-        # Validate email format
-        if not self.is_valid_email(email):
-            messagebox.showerror("Error", "Vul een geldig email adres in.")
-            return
+        self.tasks.submit(self.clients.update, client_id, *self.read_form(),
+                          on_success=self.on_client_updated, on_error=self.on_update_error)
 
-        # Check if phone is unique (excluding current client)
-        self.cursor.execute("SELECT COUNT(*) FROM clients WHERE phone = ? AND id != ?", (phone, client_id))
-        count = self.cursor.fetchone()[0]
-        if count > 0:
-            messagebox.showerror("Error", "Dit nummer is al geregistreerd")
-            return
+    def on_client_updated(self, client):
+        self.clear_form()
+        self.resolve_phone_conflicts([client.id])
+        self.patch_client_rows({client.id: client})
+        messagebox.showinfo("Success", "Klant geupdate!")
 
-        try:
-            self.cursor.execute("""
-                UPDATE clients 
-                SET name = ?, email = ?, phone = ?, rental_type = ? 
-                WHERE id = ?
-            """, (name, email, phone, rental_type, client_id))
-
-            # Check if any row was actually updated
-            if self.cursor.rowcount == 0:
-                messagebox.showerror("Error", "Geen klanten gevonden met dit ID")
-                return
-
-            self.conn.commit()
-            self.clear_form()
-            self.update_client_list()
-            messagebox.showinfo("Success", "Klant geupdate!")
-        except sqlite3.Error as e:
-            messagebox.showerror("Error", f"Er is een fout opgetreden bij het updaten van de klant. {str(e)}")
+    def on_update_error(self, error):
+        if isinstance(error, sqlite3.Error):
+            messagebox.showerror("Error", f"Er is een fout opgetreden bij het updaten van de klant. {str(error)}")
+        else:
+            self.show_error(error)
 
     def clear_form(self):
         self.name_entry.delete(0, tk.END)
@@ -413,64 +591,904 @@ class BikeRentalApp(tk.Toplevel):
         self.phone_entry.delete(0, tk.END)
         self.rental_type.set("")
 
+    def on_search_changed(self, event=None):
+        # Debounce: only search once the user stops typing
+        if self.search_after_id is not None:
+            self.after_cancel(self.search_after_id)
+        self.search_after_id = self.after(SEARCH_DEBOUNCE_MS, self.run_search)
+
+    @metrics.timed
+    def run_search(self):
+        self.search_after_id = None
+        query = self.search_entry.get().strip()
+        if query == self.search_query:
+            return
+        self.search_query = query
+        self.update_client_list()
+
+    @metrics.timed
     def update_client_list(self):
-        # Clear existing clients from scrollable frame
-        for widget in self.scrollable_frame.winfo_children():
-            widget.destroy()
+        # Start over: drop the rows and any list query that is still running
+        self.list_generation += 1
+        if self.list_task is not None:
+            self.list_task.cancel()
+        self.client_tree.delete(*self.client_tree.get_children())
+        self.first_loaded_id = 0
+        self.last_loaded_id = 0
+        self.start_loaded = True
+        self.all_clients_loaded = False
+        self.page_loading = False
+
+        if self.search_query:
+            self.list_task = self.tasks.submit(self.clients.search, self.search_query, busy=False,
+                                               on_success=partial(self.show_search_results, self.list_generation))
+            return
+
+        # Fetch the first page of clients
+        self.load_next_client_page()
+
+    def show_search_results(self, generation, clients):
+        if generation != self.list_generation:
+            return
+        for client in clients:
+            self.client_tree.insert("", tk.END, iid=str(client.id), values=client, tags=self.row_tags(client.id))
+        self.show_queued_edits(client.id for client in clients)
+        # Search results are ranked, not paginated
+        self.all_clients_loaded = True
+        self.update_empty_label()
+
+    def load_next_client_page(self):
+        if self.all_clients_loaded or self.page_loading or self.search_query:
+            return
 
-        # Fetch clients from database
-        self.cursor.execute("SELECT * FROM clients")
-        clients = self.cursor.fetchall()
+        # Keyset pagination on id, so each page is a short index range scan
+        self.page_loading = True
+        self.list_task = self.tasks.submit(self.clients.list_page, self.last_loaded_id, CLIENT_PAGE_SIZE,
+                                           busy=False,
+                                           on_success=partial(self.show_client_page, self.list_generation))
 
-        # Add header
-        header = tk.Label(self.scrollable_frame, text="Geregistreerde Klanten", font=("Arial", 16), bg="#f0f0f0")
-        header.pack(pady=10)
+    def load_previous_client_page(self):
+        # Pages dropped from the start of the list, see drop_client_rows
+        if self.start_loaded or self.page_loading or self.search_query:
+            return
+        self.page_loading = True
+        self.list_task = self.tasks.submit(self.clients.list_page_before, self.first_loaded_id, CLIENT_PAGE_SIZE,
+                                           busy=False,
+                                           on_success=partial(self.show_previous_client_page, self.list_generation))
 
-        if not clients:
-            tk.Label(self.scrollable_frame, text="Nog geen klanten geregistreerd",
-                     bg="#f0f0f0", font=("Arial", 14)).pack(pady=20)
+    def show_client_page(self, generation, clients):
+        if generation != self.list_generation:
+            return
+        self.page_loading = False
+
+        top = self.first_visible_client_row()
+        for client in clients:
+            if not self.client_tree.exists(str(client.id)):
+                self.client_tree.insert("", tk.END, iid=str(client.id), values=client, tags=self.row_tags(client.id))
+        self.show_queued_edits(client.id for client in clients)
+
+        if clients:
+            self.last_loaded_id = clients[-1].id
+        if len(clients) < CLIENT_PAGE_SIZE:
+            self.all_clients_loaded = True
+
+        dropped = self.drop_client_rows(from_start=True)
+        if dropped:
+            self.scroll_client_list_to(top - dropped)
+        self.update_empty_label()
+
+    def show_previous_client_page(self, generation, clients):
+        if generation != self.list_generation:
+            return
+        self.page_loading = False
+
+        top = self.first_visible_client_row()
+        for index, client in enumerate(clients):
+            if not self.client_tree.exists(str(client.id)):
+                self.client_tree.insert("", index, iid=str(client.id), values=client, tags=self.row_tags(client.id))
+        self.show_queued_edits(client.id for client in clients)
+
+        if clients:
+            self.first_loaded_id = clients[0].id
+        if len(clients) < CLIENT_PAGE_SIZE:
+            self.start_loaded = True
+
+        self.drop_client_rows(from_start=False)
+        # The rows in view stay in view, above them are the new ones
+        self.scroll_client_list_to(top + len(clients))
+
+    def drop_client_rows(self, from_start):
+        # Keep at most CLIENT_PAGES_KEPT pages, dropping rows at the other end
+        # than the page just loaded; returns the number of rows dropped
+        children = self.client_tree.get_children()
+        excess = len(children) - CLIENT_PAGES_KEPT * CLIENT_PAGE_SIZE
+        if excess <= 0:
+            return 0
+        if from_start:
+            self.client_tree.delete(*children[:excess])
+            self.first_loaded_id = int(children[excess])
+            self.start_loaded = False
+        else:
+            self.client_tree.delete(*children[-excess:])
+            self.last_loaded_id = int(children[-excess - 1])
+            self.all_clients_loaded = False
+        return excess
+
+    def first_visible_client_row(self):
+        return round(self.client_tree.yview()[0] * len(self.client_tree.get_children()))
+
+    def scroll_client_list_to(self, row):
+        rows = len(self.client_tree.get_children())
+        if rows:
+            self.client_tree.yview_moveto(max(row, 0) / rows)
+
+    def on_client_list_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # Fetch a page once the user scrolls near either end of the loaded rows
+        if float(last) > 0.9:
+            self.load_next_client_page()
+        elif float(first) < 0.1:
+            self.load_previous_client_page()
+
+    def update_empty_label(self):
+        if self.client_tree.get_children():
+            self.empty_label.place_forget()
         else:
-            for client in clients:
-                client_frame = tk.Frame(self.scrollable_frame, bg="#ffffff", relief=tk.SOLID, borderwidth=1)
-                client_frame.pack(fill=tk.X, padx=10, pady=5)
-
-                labels = [
-                    f"ID: {client[0]}",
-                    f"Name: {client[1]}",
-                    f"Email: {client[2]}",
-                    f"Phone: {client[3]}",
-                    f"Rental: {client[4]}"
-                ]
-
-                for text in labels:
-                    label = tk.Label(client_frame, text=text, bg="#ffffff", font=("Arial", 12))
-                    label.pack(side=tk.LEFT, padx=10, pady=5)
-
-                remove_button = tk.Button(
-                    client_frame,
-                    text="Remove",
-                    command=lambda cid=client[0]: self.remove_client(cid),
-                    bg="#f44336",
-                    fg="white",
-                    font=("Arial", 10),
-                    padx=5,
-                    pady=2
-                )
-                remove_button.pack(side=tk.RIGHT, padx=10, pady=5)
-
-        # Update the scroll region
-        self.client_canvas.update_idletasks()
-        self.client_canvas.configure(scrollregion=self.client_canvas.bbox("all"))
+            self.empty_label.place(relx=0.5, rely=0.3, anchor="center")
+
+    def patch_client_rows(self, clients):
+        # Apply a diff of client id -> row (None when removed) to the list in
+        # one pass, instead of rebuilding the whole list
+        for client_id, client in clients.items():
+            self.patch_client_row(client_id, client)
+        self.update_empty_label()
+
+    def patch_client_row(self, client_id, client):
+        iid = str(client_id)
+
+        if client is None:
+            if self.client_tree.exists(iid):
+                self.client_tree.delete(iid)
+        elif self.client_tree.exists(iid):
+            self.client_tree.item(iid, values=client, tags=self.row_tags(client_id))
+        elif self.search_query:
+            # Rows that aren't part of the current search results stay hidden
+            pass
+        elif ((self.all_clients_loaded or client_id <= self.last_loaded_id)
+              and (self.start_loaded or client_id > self.first_loaded_id)):
+            # Rows outside the loaded window are picked up when their page is fetched
+            self.client_tree.insert("", self.client_row_index(client_id), iid=iid, values=client,
+                                    tags=self.row_tags(client_id))
+            self.last_loaded_id = max(self.last_loaded_id, client_id)
+
+    def row_tags(self, client_id):
+        return ("phone_conflict",) if client_id in self.phone_conflicts else ()
+
+    def show_phone_conflicts(self, client_ids):
+        self.phone_conflicts = set(client_ids)
+        for client_id in client_ids:
+            if self.client_tree.exists(str(client_id)):
+                self.client_tree.item(str(client_id), tags=self.row_tags(client_id))
+        self.update_phone_conflict_label()
+
+    def resolve_phone_conflicts(self, client_ids):
+        # Saving a client gives it a phone key of its own and removing it ends
+        # the conflict as well, see migration 009
+        self.phone_conflicts.difference_update(client_ids)
+        self.update_phone_conflict_label()
+
+    def update_phone_conflict_label(self):
+        if self.phone_conflicts:
+            self.phone_conflict_label.config(
+                text=f"{len(self.phone_conflicts)} klant(en) delen hun telefoonnummer met een andere klant "
+                     f"(oranje). Geef ze een ander nummer of verwijder de dubbele klant.")
+            self.phone_conflict_label.pack(side=tk.TOP, before=self.client_tree, pady=(0, 5))
+        else:
+            self.phone_conflict_label.pack_forget()
+
+    def client_row_index(self, client_id):
+        # Rows are ordered by id, find the position for a newly inserted row
+        children = self.client_tree.get_children()
+        for index in range(len(children) - 1, -1, -1):
+            if int(children[index]) < client_id:
+                return index + 1
+        return 0
+
+    def set_change_seq(self, seq):
+        self.change_seq = seq
+
+    def poll_changes(self):
+        self.change_poll_id = self.after(CHANGE_POLL_MS, self.poll_changes)
+        if self.change_seq is None or self.change_poll_pending:
+            return
+        self.change_poll_pending = True
+        self.tasks.submit(self.clients.changes_since, self.change_seq, busy=False,
+                          on_success=self.apply_changes, on_error=self.on_poll_error)
+
+    @metrics.timed
+    def apply_changes(self, changes):
+        self.change_poll_pending = False
+        self.change_seq = changes.seq
+        if not changes.complete:
+            # Too many changes to patch one by one
+            self.update_client_list()
+            return
+        clients = changes.clients
+        if self.edits is not None:
+            # Rows with queued edits keep showing them; saving notices the
+            # change on the other terminal and refuses to overwrite it
+            clients = {client_id: client for client_id, client in clients.items() if client_id not in self.edits.current}
+        self.patch_client_rows(clients)
+
+    def on_poll_error(self, error):
+        # Not worth a message box every half second; the next poll tries again
+        self.change_poll_pending = False
+        logger.warning("Polling the change journal failed", exc_info=error)
+        metrics.count_error("ui")
+
+    def remove_selected_client(self):
+        selection = self.client_tree.selection()
+        if not selection:
+            messagebox.showerror("Error", "Selecteer eerst een klant")
+            return
+        if self.edits is not None:
+            self.queue_remove()
+            return
+        self.remove_client(int(selection[0]))
 
     def remove_client(self, client_id):
         if messagebox.askyesno("Confirm Removal", "Weet je zeker dat je deze klant wilt verwijderen?"):
-            self.cursor.execute("DELETE FROM clients WHERE id = ?", (client_id,))
-            self.conn.commit()
-            self.update_client_list()
-            messagebox.showinfo("Success", "Klant verwijderd.")
+            self.tasks.submit(self.clients.remove, client_id,
+                              on_success=lambda result: self.on_client_removed(client_id))
+
+    def on_client_removed(self, client_id):
+        self.patch_client_rows({client_id: None})
+        self.resolve_phone_conflicts([client_id])
+        messagebox.showinfo("Success", "Klant verwijderd.")
+
+    def toggle_edit_mode(self):
+        if self.edits is None:
+            self.edits = ClientEdits()
+            self.edit_bar.pack(side=tk.BOTTOM, fill=tk.X, pady=(0, 10), before=self.client_tree)
+            self.edit_mode_button.config(text="Stop met bewerken")
+            self.update_edit_buttons()
+            return
+        if len(self.edits) and not messagebox.askyesno(
+                "Niet opgeslagen", "De wijzigingen zijn nog niet opgeslagen. Weggooien?", parent=self):
+            return
+        self.discard_edits()
+        self.edits = None
+        self.edit_bar.pack_forget()
+        self.edit_mode_button.config(text="Meerdere klanten bewerken")
+
+    def selected_client_ids(self):
+        return [int(iid) for iid in self.client_tree.selection()]
+
+    def queue_form_edit(self):
+        # The filled-in fields of the form go to every selected client
+        values = {field: value for field, value in zip(("name", "email", "phone", "rental_type"), self.read_form())
+                  if value}
+        client_ids = self.selected_client_ids()
+        if not client_ids or not values:
+            messagebox.showerror("Error", "Selecteer klanten en vul de velden in die je wilt wijzigen", parent=self)
+            return
+        # The rows as stored, from the cache or the database; the Treeview
+        # only holds their text
+        self.tasks.submit(self.clients.get_many, client_ids,
+                          on_success=lambda clients: self.show_edits(self.edits.update(clients, **values)))
+
+    def queue_remove(self):
+        client_ids = self.selected_client_ids()
+        if not client_ids:
+            messagebox.showerror("Error", "Selecteer eerst een klant", parent=self)
+            return
+        self.tasks.submit(self.clients.get_many, client_ids,
+                          on_success=lambda clients: self.show_edits(self.edits.remove(clients)))
 
+    def show_edits(self, edits):
+        # Edit mode can't be left while the rows are loading, its button is one of the action buttons
+        self.show_queued_edits(edit.client_id for edit in edits)
 
+    def show_queued_edits(self, client_ids):
+        # Rows with queued edits show the new values, removed ones stay greyed
+        # out until the edits are saved
+        if self.edits is None:
+            return
+        for client_id in client_ids:
+            original = self.edits.originals.get(client_id)
+            iid = str(client_id)
+            if original is None or not self.client_tree.exists(iid):
+                continue
+            queued = self.edits.queued(original)
+            if queued is None:
+                self.client_tree.item(iid, values=original, tags=("removed",))
+            else:
+                self.client_tree.item(iid, values=queued, tags=("edited",) if queued != original else ())
+        self.update_edit_buttons()
+
+    def update_edit_buttons(self):
+        self.undo_button.config(state=tk.NORMAL if self.edits.can_undo else tk.DISABLED)
+        self.redo_button.config(state=tk.NORMAL if self.edits.can_redo else tk.DISABLED)
+        self.save_edits_button.config(text=f"Opslaan ({len(self.edits)})")
+
+    def undo_edit(self):
+        if self.edits is not None:
+            self.show_queued_edits(self.edits.undo())
+
+    def redo_edit(self):
+        if self.edits is not None:
+            self.show_queued_edits(self.edits.redo())
+
+    def save_edits(self):
+        changes = self.edits.changes()
+        if not changes:
+            messagebox.showinfo("Opslaan", "Er zijn geen wijzigingen", parent=self)
+            return
+        self.tasks.submit(self.clients.apply_edits, changes, on_success=self.on_edits_saved)
+
+    def on_edits_saved(self, clients):
+        # One diff with the saved rows; rows that ended unchanged lose their marks
+        rows = self.edits.clear()
+        rows.update(clients)
+        self.resolve_phone_conflicts(clients)
+        self.patch_client_rows(rows)
+        self.update_edit_buttons()
+        messagebox.showinfo("Success", f"{len(clients)} klanten opgeslagen", parent=self)
+
+    def discard_edits(self):
+        self.patch_client_rows(self.edits.clear())
+        self.update_edit_buttons()
+
+
+class ExportDialog(tk.Toplevel):
+    def __init__(self, parent):
+        from exporter import EXPORT_COLUMNS, EXPORT_FORMATS
+
+        super().__init__(parent)
+        self.title("Klanten exporteren")
+        self.configure(bg="#f0f0f0", padx=20, pady=20)
+        self.resizable(False, False)
+
+        # Column selection
+        tk.Label(self, text="Kolommen:", bg="#f0f0f0").grid(row=0, column=0, padx=10, pady=5, sticky="ne")
+        columns_frame = tk.Frame(self, bg="#f0f0f0")
+        columns_frame.grid(row=0, column=1, padx=10, pady=5, sticky="w")
+        self.column_vars = {}
+        for column, header in EXPORT_COLUMNS.items():
+            var = tk.BooleanVar(value=True)
+            tk.Checkbutton(columns_frame, text=header, variable=var, bg="#f0f0f0").pack(anchor="w")
+            self.column_vars[column] = var
+
+        # Filter and format
+        tk.Label(self, text="Type Fiets:", bg="#f0f0f0").grid(row=1, column=0, padx=10, pady=5, sticky="e")
+        self.rental_type = ttk.Combobox(self, values=[ALL_RENTAL_TYPES, *RENTAL_TYPES], state="readonly")
+        self.rental_type.set(ALL_RENTAL_TYPES)
+        self.rental_type.grid(row=1, column=1, padx=10, pady=5, sticky="w")
+
+        tk.Label(self, text="Formaat:", bg="#f0f0f0").grid(row=2, column=0, padx=10, pady=5, sticky="e")
+        self.file_format = ttk.Combobox(self, values=EXPORT_FORMATS, state="readonly")
+        self.file_format.set("xlsx")
+        self.file_format.grid(row=2, column=1, padx=10, pady=5, sticky="w")
+
+        self.progress = ttk.Progressbar(self, length=300, mode="determinate")
+        self.progress.grid(row=3, column=0, columnspan=2, padx=10, pady=10)
+        self.status_label = tk.Label(self, text="", bg="#f0f0f0")
+        self.status_label.grid(row=4, column=0, columnspan=2)
+
+        self.start_button = tk.Button(self, text="Exporteer", command=self.start_export,
+                                      bg="#2196F3", fg="white", font=("Arial", 10), padx=10, pady=5)
+        self.start_button.grid(row=5, column=0, padx=10, pady=10)
+        self.cancel_button = tk.Button(self, text="Annuleer", command=self.cancel_export, state=tk.DISABLED,
+                                       bg="#f44336", fg="white", font=("Arial", 10), padx=10, pady=5)
+        self.cancel_button.grid(row=5, column=1, padx=10, pady=10)
+
+        # The export runs in the background, progress comes back through the task runner
+        self.tasks = TaskRunner(self)
+        self.export_task = None
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-if __name__ == "__main__":
+    @metrics.timed
+    def start_export(self):
+        columns = [column for column, var in self.column_vars.items() if var.get()]
+        if not columns:
+            messagebox.showerror("Error", "Selecteer minimaal één kolom", parent=self)
+            return
+
+        from tkinter import filedialog
+        from exporter import export_clients
+
+        fmt = self.file_format.get()
+        file_path = filedialog.asksaveasfilename(
+            parent=self,
+            defaultextension=f".{fmt}",
+            filetypes=[(f"{fmt} files", f"*.{fmt}")],
+            initialfile=f"bike_rental_clients.{fmt}"
+        )
+        if not file_path:
+            return
+
+        rental_type = self.rental_type.get()
+        rental_type = None if rental_type == ALL_RENTAL_TYPES else rental_type
+
+        self.progress["value"] = 0
+        self.status_label.config(text="Bezig met exporteren...")
+        self.start_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+
+        cancel_event = threading.Event()
+        export = partial(export_clients, file_path, fmt, columns, rental_type,
+                         progress=lambda done, total: self.tasks.post(self.show_progress, done, total),
+                         cancel_event=cancel_event)
+        self.export_task = self.tasks.submit(export, on_success=self.on_export_done, on_error=self.on_export_error,
+                                             on_cancelled=self.on_export_cancelled,
+                                             executor=io_executor, cancel_event=cancel_event)
+
+    def show_progress(self, done, total):
+        self.progress["value"] = 100 * done / total if total else 100
+        self.status_label.config(text=f"{done} van {total} klanten")
+
+    def on_export_done(self, count):
+        self.reset_buttons()
+        self.progress["value"] = 100
+        if count:
+            messagebox.showinfo("Success", "Klantgegevens succesvol geëxporteerd!", parent=self)
+        else:
+            messagebox.showinfo("Info", "Geen klanten om te exporteren", parent=self)
+
+    def on_export_error(self, error):
+        self.reset_buttons()
+        messagebox.showerror("Error", f"Er is een fout opgetreden bij het exporteren: {error}", parent=self)
+
+    def on_export_cancelled(self):
+        self.reset_buttons()
+        self.status_label.config(text="Export geannuleerd")
+
+    def reset_buttons(self):
+        self.start_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def cancel_export(self):
+        if self.export_task is not None:
+            self.export_task.cancel()
+
+    def on_closing(self):
+        # Closing the dialog also stops a running export
+        self.tasks.close()
+        self.destroy()
+
+
+class RentalDialog(tk.Toplevel):
+    """Check-out and check-in of bikes, and how many bikes are free in a time window."""
+
+    def __init__(self, parent, rentals):
+        super().__init__(parent)
+        self.rentals = rentals
+        self.title("Verhuur")
+        self.configure(bg="#f0f0f0", padx=20, pady=20)
+        self.resizable(False, False)
+
+        now = datetime.now()
+        later = now + timedelta(hours=DEFAULT_RENTAL_HOURS)
+
+        # Availability
+        availability = tk.LabelFrame(self, text="Beschikbaarheid", bg="#f0f0f0", padx=10, pady=10)
+        availability.grid(row=0, column=0, sticky="we", pady=5)
+        tk.Label(availability, text="Van:", bg="#f0f0f0").grid(row=0, column=0, sticky="e")
+        self.start_entry = tk.Entry(availability, width=16)
+        self.start_entry.insert(0, now.strftime("%H:%M"))
+        self.start_entry.grid(row=0, column=1, padx=5)
+        tk.Label(availability, text="Tot:", bg="#f0f0f0").grid(row=0, column=2, sticky="e")
+        self.end_entry = tk.Entry(availability, width=16)
+        self.end_entry.insert(0, later.strftime("%H:%M"))
+        self.end_entry.grid(row=0, column=3, padx=5)
+        self.availability_button = tk.Button(availability, text="Controleer", command=self.check_availability,
+                                             bg="#2196F3", fg="white", padx=10)
+        self.availability_button.grid(row=0, column=4, padx=5)
+        self.availability_label = tk.Label(availability, text="", bg="#f0f0f0")
+        self.availability_label.grid(row=1, column=0, columnspan=5, sticky="w", pady=(5, 0))
+
+        # Check-out
+        check_out = tk.LabelFrame(self, text="Uitgeven", bg="#f0f0f0", padx=10, pady=10)
+        check_out.grid(row=1, column=0, sticky="we", pady=5)
+        tk.Label(check_out, text="Klant ID:", bg="#f0f0f0").grid(row=0, column=0, sticky="e", pady=2)
+        self.client_id_entry = tk.Entry(check_out)
+        self.client_id_entry.grid(row=0, column=1, padx=5, pady=2)
+        tk.Label(check_out, text="Type Fiets:", bg="#f0f0f0").grid(row=1, column=0, sticky="e", pady=2)
+        self.rental_type = ttk.Combobox(check_out, values=RENTAL_TYPES, state="readonly")
+        self.rental_type.set(RENTAL_TYPES[0])
+        self.rental_type.grid(row=1, column=1, padx=5, pady=2)
+        tk.Label(check_out, text="Fietscode (optioneel):", bg="#f0f0f0").grid(row=2, column=0, sticky="e", pady=2)
+        self.check_out_code_entry = tk.Entry(check_out)
+        self.check_out_code_entry.grid(row=2, column=1, padx=5, pady=2)
+        tk.Label(check_out, text="Terug om:", bg="#f0f0f0").grid(row=3, column=0, sticky="e", pady=2)
+        self.due_entry = tk.Entry(check_out)
+        self.due_entry.insert(0, later.strftime("%H:%M"))
+        self.due_entry.grid(row=3, column=1, padx=5, pady=2)
+        self.check_out_button = tk.Button(check_out, text="Uitgeven", command=self.check_out,
+                                          bg="#4CAF50", fg="white", padx=10)
+        self.check_out_button.grid(row=4, column=0, columnspan=2, pady=(5, 0))
+
+        # Check-in
+        check_in = tk.LabelFrame(self, text="Innemen", bg="#f0f0f0", padx=10, pady=10)
+        check_in.grid(row=2, column=0, sticky="we", pady=5)
+        tk.Label(check_in, text="Fietscode:", bg="#f0f0f0").grid(row=0, column=0, sticky="e")
+        self.check_in_code_entry = tk.Entry(check_in)
+        self.check_in_code_entry.grid(row=0, column=1, padx=5)
+        self.check_in_button = tk.Button(check_in, text="Innemen", command=self.check_in,
+                                         bg="#2196F3", fg="white", padx=10)
+        self.check_in_button.grid(row=0, column=2, padx=5)
+
+        self.status_label = tk.Label(self, text="", bg="#f0f0f0")
+        self.status_label.grid(row=3, column=0, sticky="w")
+
+        self.buttons = [self.availability_button, self.check_out_button, self.check_in_button]
+        self.tasks = TaskRunner(self, on_busy_changed=self.on_busy_changed, on_error=parent.show_error)
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.check_availability()
+
+    def on_busy_changed(self, busy):
+        for button in self.buttons:
+            button.config(state=tk.DISABLED if busy else tk.NORMAL)
+
+    def check_availability(self):
+        start = parse_time(self.start_entry.get())
+        end = parse_time(self.end_entry.get())
+        if start is None or end is None:
+            messagebox.showerror("Error", "Vul tijden in als 14:00 of 2024-06-01 14:00", parent=self)
+            return
+        self.tasks.submit(self.rentals.count_available, start, end, on_success=self.show_availability)
+
+    def show_availability(self, counts):
+        self.availability_label.config(
+            text=", ".join(f"{rental_type}: {count} vrij" for rental_type, count in counts.items()))
+
+    def check_out(self):
+        try:
+            client_id = int(self.client_id_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Vul een geldig klant ID in", parent=self)
+            return
+        due_at = parse_time(self.due_entry.get())
+        if due_at is None:
+            messagebox.showerror("Error", "Vul de terugkomsttijd in als 17:00 of 2024-06-01 17:00", parent=self)
+            return
+        self.tasks.submit(self.rent_bike, client_id, self.rental_type.get(), due_at,
+                          self.check_out_code_entry.get().strip() or None, on_success=self.on_checked_out)
+
+    def rent_bike(self, client_id, rental_type, due_at, bike_code):
+        # Runs on the database thread
+        rental = self.rentals.check_out(client_id, rental_type, due_at, bike_code)
+        return rental, self.rentals.bikes.get(rental.bike_id)
+
+    def on_checked_out(self, result):
+        rental, bike = result
+        self.status_label.config(
+            text=f"Fiets {bike.code} uitgegeven aan klant {rental.client_id} tot {format_time(rental.due_at)}")
+        self.client_id_entry.delete(0, tk.END)
+        self.check_out_code_entry.delete(0, tk.END)
+        self.check_availability()
+
+    def check_in(self):
+        code = self.check_in_code_entry.get().strip()
+        if not code:
+            messagebox.showerror("Error", "Vul een fietscode in", parent=self)
+            return
+        self.tasks.submit(self.rentals.check_in, code, on_success=partial(self.on_checked_in, code))
+
+    def on_checked_in(self, code, rental):
+        message = f"Fiets {code} ingenomen"
+        if rental.returned_at > rental.due_at:
+            message += f", {(rental.returned_at - rental.due_at) // 60} minuten te laat"
+        self.status_label.config(text=message)
+        self.check_in_code_entry.delete(0, tk.END)
+        self.check_availability()
+
+    def on_closing(self):
+        self.tasks.close()
+        self.destroy()
+
+
+class DashboardDialog(tk.Toplevel):
+    """Clients per rental type, registrations per day and growth, for admins."""
+
+    DAYS = 30
+    PERIODS = {"dag": "day", "week": "week", "maand": "month"}
+    CHART_WIDTH = 600
+    CHART_HEIGHT = 150
+
+    def __init__(self, parent, reports):
+        super().__init__(parent)
+        self.reports = reports
+        self.title("Dashboard")
+        self.configure(bg="#f0f0f0", padx=20, pady=20)
+        self.resizable(False, False)
+
+        self.totals_label = tk.Label(self, text="", bg="#f0f0f0", font=("Arial", 14), justify=tk.LEFT)
+        self.totals_label.grid(row=0, column=0, sticky="w")
+        self.growth_label = tk.Label(self, text="", bg="#f0f0f0", font=("Arial", 12))
+        self.growth_label.grid(row=1, column=0, sticky="w", pady=(5, 10))
+
+        tk.Label(self, text=f"Nieuwe klanten per dag, laatste {self.DAYS} dagen",
+                 bg="#f0f0f0").grid(row=2, column=0, sticky="w")
+        self.chart = tk.Canvas(self, width=self.CHART_WIDTH, height=self.CHART_HEIGHT, bg="white",
+                               highlightthickness=0)
+        self.chart.grid(row=3, column=0, pady=5)
+
+        # Totals over any period, per day, week or month
+        rollup = tk.LabelFrame(self, text="Overzicht per periode", bg="#f0f0f0", padx=10, pady=10)
+        rollup.grid(row=4, column=0, sticky="we", pady=10)
+        today = date.today()
+        tk.Label(rollup, text="Van:", bg="#f0f0f0").grid(row=0, column=0)
+        self.first_day_entry = tk.Entry(rollup, width=12)
+        self.first_day_entry.insert(0, today.replace(month=1, day=1).isoformat())
+        self.first_day_entry.grid(row=0, column=1, padx=5)
+        tk.Label(rollup, text="Tot:", bg="#f0f0f0").grid(row=0, column=2)
+        self.last_day_entry = tk.Entry(rollup, width=12)
+        self.last_day_entry.insert(0, today.isoformat())
+        self.last_day_entry.grid(row=0, column=3, padx=5)
+        self.period = ttk.Combobox(rollup, values=list(self.PERIODS), state="readonly", width=8)
+        self.period.set("week")
+        self.period.grid(row=0, column=4, padx=5)
+        tk.Button(rollup, text="Toon", command=self.load_rollup, bg="#2196F3", fg="white",
+                  padx=10).grid(row=0, column=5, padx=5)
+
+        self.rollup_tree = ttk.Treeview(rollup, columns=("period", "registered", "removed", "net"),
+                                        show="headings", height=8)
+        for column, heading in zip(self.rollup_tree["columns"], ("Periode", "Nieuw", "Verwijderd", "Netto")):
+            self.rollup_tree.heading(column, text=heading)
+            self.rollup_tree.column(column, width=120, anchor="e" if column != "period" else "w")
+        self.rollup_tree.grid(row=1, column=0, columnspan=6, pady=(10, 0))
+
+        tk.Button(self, text="Vernieuw", command=self.refresh, padx=10).grid(row=5, column=0, sticky="e")
+
+        self.tasks = TaskRunner(self, on_error=parent.show_error)
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.refresh()
+
+    def refresh(self):
+        self.tasks.submit(self.reports.dashboard, self.DAYS, on_success=self.show_dashboard, busy=False)
+        self.load_rollup()
+
+    def show_dashboard(self, dashboard):
+        lines = [f"Totaal: {dashboard.total} klanten"]
+        lines += [f"{rental_type or 'Onbekend'}: {count}" for rental_type, count in dashboard.clients_per_type.items()]
+        self.totals_label.config(text="\n".join(lines))
+
+        growth = "" if dashboard.growth is None else f" ({dashboard.growth:+.0%})"
+        self.growth_label.config(text=f"Deze week {dashboard.registered_this_week} nieuwe klanten, "
+                                      f"vorige week {dashboard.registered_last_week}{growth}")
+        self.draw_chart(dashboard.days)
+
+    def draw_chart(self, days):
+        self.chart.delete("all")
+        highest = max((day.registered for day in days), default=0) or 1
+        bar_width = self.CHART_WIDTH / max(len(days), 1)
+        for i, day in enumerate(days):
+            height = (self.CHART_HEIGHT - 20) * day.registered / highest
+            x = i * bar_width
+            self.chart.create_rectangle(x + 2, self.CHART_HEIGHT - 15 - height, x + bar_width - 2,
+                                        self.CHART_HEIGHT - 15, fill="#4CAF50", outline="")
+        for i in range(0, len(days), 7):
+            self.chart.create_text(i * bar_width + 2, self.CHART_HEIGHT - 7, anchor="w",
+                                   text=days[i].start.strftime("%d-%m"), font=("Arial", 8))
+        self.chart.create_text(self.CHART_WIDTH - 4, 4, anchor="ne", text=f"max {highest}", font=("Arial", 8))
+
+    def load_rollup(self):
+        try:
+            first_day = date.fromisoformat(self.first_day_entry.get().strip())
+            last_day = date.fromisoformat(self.last_day_entry.get().strip())
+        except ValueError:
+            messagebox.showerror("Error", "Vul datums in als 2024-06-01", parent=self)
+            return
+        self.tasks.submit(self.reports.rollup, first_day, last_day, self.PERIODS[self.period.get()],
+                          on_success=self.show_rollup, busy=False)
+
+    def show_rollup(self, totals):
+        self.rollup_tree.delete(*self.rollup_tree.get_children())
+        for row in totals:
+            self.rollup_tree.insert("", tk.END, values=(row.start.isoformat(), row.registered, row.removed, row.net))
+
+    def on_closing(self):
+        self.tasks.close()
+        self.destroy()
+
+
+class MaintenanceDialog(tk.Toplevel):
+    """Online backups and archiving of removed clients, for admins."""
+
+    def __init__(self, parent):
+        from archive import ARCHIVE_AFTER_DAYS
+
+        super().__init__(parent)
+        self.title("Onderhoud")
+        self.configure(bg="#f0f0f0", padx=20, pady=20)
+        self.resizable(False, False)
+
+        # A shared PostgreSQL database is backed up on the server
+        self.can_backup = not is_postgres(DATABASE_URL)
+        backup_text = ("Maak een kopie van de database terwijl de kassa's doorwerken" if self.can_backup
+                       else "Backups van de gedeelde PostgreSQL database worden op de server gemaakt")
+        tk.Label(self, text=backup_text, bg="#f0f0f0").grid(row=0, column=0, columnspan=3, sticky="w")
+        self.backup_button = tk.Button(self, text="Maak backup", command=self.start_backup,
+                                       state=tk.NORMAL if self.can_backup else tk.DISABLED,
+                                       bg="#2196F3", fg="white", font=("Arial", 10), padx=10, pady=5)
+        self.backup_button.grid(row=1, column=0, padx=10, pady=10, sticky="w")
+
+        tk.Label(self, text="Archiveer klanten die langer dan zoveel dagen verwijderd zijn:",
+                 bg="#f0f0f0").grid(row=2, column=0, columnspan=3, sticky="w")
+        self.days_entry = tk.Entry(self, width=6)
+        self.days_entry.insert(0, str(ARCHIVE_AFTER_DAYS))
+        self.days_entry.grid(row=3, column=0, padx=10, pady=10, sticky="w")
+        self.archive_button = tk.Button(self, text="Archiveer", command=self.start_archive,
+                                        bg="#2196F3", fg="white", font=("Arial", 10), padx=10, pady=5)
+        self.archive_button.grid(row=3, column=1, padx=10, pady=10)
+
+        self.progress = ttk.Progressbar(self, length=300, mode="determinate")
+        self.progress.grid(row=4, column=0, columnspan=3, padx=10, pady=10)
+        self.status_label = tk.Label(self, text="", bg="#f0f0f0")
+        self.status_label.grid(row=5, column=0, columnspan=3)
+        self.cancel_button = tk.Button(self, text="Annuleer", command=self.cancel_job, state=tk.DISABLED,
+                                       bg="#f44336", fg="white", font=("Arial", 10), padx=10, pady=5)
+        self.cancel_button.grid(row=6, column=0, columnspan=3, pady=10)
+
+        # Both jobs use their own connections on the file thread
+        self.tasks = TaskRunner(self)
+        self.job = None
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+    @metrics.timed
+    def start_backup(self):
+        from backup import backup_database
+
+        self.start_job("Bezig met backup...")
+        cancel_event = threading.Event()
+        job = partial(backup_database, progress=partial(self.post_progress, "pagina's"), cancel_event=cancel_event)
+        self.job = self.tasks.submit(job, on_success=self.on_backup_done, on_error=self.on_job_error,
+                                     on_cancelled=self.on_job_cancelled, executor=io_executor,
+                                     cancel_event=cancel_event)
+
+    @metrics.timed
+    def start_archive(self):
+        from archive import archive_deleted_clients
+
+        try:
+            days = int(self.days_entry.get().strip())
+        except ValueError:
+            messagebox.showerror("Error", "Vul een aantal dagen in", parent=self)
+            return
+        self.start_job("Bezig met archiveren...")
+        cancel_event = threading.Event()
+        job = partial(archive_deleted_clients, days, progress=partial(self.post_progress, "klanten"),
+                      cancel_event=cancel_event)
+        self.job = self.tasks.submit(job, on_success=self.on_archive_done, on_error=self.on_job_error,
+                                     on_cancelled=self.on_job_cancelled, executor=io_executor,
+                                     cancel_event=cancel_event)
+
+    def post_progress(self, unit, done, total):
+        # Called on the file thread
+        self.tasks.post(self.show_progress, unit, done, total)
+
+    def show_progress(self, unit, done, total):
+        self.progress["value"] = 100 * done / total if total else 100
+        self.status_label.config(text=f"{done} van {total} {unit}")
+
+    def start_job(self, status):
+        self.progress["value"] = 0
+        self.status_label.config(text=status)
+        self.backup_button.config(state=tk.DISABLED)
+        self.archive_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+
+    def on_backup_done(self, path):
+        self.reset_buttons()
+        self.progress["value"] = 100
+        self.status_label.config(text=f"Backup opgeslagen in {path}")
+
+    def on_archive_done(self, count):
+        self.reset_buttons()
+        self.progress["value"] = 100
+        self.status_label.config(text=f"{count} klanten gearchiveerd" if count else "Geen klanten om te archiveren")
+
+    def on_job_error(self, error):
+        self.reset_buttons()
+        logger.error("Maintenance job failed", exc_info=error)
+        metrics.count_error("ui")
+        messagebox.showerror("Error", f"Er is een fout opgetreden: {error}", parent=self)
+
+    def on_job_cancelled(self):
+        self.reset_buttons()
+        self.status_label.config(text="Geannuleerd")
+
+    def reset_buttons(self):
+        self.backup_button.config(state=tk.NORMAL if self.can_backup else tk.DISABLED)
+        self.archive_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def cancel_job(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def on_closing(self):
+        # Closing the dialog also stops a running job
+        self.tasks.close()
+        self.destroy()
+
+
+class MetricsDialog(tk.Toplevel):
+    """Timings of SQL statements, UI handlers and background tasks, and the slow query log."""
+
+    REFRESH_MS = 2000
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.title("Metrics")
+        self.configure(bg="#f0f0f0", padx=10, pady=10)
+
+        columns = ("kind", "name", "count", "p50", "p95", "p99")
+        self.timings_tree = ttk.Treeview(self, columns=columns, show="headings", height=15)
+        for column, heading, width in zip(columns, ("Soort", "Naam", "Aantal", "p50 ms", "p95 ms", "p99 ms"),
+                                          (60, 500, 70, 70, 70, 70)):
+            self.timings_tree.heading(column, text=heading)
+            self.timings_tree.column(column, width=width, anchor="w" if column == "name" else "e")
+        self.timings_tree.pack(fill=tk.BOTH, expand=True)
+
+        tk.Label(self, text="Trage queries", bg="#f0f0f0").pack(anchor="w", pady=(10, 0))
+        self.slow_tree = ttk.Treeview(self, columns=("ms", "at", "statement"), show="headings", height=6)
+        for column, heading, width in (("ms", "ms", 70), ("at", "Tijd", 80), ("statement", "Query", 690)):
+            self.slow_tree.heading(column, text=heading)
+            self.slow_tree.column(column, width=width, anchor="e" if column == "ms" else "w")
+        self.slow_tree.pack(fill=tk.BOTH, expand=True)
+        self.slow_tree.bind("<<TreeviewSelect>>", self.show_plan)
+        self.plan_label = tk.Label(self, text="", bg="#f0f0f0", justify=tk.LEFT, font=("Courier", 9))
+        self.plan_label.pack(anchor="w", pady=5)
+
+        self.slow_queries = []
+        self.after_id = None
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.refresh()
+
+    def refresh(self):
+        self.timings_tree.delete(*self.timings_tree.get_children())
+        for summary in metrics.registry.summaries():
+            self.timings_tree.insert("", tk.END, values=(
+                summary.kind, summary.name, summary.count,
+                *(f"{summary.quantiles[q] * 1000:.2f}" for q in metrics.QUANTILES)))
+
+        self.slow_queries = list(metrics.registry.slow_queries)[::-1]  # newest first
+        self.slow_tree.delete(*self.slow_tree.get_children())
+        for i, query in enumerate(self.slow_queries):
+            self.slow_tree.insert("", tk.END, iid=str(i), values=(
+                f"{query.seconds * 1000:.1f}", datetime.fromtimestamp(query.at).strftime("%H:%M:%S"),
+                query.statement))
+        self.after_id = self.after(self.REFRESH_MS, self.refresh)
+
+    def show_plan(self, event):
+        selection = self.slow_tree.selection()
+        if selection:
+            self.plan_label.config(text="\n".join(self.slow_queries[int(selection[0])].plan))
+
+    def on_closing(self):
+        if self.after_id is not None:
+            self.after_cancel(self.after_id)
+        self.destroy()
+
+
+def open_database():
+    # Runs on the database thread: opens the shared storage (SQLite or
+    # PostgreSQL, see storage.py) and brings the schema up to date, once per process
+    storage = get_storage()
+    storage.migrate()
+    storage.clients.prune_changes(CHANGES_KEPT)
+    return storage
+
+
+def main():
+    startup.mark("imports done")
+    if metrics.ENABLED:
+        metrics.install_tk_timing()
     app = LoginWindow()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+
+
+if __name__ == "__main__":
+    main()
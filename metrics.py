@@ -0,0 +1,265 @@
+"""Optional timing of SQL statements, Tk event handlers and background tasks.
+
+Off by default. With BIKE_RENTAL_METRICS=1:
+
+- every connection from repositories.open_connection times its statements;
+  statements slower than SLOW_QUERY_SECONDS go to the slow query log together
+  with their EXPLAIN QUERY PLAN,
+- every Tk callback (button commands, key bindings, after() callbacks) and
+  every TaskRunner task and callback is timed,
+- admins open the metrics panel with Ctrl+Shift+M, the desktop application
+  writes the metrics in Prometheus text format to BIKE_RENTAL_METRICS_FILE
+  and the HTTP API serves them on GET /metrics.
+
+Percentiles are computed over the last SAMPLES observations of each name.
+SQL timings cover execute(), which runs the statement up to its first row;
+fetching further rows is not included.
+"""
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple
+
+ENABLED = os.environ.get("BIKE_RENTAL_METRICS") == "1"
+METRICS_FILE = os.environ.get("BIKE_RENTAL_METRICS_FILE", "metrics.prom")
+SLOW_QUERY_SECONDS = float(os.environ.get("BIKE_RENTAL_SLOW_QUERY_MS", "50")) / 1000
+
+SAMPLES = 1024  # a power of two, see _Timings
+SLOW_QUERY_LOG_SIZE = 100
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Statements are keyed by their text with whitespace collapsed, cut off here
+STATEMENT_KEY_LENGTH = 120
+
+
+class Summary(NamedTuple):
+    kind: str
+    name: str
+    count: int
+    total: float  # seconds
+    quantiles: Dict[float, float]  # quantile -> seconds
+
+
+class SlowQuery(NamedTuple):
+    statement: str
+    seconds: float
+    at: float  # unix time
+    plan: List[str]
+
+
+class _Timings:
+    # count, sum and a ring buffer of the last SAMPLES durations. Updates
+    # happen under the GIL without a lock; summaries copy the buffer first
+    __slots__ = ("count", "total", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = [0.0] * SAMPLES
+
+    def add(self, seconds):
+        self.samples[self.count & (SAMPLES - 1)] = seconds
+        self.count += 1
+        self.total += seconds
+
+    def recent(self):
+        return self.samples[:min(self.count, SAMPLES)]
+
+
+class Registry:
+    def __init__(self):
+        self.timings = {}  # (kind, name) -> _Timings
+        self.statements = {}  # SQL text as passed to execute() -> _Timings
+        self.errors = {}  # where -> count
+        self.slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+        self.slow_query_count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, kind: str, name: str, seconds: float):
+        timings = self.timings.get((kind, name))
+        if timings is None:
+            with self.lock:
+                timings = self.timings.setdefault((kind, name), _Timings())
+        timings.add(seconds)
+
+    def count_error(self, where: str):
+        with self.lock:
+            self.errors[where] = self.errors.get(where, 0) + 1
+
+    def summaries(self) -> List[Summary]:
+        with self.lock:
+            items = list(self.timings.items())
+            items += [(("sql", statement_key(sql)), timings) for sql, timings in self.statements.items()]
+        result = []
+        for (kind, name), timings in sorted(items, key=lambda item: item[0]):
+            samples = sorted(timings.recent())
+            if not samples:
+                continue
+            quantiles = {q: samples[min(int(q * len(samples)), len(samples) - 1)] for q in QUANTILES}
+            result.append(Summary(kind, name, timings.count, timings.total, quantiles))
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.timings.clear()
+            self.statements.clear()
+            self.errors.clear()
+            self.slow_queries.clear()
+            self.slow_query_count = 0
+
+
+registry = Registry()
+
+
+def observe(kind: str, name: str, seconds: float):
+    registry.observe(kind, name, seconds)
+
+
+def count_error(where: str):
+    if ENABLED:
+        registry.count_error(where)
+
+
+def handler_name(fn) -> str:
+    fn = getattr(fn, "func", fn)  # functools.partial
+    return getattr(fn, "__qualname__", None) or repr(fn)
+
+
+def timed(fn):
+    """Decorator that times fn as a handler when metrics are enabled, a no-op otherwise."""
+    if not ENABLED:
+        return fn
+    name = handler_name(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            registry.observe("handler", name, time.perf_counter() - start)
+
+    return wrapper
+
+
+_statement_keys = {}
+
+
+def statement_key(sql: str) -> str:
+    key = _statement_keys.get(sql)
+    if key is None:
+        key = _statement_keys[sql] = " ".join(sql.split())[:STATEMENT_KEY_LENGTH]
+    return key
+
+
+_perf_counter = time.perf_counter
+_execute = sqlite3.Connection.execute
+_executemany = sqlite3.Connection.executemany
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection that times execute() and executemany().
+
+    This runs for every statement, so the common path is kept to two clock
+    reads, one dict lookup and a ring buffer write.
+    """
+
+    def execute(self, sql, parameters=()):
+        start = _perf_counter()
+        try:
+            return _execute(self, sql, parameters)
+        finally:
+            seconds = _perf_counter() - start
+            timings = registry.statements.get(sql)
+            if timings is None:
+                timings = self._timings(sql)
+            timings.samples[timings.count & (SAMPLES - 1)] = seconds
+            timings.count += 1
+            timings.total += seconds
+            if seconds >= SLOW_QUERY_SECONDS:
+                self._log_slow(sql, parameters, seconds)
+
+    def executemany(self, sql, parameters):
+        start = _perf_counter()
+        try:
+            return _executemany(self, sql, parameters)
+        finally:
+            seconds = _perf_counter() - start
+            timings = registry.statements.get(sql) or self._timings(sql)
+            timings.add(seconds)
+            if seconds >= SLOW_QUERY_SECONDS:
+                self._log_slow(sql, None, seconds)
+
+    def _timings(self, sql):
+        with registry.lock:
+            return registry.statements.setdefault(sql, _Timings())
+
+    def _log_slow(self, sql, parameters, seconds):
+        registry.slow_query_count += 1
+        registry.slow_queries.append(SlowQuery(statement_key(sql), seconds, time.time(), self._plan(sql, parameters)))
+
+    def _plan(self, sql, parameters):
+        if parameters is None or not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+            return []
+        try:
+            rows = _execute(self, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            return [f"EXPLAIN failed: {e}"]
+        return [row[3] for row in rows]
+
+
+def install_tk_timing():
+    """Time every Tk callback registered from now on; call before creating windows."""
+    import tkinter
+
+    class TimedCallWrapper(tkinter.CallWrapper):
+        def __init__(self, func, subst, widget):
+            super().__init__(func, subst, widget)
+            self.name = handler_name(func)
+
+        def __call__(self, *args):
+            start = time.perf_counter()
+            try:
+                return super().__call__(*args)
+            finally:
+                registry.observe("handler", self.name, time.perf_counter() - start)
+
+    tkinter.CallWrapper = TimedCallWrapper
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    summaries = registry.summaries()
+    for kind, label in (("sql", "statement"), ("handler", "handler"), ("task", "task")):
+        metric = f"bike_rental_{kind}_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for summary in summaries:
+            if summary.kind != kind:
+                continue
+            name = f'{label}="{_label(summary.name)}"'
+            for q, seconds in summary.quantiles.items():
+                lines.append(f'{metric}{{{name},quantile="{q}"}} {seconds:.6f}')
+            lines.append(f"{metric}_sum{{{name}}} {summary.total:.6f}")
+            lines.append(f"{metric}_count{{{name}}} {summary.count}")
+    lines.append("# TYPE bike_rental_errors_total counter")
+    for where, count in sorted(registry.errors.items()):
+        lines.append(f'bike_rental_errors_total{{where="{_label(where)}"}} {count}')
+    lines.append("# TYPE bike_rental_slow_queries_total counter")
+    lines.append(f"bike_rental_slow_queries_total {registry.slow_query_count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str = METRICS_FILE):
+    # Write and rename, so a collector never reads a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
@@ -0,0 +1,322 @@
+"""Versioned schema migrations for the bike rental database.
+
+The schema version is stored in PRAGMA user_version. Every migration runs once,
+in its own transaction, and bumps the version when it succeeds. Call migrate()
+once at process start.
+"""
+import sqlite3
+from hashlib import sha256
+
+from validation import client_keys, phone_key
+
+# Seed data of new databases, shared with the PostgreSQL schema (postgres_storage.py).
+# Passwords are unsalted sha256 digests, AuthService rehashes them on the first login
+DEFAULT_ACCOUNTS = [
+    ("admin", sha256("admin123".encode()).hexdigest(), 1),
+    ("employee", sha256("employee123".encode()).hexdigest(), 0)
+]
+DUMMY_CLIENTS = [
+    ("Guus S", "guus@guus.com", "123", "Bike"),
+    ("John Doe", "john.doe@example.com", "0612345678", "Bike"),
+    ("Emma Smith", "emma.smith@example.com", "0687654321", "Electric Bike"),
+    ("Michael Johnson", "michael.j@example.com", "0623456789", "Bike"),
+    ("Sarah Williams", "sarah.w@example.com", "0698765432", "Electric Bike"),
+    ("David Brown", "david.brown@example.com", "0643210987", "Bike")
+]
+# A small starting fleet, like the dummy clients
+STARTING_FLEET = [(f"B{i:03d}", "Bike") for i in range(1, 6)] + [(f"E{i:03d}", "Electric Bike") for i in range(1, 6)]
+
+
+def _001_initial_schema(conn):
+    # Same tables the application used to create on every window open;
+    # IF NOT EXISTS / OR IGNORE keep existing databases intact
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS employees (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            is_admin BOOLEAN DEFAULT 0
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS clients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            email TEXT,
+            phone TEXT UNIQUE,
+            rental_type TEXT)""")
+
+    # Default accounts and dummy clients are only seeded once
+    conn.executemany("""
+        INSERT OR IGNORE INTO employees (username, password, is_admin)
+        VALUES (?, ?, ?)""", DEFAULT_ACCOUNTS)
+    conn.executemany("""
+        INSERT OR IGNORE INTO clients (name, email, phone, rental_type)
+        VALUES (?, ?, ?, ?)""", DUMMY_CLIENTS)
+
+
+def _002_client_indexes(conn):
+    # phone already has the index of its UNIQUE constraint.
+    # The NOCASE indexes serve case-insensitive equality and LIKE 'prefix%'
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_email_nocase ON clients (email COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_name_nocase ON clients (name COLLATE NOCASE)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_rental_type ON clients (rental_type)")
+
+
+def _003_client_search(conn):
+    # External-content FTS5 index over name, email and phone. The triggers keep
+    # it in sync with clients. Prefix indexes up to 6 characters keep
+    # search-as-you-type fast: without them a prefix like "jansen" has to merge
+    # the postings of every "jansen123"-style email token. detail=column drops
+    # token positions, which search() doesn't need since it never runs phrase queries
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS clients_fts USING fts5(
+            name, email, phone,
+            content='clients', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='1 2 3 4 5 6', detail=column)""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_insert AFTER INSERT ON clients BEGIN
+            INSERT INTO clients_fts (rowid, name, email, phone)
+            VALUES (new.id, new.name, new.email, new.phone);
+        END""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_delete AFTER DELETE ON clients BEGIN
+            INSERT INTO clients_fts (clients_fts, rowid, name, email, phone)
+            VALUES ('delete', old.id, old.name, old.email, old.phone);
+        END""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS clients_fts_update AFTER UPDATE OF name, email, phone ON clients BEGIN
+            INSERT INTO clients_fts (clients_fts, rowid, name, email, phone)
+            VALUES ('delete', old.id, old.name, old.email, old.phone);
+            INSERT INTO clients_fts (rowid, name, email, phone)
+            VALUES (new.id, new.name, new.email, new.phone);
+        END""")
+    # Index the clients that already exist
+    conn.execute("INSERT INTO clients_fts (clients_fts) VALUES ('rebuild')")
+
+
+def _004_bikes_and_rentals(conn):
+    # Times are unix seconds. A rental is open until returned_at is set; an
+    # open rental keeps its bike busy until it is checked in
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bikes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            rental_type TEXT NOT NULL,
+            active BOOLEAN NOT NULL DEFAULT 1)""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rentals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            bike_id INTEGER NOT NULL REFERENCES bikes (id),
+            client_id INTEGER NOT NULL REFERENCES clients (id),
+            start_at INTEGER NOT NULL,
+            due_at INTEGER NOT NULL,
+            returned_at INTEGER)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bikes_rental_type ON bikes (rental_type, active)")
+    # At most one open rental per bike; also the (small) index of bikes that are out
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_rentals_open ON rentals (bike_id)
+        WHERE returned_at IS NULL""")
+    # Returned rentals that overlap a time window are found with a range scan
+    # from the start of the window, which only touches recent history
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_rentals_returned ON rentals (returned_at, start_at, bike_id)
+        WHERE returned_at IS NOT NULL""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rentals_client ON rentals (client_id, start_at)")
+
+    conn.executemany("INSERT OR IGNORE INTO bikes (code, rental_type) VALUES (?, ?)", STARTING_FLEET)
+
+
+def _005_client_reports(conn):
+    # Registration time in unix seconds, set by ClientRepository on insert.
+    # Clients that existed before this migration have none
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(clients)")]
+    if "created_at" not in columns:
+        conn.execute("ALTER TABLE clients ADD COLUMN created_at INTEGER")
+
+    # Summary tables for the dashboard, kept current by the triggers below so
+    # reading them never touches the clients table. Days are local dates, a
+    # missing rental type is counted as ''
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS client_type_counts (
+            rental_type TEXT PRIMARY KEY,
+            clients INTEGER NOT NULL) WITHOUT ROWID""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS client_daily_counts (
+            day TEXT NOT NULL,
+            rental_type TEXT NOT NULL,
+            registered INTEGER NOT NULL DEFAULT 0,
+            removed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, rental_type)) WITHOUT ROWID""")
+
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS client_counts_insert AFTER INSERT ON clients BEGIN
+            INSERT INTO client_type_counts (rental_type, clients) VALUES (IFNULL(new.rental_type, ''), 1)
+            ON CONFLICT (rental_type) DO UPDATE SET clients = clients + 1;
+            INSERT INTO client_daily_counts (day, rental_type, registered)
+            SELECT date(new.created_at, 'unixepoch', 'localtime'), IFNULL(new.rental_type, ''), 1
+            WHERE new.created_at IS NOT NULL
+            ON CONFLICT (day, rental_type) DO UPDATE SET registered = registered + 1;
+        END""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS client_counts_delete AFTER DELETE ON clients BEGIN
+            UPDATE client_type_counts SET clients = clients - 1 WHERE rental_type = IFNULL(old.rental_type, '');
+            INSERT INTO client_daily_counts (day, rental_type, removed)
+            VALUES (date('now', 'localtime'), IFNULL(old.rental_type, ''), 1)
+            ON CONFLICT (day, rental_type) DO UPDATE SET removed = removed + 1;
+        END""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS client_counts_update AFTER UPDATE OF rental_type ON clients
+        WHEN old.rental_type IS NOT new.rental_type BEGIN
+            UPDATE client_type_counts SET clients = clients - 1 WHERE rental_type = IFNULL(old.rental_type, '');
+            INSERT INTO client_type_counts (rental_type, clients) VALUES (IFNULL(new.rental_type, ''), 1)
+            ON CONFLICT (rental_type) DO UPDATE SET clients = clients + 1;
+        END""")
+
+    # Start from the clients that already exist, the only full scan ever needed
+    conn.execute("DELETE FROM client_type_counts")
+    conn.execute("""
+        INSERT INTO client_type_counts (rental_type, clients)
+        SELECT IFNULL(rental_type, ''), COUNT(*) FROM clients GROUP BY 1""")
+
+
+def _006_client_changes(conn):
+    # Append-only journal of client changes for keeping other terminals in
+    # sync. AUTOINCREMENT guarantees seq is never reused, also after pruning.
+    # Only the id is journaled, readers join clients for the current row
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS client_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_id INTEGER NOT NULL,
+            operation TEXT NOT NULL)""")
+    for operation, row in (("insert", "new"), ("update", "new"), ("delete", "old")):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS client_changes_{operation} AFTER {operation.upper()} ON clients BEGIN
+                INSERT INTO client_changes (client_id, operation) VALUES ({row}.id, '{operation}');
+            END""")
+
+
+def _007_deleted_clients(conn):
+    # Removed clients are moved here by ClientRepository.remove instead of
+    # being deleted, so clients only holds current clients and the phone is
+    # free again right away. archive.py moves old rows on to the archive database
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS deleted_clients (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            email TEXT,
+            phone TEXT,
+            rental_type TEXT,
+            created_at INTEGER,
+            deleted_at INTEGER NOT NULL)""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_deleted_clients_deleted_at ON deleted_clients (deleted_at)")
+
+
+def _008_client_keys(conn):
+    # Normalized keys for uniqueness checks and duplicate detection, computed
+    # by ClientRepository with validation.client_keys
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(clients)")]
+    for column in ("phone_key", "email_key", "name_key"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE clients ADD COLUMN {column} TEXT")
+
+    # Only real changes go to the change journal, not the backfill below
+    conn.execute("DROP TRIGGER IF EXISTS client_changes_update")
+    conn.execute("""
+        CREATE TRIGGER client_changes_update AFTER UPDATE OF name, email, phone, rental_type ON clients BEGIN
+            INSERT INTO client_changes (client_id, operation) VALUES (new.id, 'update');
+        END""")
+
+    # Keyset batches, so large tables are never read into memory at once.
+    # Phones that only differ in notation ("06-12345678", "0612345678")
+    # may already be registered twice; the oldest client keeps the key
+    seen_phones = set()
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, name, email, phone FROM clients WHERE id > ? ORDER BY id LIMIT 10000",
+                            (last_id,)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for client_id, name, email, phone in rows:
+            phone_key, email_key, name_key = client_keys(name or "", email or "", phone or "")
+            if not phone_key or phone_key in seen_phones:
+                phone_key = None
+            else:
+                seen_phones.add(phone_key)
+            updates.append((phone_key, email_key, name_key, client_id))
+        conn.executemany("UPDATE clients SET phone_key = ?, email_key = ?, name_key = ? WHERE id = ?", updates)
+        last_id = rows[-1][0]
+
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clients_phone_key ON clients (phone_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_email_key ON clients (email_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_name_key ON clients (name_key)")
+
+
+def _009_phone_conflicts(conn):
+    # _008_client_keys left phone_key empty on clients whose phone was
+    # already registered by an older client. Saving such a client sets the
+    # key and fails on the unique index, so they are listed here for the
+    # application to point out (ClientService.phone_taken_message). A row
+    # goes away once its client has a phone_key of its own or is removed
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS phone_conflicts (
+            client_id INTEGER PRIMARY KEY,
+            phone_key TEXT NOT NULL)""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS phone_conflicts_resolved AFTER UPDATE OF phone_key ON clients
+        WHEN new.phone_key IS NOT NULL BEGIN
+            DELETE FROM phone_conflicts WHERE client_id = new.id;
+        END""")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS phone_conflicts_removed AFTER DELETE ON clients BEGIN
+            DELETE FROM phone_conflicts WHERE client_id = old.id;
+        END""")
+
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, phone FROM clients WHERE phone_key IS NULL AND id > ? ORDER BY id LIMIT 10000",
+                            (last_id,)).fetchall()
+        if not rows:
+            break
+        keys = [(client_id, phone_key(phone)) for client_id, phone in rows if phone]
+        conn.executemany("""
+            INSERT OR IGNORE INTO phone_conflicts (client_id, phone_key)
+            SELECT ?, phone_key FROM clients WHERE phone_key = ?""", keys)
+        last_id = rows[-1][0]
+
+
+# Append new migrations to the end, never reorder or edit applied ones
+MIGRATIONS = [
+    _001_initial_schema,
+    _002_client_indexes,
+    _003_client_search,
+    _004_bikes_and_rentals,
+    _005_client_reports,
+    _006_client_changes,
+    _007_deleted_clients,
+    _008_client_keys,
+    _009_phone_conflicts,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply all pending migrations and return the resulting schema version."""
+    while schema_version(conn) < len(MIGRATIONS):
+        # BEGIN IMMEDIATE takes the write lock, so two terminals starting at
+        # the same time can't apply the same migration twice
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version < len(MIGRATIONS):
+                MIGRATIONS[version](conn)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return schema_version(conn)
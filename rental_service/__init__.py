@@ -0,0 +1,34 @@
+"""UI-independent services for the client registry.
+
+The Tk application, the bulk import and the HTTP API (rental_service.api) all
+use these services, so the same rules apply whichever way clients come in.
+RentalService handles bikes, check-out/check-in and availability,
+ReportService the numbers of the admin dashboard. ClientEdits queues edits of
+several clients, with undo and redo, for ClientService.apply_edits.
+"""
+from .auth import AuthService
+from .cache import ClientCache
+from .clients import ClientChanges, ClientService, RejectedRow, validate_batch
+from .edits import ClientEdits, Edit
+from .errors import NotFoundError, ServiceError, TooManyAttemptsError, ValidationError
+from .rentals import RentalService
+from .reports import Dashboard, PeriodTotals, ReportService
+
+__all__ = [
+    "AuthService",
+    "ClientCache",
+    "ClientChanges",
+    "ClientEdits",
+    "ClientService",
+    "Dashboard",
+    "Edit",
+    "NotFoundError",
+    "PeriodTotals",
+    "RejectedRow",
+    "RentalService",
+    "ReportService",
+    "ServiceError",
+    "TooManyAttemptsError",
+    "ValidationError",
+    "validate_batch",
+]
@@ -0,0 +1,399 @@
+"""Local HTTP/JSON API for the client registry.
+
+A small asyncio HTTP/1.1 server with keep-alive and chunked request bodies, so
+scripts and the web booking frontend can use the same database as the counter
+terminals without extra dependencies. Slow or oversized requests are cut off
+by the timeouts and limits below; put a reverse proxy (nginx) in front of it
+when it is reachable from outside the shop. All database work runs on the
+single database thread from workers.py (with PostgreSQL on a thread per pooled
+connection, see create_server), the event loop only parses requests and writes
+responses.
+
+Start it with:  python -m rental_service.api --port 8080
+
+Endpoints (everything except /login needs "Authorization: Bearer <token>"):
+
+    POST   /login                 {"username", "password"} -> {"token", "employee"}
+    GET    /clients?after_id=&limit=                        -> page of clients
+    GET    /clients/search?q=&limit=                        -> ranked search results
+    GET    /clients/changes?since=                          -> clients changed after journal entry since
+    GET    /clients/duplicates?name=&email=&phone=          -> clients that are probably the same person
+    GET    /clients/<id>
+    POST   /clients               {"name", "email", "phone", "rental_type"}
+    PUT    /clients/<id>          {"name", "email", "phone", "rental_type"}
+    DELETE /clients/<id>
+    POST   /clients/batch         {"clients": [{...}, ...]} -> {"created", "rejected"}
+    POST   /clients/lookup        {"ids": [1, 2, ...]}      -> clients that exist
+    GET    /cache/stats                                     -> client cache hits and misses
+    GET    /metrics                                         -> Prometheus text, no login needed
+
+With BIKE_RENTAL_METRICS=1 every request is timed as well (see metrics.py).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from storage import Storage, get_storage
+from workers import db_executor
+
+from .auth import AuthService
+from .cache import ClientCache
+from .clients import ClientService
+from .errors import NotFoundError, TooManyAttemptsError, ValidationError
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_SIZE = 16 * 1024 * 1024
+# Request line and headers together
+MAX_HEADER_SIZE = 16 * 1024
+MAX_HEADERS = 100
+# Seconds; a client that sends or reads slower than this loses its connection,
+# so slow clients can't hold connections open
+IDLE_TIMEOUT = 60  # between requests on a keep-alive connection
+HEADER_TIMEOUT = 10  # for the headers, after the request line
+BODY_TIMEOUT = 30  # for the body, and for reading the response
+MAX_PAGE_SIZE = 1000
+CLIENT_FIELDS = ("name", "email", "phone", "rental_type")
+
+REASONS = {200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 401: "Unauthorized",
+           404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+           429: "Too Many Requests", 431: "Request Header Fields Too Large", 500: "Internal Server Error",
+           501: "Not Implemented"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _client_json(client):
+    return client._asdict()
+
+
+def _client_fields(body):
+    if not isinstance(body, dict):
+        raise HttpError(400, "Verwacht een JSON object")
+    return tuple(str(body.get(field) or "") for field in CLIENT_FIELDS)
+
+
+def _int_param(query, name, default, minimum=0, maximum=None):
+    try:
+        value = int(query.get(name, [default])[0])
+    except ValueError:
+        raise HttpError(400, f"{name} moet een getal zijn")
+    # SQLite reads a negative LIMIT as no limit at all
+    if value < minimum:
+        raise HttpError(400, f"{name} moet minstens {minimum} zijn")
+    return min(value, maximum) if maximum else value
+
+
+async def _readline(reader):
+    try:
+        return await reader.readline()
+    except ValueError:
+        # Longer than the limit of the stream, see ApiServer.serve
+        raise HttpError(431, "Regel te lang")
+
+
+class ApiServer:
+    def __init__(self, clients: ClientService, auth: AuthService, executor=db_executor):
+        self.clients = clients
+        self.auth = auth
+        self.executor = executor
+        # (method, path pattern, handler, needs login)
+        self.routes = [
+            ("POST", re.compile(r"/login"), self.login, False),
+            ("GET", re.compile(r"/clients"), self.list_clients, True),
+            ("GET", re.compile(r"/clients/search"), self.search_clients, True),
+            ("GET", re.compile(r"/clients/changes"), self.client_changes, True),
+            ("GET", re.compile(r"/clients/duplicates"), self.duplicate_clients, True),
+            ("POST", re.compile(r"/clients/batch"), self.register_batch, True),
+            ("POST", re.compile(r"/clients/lookup"), self.lookup_clients, True),
+            ("GET", re.compile(r"/clients/(\d+)"), self.get_client, True),
+            ("POST", re.compile(r"/clients"), self.register_client, True),
+            ("PUT", re.compile(r"/clients/(\d+)"), self.update_client, True),
+            ("DELETE", re.compile(r"/clients/(\d+)"), self.remove_client, True),
+            ("GET", re.compile(r"/cache/stats"), self.cache_stats, True),
+            ("GET", re.compile(r"/metrics"), self.metrics, False),
+        ]
+
+    async def run_db(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args))
+
+    # Handlers: (query, body, *path groups) -> (status, payload)
+
+    async def login(self, query, body):
+        if not isinstance(body, dict):
+            raise HttpError(400, "Verwacht een JSON object")
+        username, password = str(body.get("username", "")), str(body.get("password", ""))
+        # The KDF runs on the loop's default executor, not on the database thread
+        credentials = await self.run_db(self.auth.lookup, username)
+        employee, new_hash = await asyncio.get_running_loop().run_in_executor(
+            None, self.auth.verify, username, password, credentials)
+        if new_hash is not None:
+            await self.run_db(self.auth.save_hash, employee.id, new_hash)
+        if employee is None:
+            raise HttpError(401, "Ongeldige gebruikersnaam of wachtwoord")
+        return 200, {"token": self.auth.create_session(employee), "employee": employee._asdict()}
+
+    async def list_clients(self, query, body):
+        after_id = _int_param(query, "after_id", 0)
+        limit = _int_param(query, "limit", 100, 1, MAX_PAGE_SIZE)
+        clients = await self.run_db(self.clients.list_page, after_id, limit)
+        return 200, {"clients": [_client_json(client) for client in clients]}
+
+    async def search_clients(self, query, body):
+        limit = _int_param(query, "limit", 100, 1, MAX_PAGE_SIZE)
+        clients = await self.run_db(self.clients.search, query.get("q", [""])[0], limit)
+        return 200, {"clients": [_client_json(client) for client in clients]}
+
+    async def client_changes(self, query, body):
+        # Without since only the current journal position is returned, to start from
+        if "since" not in query:
+            return 200, {"seq": await self.run_db(self.clients.latest_change), "changed": [], "removed": [],
+                         "complete": True}
+        changes = await self.run_db(self.clients.changes_since, _int_param(query, "since", 0))
+        return 200, {"seq": changes.seq,
+                     "changed": [_client_json(client) for client in changes.clients.values() if client is not None],
+                     "removed": [client_id for client_id, client in changes.clients.items() if client is None],
+                     "complete": changes.complete}
+
+    async def duplicate_clients(self, query, body):
+        name, email, phone = (query.get(field, [""])[0] for field in ("name", "email", "phone"))
+        clients = await self.run_db(self.clients.duplicates, name, email, phone)
+        return 200, {"clients": [_client_json(client) for client in clients]}
+
+    async def get_client(self, query, body, client_id):
+        return 200, _client_json(await self.run_db(self.clients.get, int(client_id)))
+
+    async def lookup_clients(self, query, body):
+        ids = body.get("ids") if isinstance(body, dict) else None
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            raise HttpError(400, "Verwacht {\"ids\": [...]} met getallen")
+        clients = await self.run_db(self.clients.get_many, ids)
+        return 200, {"clients": [_client_json(client) for client in clients]}
+
+    async def register_client(self, query, body):
+        client = await self.run_db(self.clients.register, *_client_fields(body))
+        return 201, _client_json(client)
+
+    async def register_batch(self, query, body):
+        rows = body.get("clients") if isinstance(body, dict) else None
+        if not isinstance(rows, list):
+            raise HttpError(400, "Verwacht {\"clients\": [...]}")
+        created, rejected = await self.run_db(self.clients.register_many, [_client_fields(row) for row in rows])
+        return 200, {"created": created,
+                     "rejected": [{"index": row.line, "reason": row.reason} for row in rejected]}
+
+    async def update_client(self, query, body, client_id):
+        client = await self.run_db(self.clients.update, int(client_id), *_client_fields(body))
+        return 200, _client_json(client)
+
+    async def remove_client(self, query, body, client_id):
+        await self.run_db(self.clients.remove, int(client_id))
+        return 204, None
+
+    async def cache_stats(self, query, body):
+        cache = self.clients.cache
+        return 200, cache.stats() if cache is not None else {}
+
+    async def metrics(self, query, body):
+        # A str payload is sent as text/plain
+        return 200, metrics.prometheus_text()
+
+    async def dispatch(self, method, target, headers, body):
+        url = urlsplit(target)
+        allowed = False
+        for route_method, pattern, handler, needs_login in self.routes:
+            match = pattern.fullmatch(url.path)
+            if not match:
+                continue
+            allowed = True
+            if route_method != method:
+                continue
+            if needs_login:
+                token = headers.get("authorization", "").removeprefix("Bearer ").strip()
+                if self.auth.employee_for_token(token) is None:
+                    raise HttpError(401, "Niet ingelogd")
+            try:
+                payload = json.loads(body) if body else None
+            except ValueError:
+                raise HttpError(400, "Ongeldige JSON")
+            if not metrics.ENABLED:
+                return await handler(parse_qs(url.query), payload, *match.groups())
+            start = time.perf_counter()
+            try:
+                return await handler(parse_qs(url.query), payload, *match.groups())
+            finally:
+                metrics.observe("handler", f"{method} {pattern.pattern}", time.perf_counter() - start)
+        if allowed:
+            raise HttpError(405, "Methode niet toegestaan")
+        raise HttpError(404, "Niet gevonden")
+
+    async def respond(self, method, target, headers, body):
+        try:
+            return await self.dispatch(method, target, headers, body)
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except ValidationError as e:
+            return 400, {"error": str(e)}
+        except NotFoundError as e:
+            return 404, {"error": str(e)}
+        except TooManyAttemptsError as e:
+            return 429, {"error": str(e)}
+        except Exception:
+            logger.exception("Unexpected error")
+            metrics.count_error("api")
+            return 500, {"error": "Er is een onverwachte fout opgetreden"}
+
+    async def read_request(self, reader):
+        """(method, target, version, headers, body), or None when the client is done.
+
+        An idle keep-alive connection is closed quietly after IDLE_TIMEOUT;
+        raises HttpError for requests that are malformed or over the limits.
+        """
+        try:
+            request_line = await asyncio.wait_for(_readline(reader), IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        if not request_line:
+            return None
+        method, target, version, headers = await asyncio.wait_for(self.read_head(reader, request_line),
+                                                                  HEADER_TIMEOUT)
+        body = await asyncio.wait_for(self.read_body(reader, headers), BODY_TIMEOUT)
+        return method, target, version, headers, body
+
+    async def read_head(self, reader, request_line):
+        parts = request_line.decode("latin-1").split()
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise HttpError(400, "Ongeldig verzoek")
+        size, count = len(request_line), 0
+        headers = {}
+        while True:
+            line = await _readline(reader)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            size += len(line)
+            count += 1
+            if size > MAX_HEADER_SIZE or count > MAX_HEADERS:
+                raise HttpError(431, "Headers te groot")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return (*parts, headers)
+
+    async def read_body(self, reader, headers):
+        encoding = headers.get("transfer-encoding", "").lower()
+        if encoding == "chunked":
+            return await self.read_chunked(reader)
+        if encoding:
+            raise HttpError(501, "Transfer-Encoding wordt niet ondersteund")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError(400, "Ongeldige Content-Length")
+        if length < 0:
+            raise HttpError(400, "Ongeldige Content-Length")
+        if length > MAX_BODY_SIZE:
+            raise HttpError(413, "Verzoek te groot")
+        return await reader.readexactly(length) if length else b""
+
+    async def read_chunked(self, reader):
+        body = bytearray()
+        while True:
+            try:
+                # Chunk extensions after ";" are ignored
+                size = int((await _readline(reader)).split(b";")[0], 16)
+            except ValueError:
+                raise HttpError(400, "Ongeldige chunk")
+            if size < 0:
+                raise HttpError(400, "Ongeldige chunk")
+            if len(body) + size > MAX_BODY_SIZE:
+                raise HttpError(413, "Verzoek te groot")
+            if size == 0:
+                break
+            body += await reader.readexactly(size)
+            if await _readline(reader) not in (b"\r\n", b"\n"):
+                raise HttpError(400, "Ongeldige chunk")
+        # Trailers are read and ignored
+        for _ in range(MAX_HEADERS + 1):
+            if await _readline(reader) in (b"\r\n", b"\n", b""):
+                return bytes(body)
+        raise HttpError(431, "Headers te groot")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, target, version, headers, body = request
+                except HttpError as e:
+                    # What is left of the request can't be trusted, the connection is closed
+                    status, payload = e.status, {"error": str(e)}
+                except asyncio.TimeoutError:
+                    status, payload = 408, {"error": "Het verzoek duurde te lang"}
+                else:
+                    status, payload = await self.respond(method, target, headers, body)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+
+                if isinstance(payload, str):
+                    data, content_type = payload.encode(), "text/plain; version=0.0.4"
+                else:
+                    data, content_type = b"" if payload is None else json.dumps(payload).encode(), "application/json"
+                head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: {len(data)}\r\n"
+                if data:
+                    head += f"Content-Type: {content_type}\r\n"
+                if not keep_alive:
+                    head += "Connection: close\r\n"
+                writer.write(head.encode("latin-1") + b"\r\n" + data)
+                # A client that doesn't read its responses is dropped as well
+                await asyncio.wait_for(writer.drain(), BODY_TIMEOUT)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass  # client went away or stopped reading
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080):
+        # limit caps the length of a single line, so an endless request line
+        # or header fails in _readline instead of filling memory
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_SIZE)
+        async with server:
+            await server.serve_forever()
+
+
+def create_server(storage: Storage = None):
+    storage = storage or get_storage()
+    clients = ClientService(storage.clients, ClientCache(storage.clients.data_version))
+    # SQLite repositories share one connection and stay on the database
+    # thread; pooled PostgreSQL ones get as many threads as connections
+    executor = db_executor
+    if storage.concurrent:
+        executor = ThreadPoolExecutor(max_workers=storage.pool_size, thread_name_prefix="api-db-worker")
+    return ApiServer(clients, AuthService(storage.employees), executor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP/JSON API voor de klantenregistratie")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    get_storage().migrate()
+    print(f"API luistert op http://{args.host}:{args.port}")
+    asyncio.run(create_server().serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
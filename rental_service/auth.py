@@ -0,0 +1,202 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from repositories import Employee, EmployeeRepository
+
+from .errors import TooManyAttemptsError
+
+# scrypt cost: n=2**15, r=8 takes 32 MB and roughly 150 ms per hash. The
+# parameters are stored with every hash, so raising them later only affects
+# new hashes; older ones are rehashed on the next login
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MAXMEM = 64 * 1024 * 1024
+SALT_BYTES = 16
+
+# Unknown usernames are checked against this hash of a random password, so
+# they take as long as known ones. Regenerate it when the parameters change
+DUMMY_HASH = ("scrypt$32768$8$1$ca46543140642b575a00c37e4e4c236e$50e576a0cd09db0df20a1bb9dc0ca650716454729aa0fa5f"
+              "1543d491b923733e6844716d8de9b2d9b9d351eebf6f04b16c0e4fa81cc893d901ed74b0d6918139")
+
+# A terminal that logs in again with the same password within this time
+# skips the KDF, see AuthService.login
+RELOGIN_SECONDS = 15 * 60
+RELOGIN_CACHE_SIZE = 64
+
+# API tokens
+SESSION_SECONDS = 12 * 3600
+MAX_SESSIONS = 10000
+
+# After FREE_ATTEMPTS failed logins a username is locked for LOCKOUT_SECONDS,
+# doubling with every further failure up to MAX_LOCKOUT_SECONDS. The count is
+# forgotten FAILURE_SECONDS after the last failure. Every username has a count
+# of its own; when MAX_TRACKED_USERNAMES are tracked, the oldest count that
+# doesn't lock its username makes room, so a flood of failures for made-up
+# usernames neither ends a lockout nor locks anyone else out
+FREE_ATTEMPTS = 5
+LOCKOUT_SECONDS = 1
+MAX_LOCKOUT_SECONDS = 300
+FAILURE_SECONDS = 15 * 60
+MAX_TRACKED_USERNAMES = 10000
+
+
+def hash_password(password: str) -> str:
+    """Salted scrypt hash as "scrypt$n$r$p$salt$key" (hex)."""
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = hashlib.scrypt(password.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, maxmem=SCRYPT_MAXMEM)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${key.hex()}"
+
+
+def verify_password(password: str, stored: str) -> bool:
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, key = stored.split("$")
+        computed = hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p),
+                                  maxmem=SCRYPT_MAXMEM)
+        return hmac.compare_digest(computed, bytes.fromhex(key))
+    # Unsalted sha256 hex digests of the first versions of the application
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+
+def needs_rehash(stored: str) -> bool:
+    return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+class Credentials(NamedTuple):
+    employee: Employee
+    password_hash: str
+
+
+class AuthService:
+    """Employee login and the session tokens used by the HTTP API.
+
+    login() is lookup() + verify() + save_hash(). verify() runs the KDF and
+    doesn't touch the database, so callers that share a database thread (the
+    API, the desktop login) run it elsewhere; hashlib.scrypt releases the GIL.
+    """
+
+    def __init__(self, repository: EmployeeRepository, clock=time.monotonic):
+        self.repository = repository
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()  # token -> (employee, expires at)
+        self.relogins = OrderedDict()  # HMAC of username and password -> (employee, password hash, expires at)
+        self.failures = OrderedDict()  # username -> (failed attempts, locked until, forget at), oldest first
+        # Key for the re-login cache, so it never holds anything derived from a password alone
+        self.relogin_key = secrets.token_bytes(32)
+
+    def login(self, username: str, password: str) -> Optional[Employee]:
+        credentials = self.lookup(username)
+        employee, new_hash = self.verify(username, password, credentials)
+        if new_hash is not None:
+            self.save_hash(employee.id, new_hash)
+        return employee
+
+    def lookup(self, username: str) -> Optional[Credentials]:
+        # Database part of login; raises TooManyAttemptsError before any work
+        self.check_throttle(username)
+        if not username:
+            return None
+        row = self.repository.find_by_username(username)
+        return Credentials(*row) if row else None
+
+    def verify(self, username: str, password: str,
+               credentials: Optional[Credentials]) -> Tuple[Optional[Employee], Optional[str]]:
+        """Check password; returns the employee or None, and a new hash to store if the old one is outdated."""
+        self.check_throttle(username)
+        if credentials is not None and password and self.is_recent_login(username, password, credentials):
+            return credentials.employee, None
+
+        stored = credentials.password_hash if credentials is not None else DUMMY_HASH
+        if not password or not verify_password(password, stored) or credentials is None:
+            self.record_failure(username)
+            return None, None
+
+        with self.lock:
+            self.failures.pop(username, None)
+        new_hash = hash_password(password) if needs_rehash(stored) else None
+        self.remember_login(username, password, credentials.employee, new_hash or stored)
+        return credentials.employee, new_hash
+
+    def save_hash(self, employee_id: int, password_hash: str):
+        self.repository.set_password_hash(employee_id, password_hash)
+
+    def relogin_token(self, username: str, password: str) -> bytes:
+        return hmac.new(self.relogin_key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def is_recent_login(self, username: str, password: str, credentials: Credentials) -> bool:
+        # The stored hash must still be the same: a changed password ends the shortcut
+        with self.lock:
+            entry = self.relogins.get(self.relogin_token(username, password))
+        return (entry is not None and entry[2] > self.clock() and entry[0] == credentials.employee
+                and entry[1] == credentials.password_hash)
+
+    def remember_login(self, username: str, password: str, employee: Employee, password_hash: str):
+        with self.lock:
+            token = self.relogin_token(username, password)
+            self.relogins[token] = (employee, password_hash, self.clock() + RELOGIN_SECONDS)
+            self.relogins.move_to_end(token)
+            if len(self.relogins) > RELOGIN_CACHE_SIZE:
+                self.relogins.popitem(last=False)
+
+    def check_throttle(self, username: str):
+        with self.lock:
+            _, locked_until, _ = self.failures.get(username, (0, 0.0, 0.0))
+        wait = locked_until - self.clock()
+        if wait > 0:
+            raise TooManyAttemptsError(f"Te veel mislukte pogingen, probeer het over {int(wait) + 1} seconden opnieuw")
+
+    def make_room(self, now: float):
+        # Called with self.lock held. Entries are in the order of their last
+        # failure, so the ones to forget come first
+        while self.failures:
+            username, (_, _, forget_at) = next(iter(self.failures.items()))
+            if forget_at > now:
+                break
+            del self.failures[username]
+        if len(self.failures) < MAX_TRACKED_USERNAMES:
+            return
+        # Locked usernames go last: only when every tracked username is locked
+        unlocked = (username for username, (_, locked_until, _) in self.failures.items() if locked_until <= now)
+        del self.failures[next(unlocked, next(iter(self.failures)))]
+
+    def record_failure(self, username: str):
+        with self.lock:
+            now = self.clock()
+            if username not in self.failures and len(self.failures) >= MAX_TRACKED_USERNAMES:
+                self.make_room(now)
+            attempts, _, forget_at = self.failures.pop(username, (0, 0.0, 0.0))
+            attempts = attempts + 1 if forget_at > now else 1
+            locked_until = 0.0
+            if attempts >= FREE_ATTEMPTS:
+                doublings = min(attempts - FREE_ATTEMPTS, MAX_LOCKOUT_SECONDS.bit_length())
+                lockout = min(LOCKOUT_SECONDS * 2 ** doublings, MAX_LOCKOUT_SECONDS)
+                locked_until = now + lockout
+            self.failures[username] = (attempts, locked_until, max(locked_until, now + FAILURE_SECONDS))
+
+    def create_session(self, employee: Employee) -> str:
+        token = secrets.token_urlsafe(32)
+        with self.lock:
+            self.sessions[token] = (employee, self.clock() + SESSION_SECONDS)
+            if len(self.sessions) > MAX_SESSIONS:
+                self.sessions.popitem(last=False)  # oldest session
+        return token
+
+    def employee_for_token(self, token: str) -> Optional[Employee]:
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if session[1] <= self.clock():
+                del self.sessions[token]
+                return None
+            return session[0]
+
+    def end_session(self, token: str):
+        with self.lock:
+            self.sessions.pop(token, None)
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+from repositories import Client
+from validation import phone_key
+
+_MISSING = object()
+
+
+class ClientCache:
+    """Bounded LRU cache of clients by id, and of phone key -> client id.
+
+    Clients are stored as the Client named tuples the repository returns. Phone
+    entries also remember that a phone is *not* registered (owner None), which
+    is what most uniqueness checks ask. ClientService invalidates entries on
+    every write it makes; changes made by other processes are noticed through
+    data_version (PRAGMA data_version), checked at most every check_interval
+    seconds, and clear the whole cache.
+    """
+
+    def __init__(self, data_version: Callable[[], int], capacity: int = 10000, check_interval: float = 0.5):
+        self.data_version = data_version
+        self.capacity = capacity
+        self.check_interval = check_interval
+        self.clients = OrderedDict()
+        self.phones = OrderedDict()  # phone key -> client id or None
+        self.phone_of_owner = {}  # client id -> phone key, for phone entries with an owner
+        self.lock = threading.Lock()
+        self.last_version = None
+        self.last_check = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def sync(self):
+        # Drop everything when another process changed the database
+        now = time.monotonic()
+        if now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+        version = self.data_version()
+        if version != self.last_version:
+            if self.last_version is not None:
+                self.clear()
+            self.last_version = version
+
+    def get(self, client_id: int) -> Optional[Client]:
+        with self.lock:
+            self.sync()
+            client = self.clients.get(client_id)
+            if client is None:
+                self.misses += 1
+                return None
+            self.clients.move_to_end(client_id)
+            self.hits += 1
+            return client
+
+    def put(self, client: Client):
+        with self.lock:
+            self.clients[client.id] = client
+            self.clients.move_to_end(client.id)
+            if len(self.clients) > self.capacity:
+                self.clients.popitem(last=False)
+            self._put_phone(phone_key(client.phone), client.id)
+
+    def phone_owner(self, phone: str) -> Tuple[bool, Optional[int]]:
+        """Return (cached, owner id); owner is None when the phone is free."""
+        with self.lock:
+            self.sync()
+            owner = self.phones.get(phone, _MISSING)
+            if owner is _MISSING:
+                self.misses += 1
+                return False, None
+            self.phones.move_to_end(phone)
+            self.hits += 1
+            return True, owner
+
+    def put_phone(self, phone: str, owner: Optional[int]):
+        with self.lock:
+            self._put_phone(phone, owner)
+
+    def _put_phone(self, phone, owner):
+        self._drop_phone(self.phone_of_owner.get(owner))
+        self._drop_phone(phone)
+        self.phones[phone] = owner
+        if owner is not None:
+            self.phone_of_owner[owner] = phone
+        if len(self.phones) > self.capacity:
+            self._drop_phone(next(iter(self.phones)))
+
+    def _drop_phone(self, phone):
+        owner = self.phones.pop(phone, None)
+        if owner is not None:
+            self.phone_of_owner.pop(owner, None)
+
+    def invalidate(self, client_id: int):
+        # Forget a client and the phone it was registered with
+        with self.lock:
+            self.invalidations += 1
+            self.clients.pop(client_id, None)
+            self._drop_phone(self.phone_of_owner.get(client_id))
+
+    def invalidate_phones(self, phones):
+        with self.lock:
+            self.invalidations += 1
+            for phone in phones:
+                self._drop_phone(phone)
+
+    def clear(self):
+        self.clients.clear()
+        self.phones.clear()
+        self.phone_of_owner.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "clients": len(self.clients),
+            "phones": len(self.phones),
+        }
@@ -0,0 +1,306 @@
+import sqlite3
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from repositories import Client, ClientRepository
+from validation import (EMAIL_PATTERN, RENTAL_TYPES, email_key, is_valid_email, is_valid_rental_type, normalize_phone,
+                        phone_key, similar_names)
+
+from .cache import ClientCache
+from .errors import NotFoundError, ValidationError
+
+ClientRow = Tuple[str, str, str, str]
+
+# More changes than this since the last poll are not applied one by one, the
+# caller reloads its list instead (after a bulk import on another terminal)
+CHANGES_LIMIT = 500
+
+
+class RejectedRow(NamedTuple):
+    line: int
+    row: ClientRow
+    reason: str
+
+
+class ClientChanges(NamedTuple):
+    seq: int  # pass as since to the next changes_since call
+    clients: Dict[int, Optional[Client]]  # changed client id -> current row, None when removed
+    complete: bool  # False when the changes could not be listed, reload everything
+
+
+def validate_batch(lines, rows, seen_phones, existing_phones):
+    """Split a batch into valid client rows and rejected rows.
+
+    Each rule runs as one comprehension over its column, then one pass
+    picks the first failing rule per row. The columns are short Python
+    strings, so this stays in plain Python: about 4 us per row, where pandas
+    took longer just to build the frame (see test_validate_batch in
+    benchmarks/bench_clients.py).
+
+    Phones are compared in E.164 form: existing_phones holds the phone keys
+    already registered, seen_phones the keys of earlier rows of the same
+    import; it is updated with the keys accepted here.
+    """
+    _, emails, phones, rental_types = zip(*rows)
+
+    complete = [all(row) for row in rows]
+    valid_email = [EMAIL_PATTERN.match(email) is not None for email in emails]
+    keys = [normalize_phone(phone) for phone in phones]
+    valid_type = [rental_type in RENTAL_TYPES for rental_type in rental_types]
+    in_database = [key in existing_phones for key in keys]
+
+    valid, rejected = [], []
+    for i, row in enumerate(rows):
+        if not complete[i]:
+            reason = "Niet alle velden zijn ingevuld"
+        elif not valid_email[i]:
+            reason = "Ongeldig email adres"
+        elif keys[i] is None:
+            reason = "Ongeldig telefoonnummer"
+        elif not valid_type[i]:
+            reason = "Ongeldig type fiets"
+        elif in_database[i]:
+            reason = "Dit nummer is al geregistreerd"
+        elif keys[i] in seen_phones:
+            reason = "Dit nummer komt dubbel voor in het bestand"
+        else:
+            seen_phones.add(keys[i])
+            valid.append(row)
+            continue
+        rejected.append(RejectedRow(lines[i], row, reason))
+    return valid, rejected
+
+
+class ClientService:
+    """Client registry rules on top of a ClientRepository, without any UI.
+
+    With a ClientCache, lookups by id and phone are served from memory and
+    every write made through the service invalidates the entries it touches.
+    """
+
+    def __init__(self, repository: ClientRepository, cache: Optional[ClientCache] = None):
+        self.repository = repository
+        self.cache = cache
+
+    def validate(self, name: str, email: str, phone: str, rental_type: str):
+        if not all([name, email, phone, rental_type]):
+            raise ValidationError("Vul alle velden in")
+        if not is_valid_email(email):
+            raise ValidationError("Vul een geldig email adres in")
+        if normalize_phone(phone) is None:
+            raise ValidationError("Vul een geldig telefoonnummer in")
+        if not is_valid_rental_type(rental_type):
+            raise ValidationError("Kies een geldig type fiets")
+
+    def is_phone_unique(self, phone: str, exclude_id: int = 0) -> bool:
+        if self.cache is None:
+            return not self.repository.phone_exists(phone, exclude_id)
+        key = phone_key(phone)
+        cached, owner = self.cache.phone_owner(key)
+        if not cached:
+            owner = self.repository.id_for_phone(phone)
+            self.cache.put_phone(key, owner)
+        return owner is None or owner == exclude_id
+
+    def duplicates(self, name: str, email: str, phone: str, exclude_id: int = 0) -> List[Client]:
+        """Registered clients that are probably the same person.
+
+        Candidates share the phone, the email or the name block (see
+        validation.name_key); of the last group only similar names are kept.
+        """
+        key, email = phone_key(phone.strip()), email_key(email)
+        return [client for client in self.repository.duplicate_candidates(name, email, phone.strip())
+                if client.id != exclude_id and (phone_key(client.phone) == key or email_key(client.email) == email
+                                                or similar_names(client.name, name))]
+
+    def find(self, client_id: int) -> Optional[Client]:
+        if self.cache is None:
+            return self.repository.get(client_id)
+        client = self.cache.get(client_id)
+        if client is None:
+            client = self.repository.get(client_id)
+            if client is not None:
+                self.cache.put(client)
+        return client
+
+    def get(self, client_id: int) -> Client:
+        client = self.find(client_id)
+        if client is None:
+            raise NotFoundError("Geen klanten gevonden met dit ID")
+        return client
+
+    def get_many(self, client_ids: Sequence[int]) -> List[Client]:
+        # Unknown ids are skipped
+        return [client for client in map(self.find, client_ids) if client is not None]
+
+    def list_page(self, after_id: int = 0, limit: int = 100) -> List[Client]:
+        return self.repository.list_page(after_id, limit)
+
+    def list_page_before(self, before_id: int, limit: int = 100) -> List[Client]:
+        return self.repository.list_page_before(before_id, limit)
+
+    def search(self, text: str, limit: int = 100) -> List[Client]:
+        return self.repository.search(text, limit)
+
+    def register(self, name: str, email: str, phone: str, rental_type: str) -> Client:
+        name, email, phone = name.strip(), email.strip(), phone.strip()
+        self.validate(name, email, phone, rental_type)
+        if not self.is_phone_unique(phone):
+            raise ValidationError("Dit nummer is al geregistreerd")
+        try:
+            client_id = self.repository.add(name, email, phone, rental_type)
+        except sqlite3.IntegrityError:
+            # Registered on another terminal after the check
+            raise ValidationError("Dit nummer is al geregistreerd")
+        finally:
+            # Also on failure: the cached "phone is free" was wrong
+            self.invalidate_phones([phone_key(phone)])
+        return self.find(client_id)
+
+    def update(self, client_id: int, name: str, email: str, phone: str, rental_type: str) -> Client:
+        name, email, phone = name.strip(), email.strip(), phone.strip()
+        self.validate(name, email, phone, rental_type)
+        # Check if phone is unique (excluding current client)
+        if not self.is_phone_unique(phone, exclude_id=client_id):
+            raise ValidationError(self.phone_taken_message(client_id, phone))
+        try:
+            updated = self.repository.update(client_id, name, email, phone, rental_type)
+        except sqlite3.IntegrityError:
+            # Registered on another terminal after the check
+            raise ValidationError(self.phone_taken_message(client_id, phone))
+        finally:
+            self.invalidate(client_id, phone_key(phone))
+        if not updated:
+            raise NotFoundError("Geen klanten gevonden met dit ID")
+        return self.find(client_id)
+
+    def phone_taken_message(self, client_id: int, phone: str) -> str:
+        # A client from before the phone check may still share its phone with
+        # another client (migration 009); saving it fails until one of them
+        # gets another number, so say which client has it
+        if self.repository.phone_conflict(client_id) == phone_key(phone):
+            owner = self.repository.id_for_phone(phone)
+            if owner is not None:
+                return (f"Dit nummer staat ook bij klant {owner} (van voor de controle op dubbele nummers). "
+                        f"Geef een van beide klanten een ander nummer of verwijder de dubbele klant")
+        return "Dit nummer is al geregistreerd"
+
+    def phone_conflicts(self) -> List[int]:
+        """Ids of the clients that share their phone with an older client, see phone_taken_message."""
+        return self.repository.phone_conflicts()
+
+    def remove(self, client_id: int):
+        removed = self.repository.remove(client_id)
+        self.invalidate(client_id)
+        if not removed:
+            raise NotFoundError("Geen klanten gevonden met dit ID")
+
+    def apply_edits(self, changes: Dict[int, Tuple[Client, Optional[Client]]]) -> Dict[int, Optional[Client]]:
+        """Save the changes of a ClientEdits (client id -> (row as loaded, new row)) in one transaction.
+
+        New rows are validated like update(). Nothing is saved when one of
+        them is invalid, or when another terminal changed or removed one of
+        the clients after it was loaded. Returns the saved rows, None for
+        removed clients.
+        """
+        updates, removed_ids = [], []
+        for client_id, (original, new) in changes.items():
+            if new is None:
+                removed_ids.append(client_id)
+                continue
+            new = Client(client_id, new.name.strip(), new.email.strip(), new.phone.strip(), new.rental_type)
+            try:
+                self.validate(*new[1:])
+            except ValidationError as e:
+                raise ValidationError(f"Klant {client_id}: {e}")
+            updates.append((original, new))
+
+        # A phone must not belong to a client outside this batch, nor appear
+        # twice in it. Unchanged phones are checked as well: clients in
+        # phone_conflicts share theirs with another client
+        edited = set(changes)
+        batch_phones = {}
+        for _, new in updates:
+            key = phone_key(new.phone)
+            if batch_phones.setdefault(key, new.id) != new.id:
+                raise ValidationError(f"Klant {new.id}: dit nummer komt dubbel voor in de wijzigingen")
+            owner = self.repository.id_for_phone(new.phone)
+            if owner is not None and owner != new.id and owner not in edited:
+                raise ValidationError(f"Klant {new.id}: {self.phone_taken_message(new.id, new.phone)}")
+
+        try:
+            saved = self.repository.apply_edits(updates, removed_ids)
+        except sqlite3.IntegrityError:
+            # The unique phone index is checked row by row: clients of the
+            # batch that swap phones have to be saved in two steps
+            raise ValidationError("Klanten in de wijzigingen ruilen van telefoonnummer, sla dit in twee stappen op")
+        finally:
+            for client_id, (original, new) in changes.items():
+                self.invalidate(client_id, *(phone_key(row.phone) for row in (original, new) if row is not None))
+        if not saved:
+            raise ValidationError("Een of meer klanten zijn intussen op een andere kassa gewijzigd, "
+                                  "laad de lijst opnieuw en probeer het nog eens")
+        return {client_id: None for client_id in removed_ids} | {new.id: new for _, new in updates}
+
+    def latest_change(self) -> int:
+        return self.repository.latest_change()
+
+    def changes_since(self, since: int, limit: int = CHANGES_LIMIT) -> ClientChanges:
+        """Clients changed by any terminal after journal entry since.
+
+        Several changes of one client collapse into its current row. The
+        changed clients are dropped from the cache as well.
+        """
+        rows = self.repository.changes_since(since, limit + 1)
+        if not rows:
+            return ClientChanges(since, {}, True)
+        if len(rows) > limit or (rows[0].seq > since + 1 and self.repository.oldest_change() > since + 1):
+            # Too many, or the entries after since were pruned already
+            if self.cache is not None:
+                with self.cache.lock:
+                    self.cache.clear()
+            return ClientChanges(self.repository.latest_change(), {}, False)
+
+        clients = {row.client_id: row.client for row in rows}
+        for client_id, client in clients.items():
+            self.invalidate(client_id, *([phone_key(client.phone)] if client is not None else []))
+        return ClientChanges(rows[-1].seq, clients, True)
+
+    def invalidate(self, client_id: int, *phone_keys: str):
+        if self.cache is not None:
+            self.cache.invalidate(client_id)
+            self.cache.invalidate_phones(phone_keys)
+
+    def invalidate_phones(self, phone_keys):
+        if self.cache is not None:
+            self.cache.invalidate_phones(phone_keys)
+
+    def register_many(self, rows: Sequence[ClientRow], lines: Optional[Sequence[int]] = None,
+                      seen_phones: Optional[Set[str]] = None) -> Tuple[int, List[RejectedRow]]:
+        """Validate a batch of (name, email, phone, rental_type) rows and insert the valid ones.
+
+        All valid rows are inserted in one transaction. lines numbers the rows
+        in the rejected list (default: their index). Pass the same seen_phones
+        set to consecutive calls to catch duplicates across batches. Returns
+        the number of inserted rows and the rejected rows.
+        """
+        if not rows:
+            return 0, []
+        rows = [tuple(str(value or "").strip() for value in row) for row in rows]
+        lines = list(lines) if lines is not None else list(range(len(rows)))
+        seen_phones = seen_phones if seen_phones is not None else set()
+        batch_phones = {normalize_phone(row[2]) for row in rows} - {None}
+
+        existing = self.repository.existing_phone_keys(batch_phones)
+        valid, rejected = validate_batch(lines, rows, set(seen_phones), existing)
+        try:
+            self.repository.add_many(valid)
+        except sqlite3.IntegrityError:
+            # Another terminal registered one of the phones in the meantime,
+            # the batch was rolled back so validate it again and retry
+            existing = self.repository.existing_phone_keys(batch_phones)
+            valid, rejected = validate_batch(lines, rows, set(seen_phones), existing)
+            self.repository.add_many(valid)
+        finally:
+            self.invalidate_phones(batch_phones)
+        seen_phones.update(normalize_phone(row[2]) for row in valid)
+        return len(valid), rejected
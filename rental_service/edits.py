@@ -0,0 +1,109 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from repositories import Client
+
+# Steps that can be undone; older ones stay queued but can't be taken back
+UNDO_STEPS = 100
+
+
+class Edit(NamedTuple):
+    client_id: int
+    before: Optional[Client]  # queued row before this edit
+    after: Optional[Client]  # queued row after it, None when the edit removes the client
+
+
+class ClientEdits:
+    """Unit of work for editing several clients at once, with undo and redo.
+
+    Edits only change the queued rows in memory. One call of update() or
+    remove() is one step, whatever the number of clients it touches, and
+    undo() / redo() take back or repeat a whole step. changes() is the net
+    result per client, which ClientService.apply_edits saves in a single
+    transaction.
+    """
+
+    def __init__(self, undo_steps: int = UNDO_STEPS):
+        self.undo_steps = undo_steps
+        self.originals = {}  # client id -> row as it was loaded, before the first edit
+        self.current = {}  # client id -> queued row, None when removed
+        self.undo_stack = []  # steps, lists of Edit
+        self.redo_stack = []
+
+    def __len__(self):
+        return len(self.changes())
+
+    @property
+    def can_undo(self) -> bool:
+        return bool(self.undo_stack)
+
+    @property
+    def can_redo(self) -> bool:
+        return bool(self.redo_stack)
+
+    def queued(self, client: Client) -> Optional[Client]:
+        """The queued row of a loaded client, None when it is to be removed."""
+        return self.current.get(client.id, client)
+
+    def update(self, clients: Iterable[Client], **values) -> List[Edit]:
+        """Set name, email, phone and/or rental_type of clients, as one step.
+
+        clients are the rows as loaded from the database. Clients queued for
+        removal and edits that change nothing are skipped.
+        """
+        clients = list(clients)
+        edits = []
+        for client in clients:
+            before = self.queued(client)
+            if before is not None and before._replace(**values) != before:
+                edits.append(Edit(client.id, before, before._replace(**values)))
+        return self.record(clients, edits)
+
+    def remove(self, clients: Iterable[Client]) -> List[Edit]:
+        clients = list(clients)
+        edits = [Edit(client.id, self.queued(client), None) for client in clients if self.queued(client) is not None]
+        return self.record(clients, edits)
+
+    def record(self, clients: List[Client], edits: List[Edit]) -> List[Edit]:
+        if not edits:
+            return edits
+        for client in clients:
+            self.originals.setdefault(client.id, client)
+        for edit in edits:
+            self.current[edit.client_id] = edit.after
+        self.undo_stack.append(edits)
+        del self.undo_stack[:-self.undo_steps]
+        self.redo_stack.clear()
+        return edits
+
+    def undo(self) -> Dict[int, Optional[Client]]:
+        """Take back the last step; returns the queued rows of the clients it touched."""
+        if not self.undo_stack:
+            return {}
+        edits = self.undo_stack.pop()
+        self.redo_stack.append(edits)
+        for edit in reversed(edits):
+            self.current[edit.client_id] = edit.before
+        return {edit.client_id: edit.before for edit in edits}
+
+    def redo(self) -> Dict[int, Optional[Client]]:
+        if not self.redo_stack:
+            return {}
+        edits = self.redo_stack.pop()
+        self.undo_stack.append(edits)
+        for edit in edits:
+            self.current[edit.client_id] = edit.after
+        return {edit.client_id: edit.after for edit in edits}
+
+    def changes(self) -> Dict[int, Tuple[Client, Optional[Client]]]:
+        """client id -> (row as loaded, queued row), for the clients that end up changed."""
+        return {client_id: (self.originals[client_id], row) for client_id, row in self.current.items()
+                if row != self.originals[client_id]}
+
+    def clear(self) -> Dict[int, Client]:
+        """Forget all edits; returns the loaded rows of every client that was edited."""
+        originals = {client_id: self.originals[client_id] for client_id in self.current}
+        self.originals.clear()
+        self.current.clear()
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+        return originals
@@ -0,0 +1,14 @@
+class ServiceError(Exception):
+    """Base class for errors with a message that can be shown to the user."""
+
+
+class ValidationError(ServiceError):
+    pass
+
+
+class NotFoundError(ServiceError):
+    pass
+
+
+class TooManyAttemptsError(ServiceError):
+    pass
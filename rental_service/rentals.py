@@ -0,0 +1,96 @@
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+from repositories import Bike, BikeRepository, Rental, RentalRepository
+from validation import RENTAL_TYPES, is_valid_rental_type
+
+from .clients import ClientService
+from .errors import NotFoundError, ValidationError
+
+# Attempts to find another free bike when a different terminal checked out
+# the chosen one between the availability query and the insert
+CHECK_OUT_ATTEMPTS = 3
+
+
+class RentalService:
+    """Check-out, check-in and availability of bikes; times are unix seconds."""
+
+    def __init__(self, bikes: BikeRepository, rentals: RentalRepository, clients: ClientService, clock=time.time):
+        self.bikes = bikes
+        self.rentals = rentals
+        self.clients = clients
+        self.clock = clock
+
+    def now(self) -> int:
+        return int(self.clock())
+
+    def validate_window(self, start: int, end: int):
+        if end <= start:
+            raise ValidationError("De eindtijd moet na de begintijd liggen")
+
+    def count_available(self, start: int, end: int) -> Dict[str, int]:
+        """Number of free bikes per rental type during [start, end)."""
+        self.validate_window(start, end)
+        counts = self.rentals.count_available(start, end, self.now())
+        return {rental_type: counts.get(rental_type, 0) for rental_type in RENTAL_TYPES}
+
+    def available(self, rental_type: str, start: int, end: int, limit: int = 100) -> List[Bike]:
+        self.validate_window(start, end)
+        return self.rentals.available(rental_type, start, end, self.now(), limit)
+
+    def bike_by_code(self, code: str) -> Bike:
+        bike = self.bikes.find_by_code(code.strip())
+        if bike is None:
+            raise NotFoundError("Geen fiets gevonden met deze code")
+        return bike
+
+    def add_bike(self, code: str, rental_type: str) -> Bike:
+        code = code.strip()
+        if not code:
+            raise ValidationError("Vul een code in")
+        if not is_valid_rental_type(rental_type):
+            raise ValidationError("Kies een geldig type fiets")
+        if self.bikes.find_by_code(code) is not None:
+            raise ValidationError("Deze code is al in gebruik")
+        return self.bikes.get(self.bikes.add(code, rental_type))
+
+    def check_out(self, client_id: int, rental_type: str, due_at: int, bike_code: Optional[str] = None) -> Rental:
+        """Rent a bike to a client until due_at.
+
+        With bike_code that bike is rented, otherwise the first free bike of
+        rental_type is chosen.
+        """
+        if not is_valid_rental_type(rental_type):
+            raise ValidationError("Kies een geldig type fiets")
+        self.clients.get(client_id)  # NotFoundError for unknown clients
+        now = self.now()
+        self.validate_window(now, due_at)
+
+        for _ in range(CHECK_OUT_ATTEMPTS):
+            if bike_code:
+                bike = self.bike_by_code(bike_code)
+                if bike.rental_type != rental_type or not bike.active:
+                    raise ValidationError("Deze fiets is niet van het gekozen type of niet in gebruik")
+            else:
+                free = self.rentals.available(rental_type, now, due_at, now, limit=1)
+                if not free:
+                    raise ValidationError("Er is geen fiets van dit type vrij")
+                bike = free[0]
+            try:
+                return self.rentals.get(self.rentals.add(bike.id, client_id, now, due_at))
+            except sqlite3.IntegrityError:
+                # idx_rentals_open: the bike already has an open rental
+                if bike_code:
+                    raise ValidationError("Deze fiets is al verhuurd")
+        raise ValidationError("Er is geen fiets van dit type vrij")
+
+    def check_in(self, bike_code: str) -> Rental:
+        bike = self.bike_by_code(bike_code)
+        rental = self.rentals.open_for_bike(bike.id)
+        if rental is None or not self.rentals.mark_returned(rental.id, self.now()):
+            raise ValidationError("Deze fiets is niet verhuurd")
+        return self.rentals.get(rental.id)
+
+    def open_rentals(self, client_id: int) -> List[Rental]:
+        return self.rentals.open_for_client(client_id)
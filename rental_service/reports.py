@@ -0,0 +1,79 @@
+from datetime import date, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from repositories import ReportRepository
+
+from .errors import ValidationError
+
+PERIODS = ("day", "week", "month")
+
+
+class PeriodTotals(NamedTuple):
+    start: date  # first day of the day, week (Monday) or month
+    registered: int
+    removed: int
+
+    @property
+    def net(self) -> int:
+        return self.registered - self.removed
+
+
+class Dashboard(NamedTuple):
+    clients_per_type: Dict[str, int]
+    total: int
+    days: List[PeriodTotals]  # every day of the period, oldest first
+    registered_this_week: int
+    registered_last_week: int
+
+    @property
+    def growth(self) -> Optional[float]:
+        # Change in registrations compared to the week before, None without data
+        if not self.registered_last_week:
+            return None
+        return self.registered_this_week / self.registered_last_week - 1
+
+
+def _period_start(day: date, period: str) -> date:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+class ReportService:
+    """Dashboard numbers from the summary tables.
+
+    The cost depends on the number of days asked for, not on the number of
+    clients: the triggers of migration 005 already did the counting.
+    """
+
+    def __init__(self, repository: ReportRepository, today=date.today):
+        self.repository = repository
+        self.today = today
+
+    def rollup(self, first_day: date, last_day: date, period: str = "day") -> List[PeriodTotals]:
+        """Registrations and removals per day, week or month, including empty periods."""
+        if period not in PERIODS:
+            raise ValidationError("Kies dag, week of maand")
+        if last_day < first_day:
+            raise ValidationError("De einddatum moet na de begindatum liggen")
+
+        totals = {}
+        day = first_day
+        while day <= last_day:
+            totals.setdefault(_period_start(day, period), [0, 0])
+            day += timedelta(days=1)
+        for row in self.repository.daily_counts(first_day.isoformat(), last_day.isoformat()):
+            counts = totals[_period_start(date.fromisoformat(row.day), period)]
+            counts[0] += row.registered
+            counts[1] += row.removed
+        return [PeriodTotals(start, registered, removed) for start, (registered, removed) in totals.items()]
+
+    def dashboard(self, days: int = 30) -> Dashboard:
+        today = self.today()
+        per_type = self.repository.clients_per_type()
+        history = self.rollup(today - timedelta(days=max(days, 14) - 1), today)
+        this_week = sum(day.registered for day in history[-7:])
+        last_week = sum(day.registered for day in history[-14:-7])
+        return Dashboard(per_type, sum(per_type.values()), history[-days:], this_week, last_week)
@@ -0,0 +1,496 @@
+"""Data-access layer for the bike rental application.
+
+All queries live in this module, the schema itself is managed by migrations.py.
+The application shares a single connection per process (see get_connection) so
+every window and every terminal action reuses the same page cache and prepared
+statements.
+"""
+import json
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import metrics
+from validation import client_keys, phone_key
+
+DB_PATH = 'bike_rental.db'
+
+# sqlite3 caches prepared statements per connection, keyed by the SQL text.
+# Keeping the statements as module constants means every call reuses them.
+STATEMENT_CACHE_SIZE = 256
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+class Client(NamedTuple):
+    id: int
+    name: str
+    email: str
+    phone: str
+    rental_type: str
+
+
+class Employee(NamedTuple):
+    id: int
+    username: str
+    is_admin: bool
+
+
+class ClientChange(NamedTuple):
+    seq: int
+    client_id: int
+    client: Optional[Client]  # current row, None when the client was removed
+
+
+class DeletedClient(NamedTuple):
+    id: int
+    name: str
+    email: str
+    phone: str
+    rental_type: str
+    created_at: Optional[int]  # unix seconds, None for clients from before migration 005
+    deleted_at: int
+
+
+class DailyCount(NamedTuple):
+    day: str  # YYYY-MM-DD, local date
+    rental_type: str
+    registered: int
+    removed: int
+
+
+class Bike(NamedTuple):
+    id: int
+    code: str
+    rental_type: str
+    active: bool
+
+
+class Rental(NamedTuple):
+    id: int
+    bike_id: int
+    client_id: int
+    start_at: int  # unix seconds
+    due_at: int
+    returned_at: Optional[int]  # None while the bike is out
+
+
+def open_connection(path: str = DB_PATH) -> sqlite3.Connection:
+    # check_same_thread is off so background workers can share the connection
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE,
+                           factory=metrics.InstrumentedConnection if metrics.ENABLED else sqlite3.Connection)
+    # WAL lets readers and a writer work at the same time instead of
+    # failing with "database is locked"
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-20000")  # negative value is in KiB, about 20 MB
+    conn.execute("PRAGMA mmap_size=268435456")  # 256 MB
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection() -> sqlite3.Connection:
+    # One connection per process, created on first use
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            _connection = open_connection()
+        return _connection
+
+
+def close_connection():
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+class EmployeeRepository:
+    # The password is checked by AuthService, the query only finds the hash
+    BY_USERNAME = "SELECT id, username, is_admin, password FROM employees WHERE username = ?"
+    SET_PASSWORD = "UPDATE employees SET password = ? WHERE id = ?"
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def find_by_username(self, username: str) -> Optional[Tuple[Employee, str]]:
+        """The employee and its password hash."""
+        row = self.conn.execute(self.BY_USERNAME, (username,)).fetchone()
+        return (Employee(*row[:3]), row[3]) if row else None
+
+    def set_password_hash(self, employee_id: int, password_hash: str) -> bool:
+        with self.conn:
+            cursor = self.conn.execute(self.SET_PASSWORD, (password_hash, employee_id))
+        return cursor.rowcount > 0
+
+
+class _EditConflict(Exception):
+    pass
+
+
+class ClientRepository:
+    COLUMNS = "id, name, email, phone, rental_type"
+
+    # created_at (unix seconds) feeds the registrations per day of the dashboard.
+    # The keys come from validation.client_keys (migration 008)
+    INSERT = """
+        INSERT INTO clients (name, email, phone, rental_type, phone_key, email_key, name_key, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))"""
+    UPDATE = """
+        UPDATE clients SET name = ?, email = ?, phone = ?, rental_type = ?, phone_key = ?, email_key = ?, name_key = ?
+        WHERE id = ?"""
+    # Only updates the row when it still has the values the edit started from
+    UPDATE_UNCHANGED = UPDATE + " AND name IS ? AND email IS ? AND phone IS ? AND rental_type IS ?"
+    DELETE = "DELETE FROM clients WHERE id = ?"
+    # Removing a client keeps its row in deleted_clients (migration 007)
+    SOFT_DELETE = """
+        INSERT INTO deleted_clients (id, name, email, phone, rental_type, created_at, deleted_at)
+        SELECT id, name, email, phone, rental_type, created_at, CAST(strftime('%s', 'now') AS INTEGER)
+        FROM clients WHERE id = ?"""
+    DELETED_COLUMNS = "id, name, email, phone, rental_type, created_at, deleted_at"
+    DELETED_BEFORE = f"""
+        SELECT {DELETED_COLUMNS} FROM deleted_clients
+        WHERE deleted_at < ? ORDER BY deleted_at LIMIT ?"""
+    COUNT_DELETED_BEFORE = "SELECT COUNT(*) FROM deleted_clients WHERE deleted_at < ?"
+    PURGE_DELETED = "DELETE FROM deleted_clients WHERE id IN (SELECT value FROM json_each(?))"
+    GET = f"SELECT {COLUMNS} FROM clients WHERE id = ?"
+    PAGE = f"SELECT {COLUMNS} FROM clients WHERE id > ? ORDER BY id LIMIT ?"
+    PAGE_BEFORE = f"SELECT {COLUMNS} FROM clients WHERE id < ? ORDER BY id DESC LIMIT ?"
+    ALL = f"SELECT {COLUMNS} FROM clients ORDER BY id"
+    COUNT = "SELECT COUNT(*) FROM clients"
+    COUNT_BY_TYPE = "SELECT COUNT(*) FROM clients WHERE rental_type = ?"
+    # Phones are compared by phone_key, so "06-12345678" is "0612345678"
+    PHONE_EXISTS = "SELECT EXISTS(SELECT 1 FROM clients WHERE phone_key = ? AND id != ?)"
+    ID_FOR_PHONE = "SELECT id FROM clients WHERE phone_key = ?"
+    # Clients from before migration 008 that share their phone with an older client (migration 009)
+    PHONE_CONFLICT = "SELECT phone_key FROM phone_conflicts WHERE client_id = ?"
+    PHONE_CONFLICTS = "SELECT client_id FROM phone_conflicts ORDER BY client_id"
+    # The keys are passed as one JSON array, so a whole batch is one query
+    EXISTING_PHONE_KEYS = "SELECT phone_key FROM clients WHERE phone_key IN (SELECT value FROM json_each(?))"
+    # Possible duplicates of a client: same phone, same email or same name
+    # block. SQLite answers the OR with one lookup in each of the three indexes
+    DUPLICATE_CANDIDATES = f"""
+        SELECT {COLUMNS} FROM clients
+        WHERE phone_key = ? OR email_key = ? OR name_key = ? ORDER BY id LIMIT ?"""
+    # COLLATE NOCASE matches idx_clients_email_nocase / idx_clients_name_nocase
+    BY_EMAIL = f"SELECT {COLUMNS} FROM clients WHERE email = ? COLLATE NOCASE ORDER BY id"
+    BY_NAME_PREFIX = f"SELECT {COLUMNS} FROM clients WHERE name LIKE ? ESCAPE '\\' ORDER BY name LIMIT ?"
+
+    # Ranking every match of a short, common prefix is what makes FTS slow on
+    # large tables, so only the first SEARCH_CANDIDATES matches are ranked.
+    # bm25 weights put name above email and phone.
+    SEARCH_CANDIDATES = 1000
+    SEARCH = f"""
+        SELECT {", ".join("c." + column for column in COLUMNS.split(", "))}
+        FROM (SELECT rowid, bm25(clients_fts, 10.0, 2.0, 1.0) AS score
+              FROM clients_fts WHERE clients_fts MATCH ? LIMIT {SEARCH_CANDIDATES}) AS hits
+        JOIN clients c ON c.id = hits.rowid
+        ORDER BY hits.score LIMIT ?"""
+
+    # Journal of changes, filled by the triggers of migration 006
+    CHANGES = f"""
+        SELECT ch.seq, ch.client_id, {", ".join("c." + column for column in COLUMNS.split(", "))}
+        FROM client_changes ch LEFT JOIN clients c ON c.id = ch.client_id
+        WHERE ch.seq > ? ORDER BY ch.seq LIMIT ?"""
+    LATEST_CHANGE = "SELECT IFNULL(MAX(seq), 0) FROM client_changes"
+    OLDEST_CHANGE = "SELECT MIN(seq) FROM client_changes"
+    PRUNE_CHANGES = "DELETE FROM client_changes WHERE seq <= ?"
+
+    # Search terms are split on anything that the FTS tokenizer treats as a separator
+    SEARCH_TOKEN = re.compile(r"\w+")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def get(self, client_id: int) -> Optional[Client]:
+        row = self.conn.execute(self.GET, (client_id,)).fetchone()
+        return Client(*row) if row else None
+
+    def list_page(self, after_id: int, limit: int) -> List[Client]:
+        # Keyset pagination: the next page starts after the last id seen
+        return [Client(*row) for row in self.conn.execute(self.PAGE, (after_id, limit))]
+
+    def list_page_before(self, before_id: int, limit: int) -> List[Client]:
+        # The page that ends just before before_id, in id order
+        return [Client(*row) for row in reversed(self.conn.execute(self.PAGE_BEFORE, (before_id, limit)).fetchall())]
+
+    def list_all(self) -> List[Client]:
+        return [Client(*row) for row in self.conn.execute(self.ALL)]
+
+    def count(self, rental_type: Optional[str] = None) -> int:
+        if rental_type is None:
+            return self.conn.execute(self.COUNT).fetchone()[0]
+        return self.conn.execute(self.COUNT_BY_TYPE, (rental_type,)).fetchone()[0]
+
+    def iter_batches(self, columns: Sequence[str], rental_type: Optional[str] = None,
+                     batch_size: int = 5000) -> Iterator[List[tuple]]:
+        # Streams rows with fetchmany so large tables never sit in memory at once
+        unknown = set(columns) - set(self.COLUMNS.split(", "))
+        if unknown:
+            raise ValueError(f"Unknown client columns: {', '.join(sorted(unknown))}")
+        sql = f"SELECT {', '.join(columns)} FROM clients"
+        params = ()
+        if rental_type is not None:
+            sql += " WHERE rental_type = ?"
+            params = (rental_type,)
+        cursor = self.conn.execute(sql + " ORDER BY id", params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def find_by_email(self, email: str) -> List[Client]:
+        return [Client(*row) for row in self.conn.execute(self.BY_EMAIL, (email,))]
+
+    def find_by_name_prefix(self, prefix: str, limit: int = 50) -> List[Client]:
+        # Escape LIKE wildcards so the prefix is matched literally
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return [Client(*row) for row in self.conn.execute(self.BY_NAME_PREFIX, (pattern, limit))]
+
+    def search(self, text: str, limit: int = 100) -> List[Client]:
+        # Every word must match as a prefix, results are ordered by bm25 rank
+        tokens = self.SEARCH_TOKEN.findall(text)
+        if not tokens:
+            return []
+        match = " ".join(f'"{token}"*' for token in tokens)
+        return [Client(*row) for row in self.conn.execute(self.SEARCH, (match, limit))]
+
+    def phone_exists(self, phone: str, exclude_id: int = 0) -> bool:
+        # exclude_id skips the client being updated; ids start at 1
+        return bool(self.conn.execute(self.PHONE_EXISTS, (phone_key(phone), exclude_id)).fetchone()[0])
+
+    def id_for_phone(self, phone: str) -> Optional[int]:
+        row = self.conn.execute(self.ID_FOR_PHONE, (phone_key(phone),)).fetchone()
+        return row[0] if row else None
+
+    def phone_conflict(self, client_id: int) -> Optional[str]:
+        """The phone key the client shares with an older client, see migration 009."""
+        row = self.conn.execute(self.PHONE_CONFLICT, (client_id,)).fetchone()
+        return row[0] if row else None
+
+    def phone_conflicts(self) -> List[int]:
+        # A handful at most, they are only left over from before migration 008
+        return [row[0] for row in self.conn.execute(self.PHONE_CONFLICTS)]
+
+    def duplicate_candidates(self, name: str, email: str, phone: str, limit: int = 50) -> List[Client]:
+        # Empty keys are passed as NULL, which matches nothing
+        keys = [key or None for key in client_keys(name, email, phone)]
+        return [Client(*row) for row in self.conn.execute(self.DUPLICATE_CANDIDATES, (*keys, limit))]
+
+    def data_version(self) -> int:
+        # Changes whenever another connection commits to the database
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def latest_change(self) -> int:
+        return self.conn.execute(self.LATEST_CHANGE).fetchone()[0]
+
+    def oldest_change(self) -> Optional[int]:
+        return self.conn.execute(self.OLDEST_CHANGE).fetchone()[0]
+
+    def changes_since(self, seq: int, limit: int) -> List[ClientChange]:
+        return [ClientChange(row[0], row[1], Client(*row[2:]) if row[2] is not None else None)
+                for row in self.conn.execute(self.CHANGES, (seq, limit))]
+
+    def prune_changes(self, keep: int) -> int:
+        # Keeps the last keep journal rows; a primary key range, no full scan
+        with self.conn:
+            cursor = self.conn.execute(self.PRUNE_CHANGES, (self.latest_change() - keep,))
+        return cursor.rowcount
+
+    def existing_phone_keys(self, keys: Iterable[str]) -> Set[str]:
+        rows = self.conn.execute(self.EXISTING_PHONE_KEYS, (json.dumps(list(keys)),))
+        return {row[0] for row in rows}
+
+    def add(self, name: str, email: str, phone: str, rental_type: str) -> int:
+        with self.conn:
+            cursor = self.conn.execute(self.INSERT, (name, email, phone, rental_type, *client_keys(name, email, phone)))
+        return cursor.lastrowid
+
+    def add_many(self, clients: Sequence[Tuple[str, str, str, str]]) -> int:
+        # One transaction for the whole batch of (name, email, phone, rental_type) rows
+        with self.conn:
+            self.conn.executemany(self.INSERT, ((name, email, phone, rental_type, *client_keys(name, email, phone))
+                                                for name, email, phone, rental_type in clients))
+        return len(clients)
+
+    def update(self, client_id: int, name: str, email: str, phone: str, rental_type: str) -> bool:
+        with self.conn:
+            cursor = self.conn.execute(self.UPDATE, (name, email, phone, rental_type,
+                                                     *client_keys(name, email, phone), client_id))
+        return cursor.rowcount > 0
+
+    def remove(self, client_id: int) -> bool:
+        with self.conn:
+            self.conn.execute(self.SOFT_DELETE, (client_id,))
+            cursor = self.conn.execute(self.DELETE, (client_id,))
+        return cursor.rowcount > 0
+
+    def apply_edits(self, updates: Sequence[Tuple[Client, Client]], removed_ids: Sequence[int]) -> bool:
+        """Update and remove several clients in one transaction, with executemany.
+
+        updates holds (row as loaded, new row) pairs. Returns False, and
+        changes nothing, when another connection changed one of the updated
+        clients or removed any of them in the meantime.
+        """
+        try:
+            with self.conn:
+                # Removals first, so their phones are free for the updates
+                if removed_ids:
+                    ids = [(client_id,) for client_id in removed_ids]
+                    self.conn.executemany(self.SOFT_DELETE, ids)
+                    if self.conn.executemany(self.DELETE, ids).rowcount != len(ids):
+                        raise _EditConflict()
+                if updates:
+                    rows = [(*new[1:], *client_keys(*new[1:4]), new.id, *old[1:]) for old, new in updates]
+                    if self.conn.executemany(self.UPDATE_UNCHANGED, rows).rowcount != len(rows):
+                        raise _EditConflict()
+        except _EditConflict:
+            return False
+        return True
+
+    def deleted_before(self, deleted_at: int, limit: int) -> List[DeletedClient]:
+        # Oldest first, from idx_deleted_clients_deleted_at
+        return [DeletedClient(*row) for row in self.conn.execute(self.DELETED_BEFORE, (deleted_at, limit))]
+
+    def count_deleted_before(self, deleted_at: int) -> int:
+        return self.conn.execute(self.COUNT_DELETED_BEFORE, (deleted_at,)).fetchone()[0]
+
+    def purge_deleted(self, client_ids: Iterable[int]) -> int:
+        with self.conn:
+            cursor = self.conn.execute(self.PURGE_DELETED, (json.dumps(list(client_ids)),))
+        return cursor.rowcount
+
+
+class BikeRepository:
+    COLUMNS = "id, code, rental_type, active"
+
+    INSERT = "INSERT INTO bikes (code, rental_type) VALUES (?, ?)"
+    GET = f"SELECT {COLUMNS} FROM bikes WHERE id = ?"
+    BY_CODE = f"SELECT {COLUMNS} FROM bikes WHERE code = ?"
+    SET_ACTIVE = "UPDATE bikes SET active = ? WHERE id = ?"
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def get(self, bike_id: int) -> Optional[Bike]:
+        row = self.conn.execute(self.GET, (bike_id,)).fetchone()
+        return Bike(*row) if row else None
+
+    def find_by_code(self, code: str) -> Optional[Bike]:
+        row = self.conn.execute(self.BY_CODE, (code,)).fetchone()
+        return Bike(*row) if row else None
+
+    def add(self, code: str, rental_type: str) -> int:
+        with self.conn:
+            cursor = self.conn.execute(self.INSERT, (code, rental_type))
+        return cursor.lastrowid
+
+    def add_many(self, bikes: Sequence[Tuple[str, str]]) -> int:
+        with self.conn:
+            self.conn.executemany(self.INSERT, bikes)
+        return len(bikes)
+
+    def set_active(self, bike_id: int, active: bool) -> bool:
+        with self.conn:
+            cursor = self.conn.execute(self.SET_ACTIVE, (active, bike_id))
+        return cursor.rowcount > 0
+
+
+class RentalRepository:
+    COLUMNS = "id, bike_id, client_id, start_at, due_at, returned_at"
+
+    INSERT = "INSERT INTO rentals (bike_id, client_id, start_at, due_at, returned_at) VALUES (?, ?, ?, ?, ?)"
+    RETURN = "UPDATE rentals SET returned_at = ? WHERE id = ? AND returned_at IS NULL"
+    GET = f"SELECT {COLUMNS} FROM rentals WHERE id = ?"
+    OPEN_FOR_BIKE = f"SELECT {COLUMNS} FROM rentals WHERE bike_id = ? AND returned_at IS NULL"
+    OPEN_FOR_CLIENT = f"""
+        SELECT {COLUMNS} FROM rentals
+        WHERE client_id = ? AND returned_at IS NULL ORDER BY start_at"""
+
+    # Bikes that are busy at some moment in [:start, :end). Open rentals come
+    # from the partial index idx_rentals_open (at most one row per bike) and
+    # count as busy until their due time; overdue ones until they are checked in.
+    # Returned rentals come from a range scan of idx_rentals_returned that
+    # starts at :start, so old history is never read for current windows.
+    BUSY_BIKES = """
+        SELECT bike_id FROM rentals
+        WHERE returned_at IS NULL AND start_at < :end AND (due_at <= :now OR due_at > :start)
+        UNION
+        SELECT bike_id FROM rentals
+        WHERE returned_at > :start AND start_at < :end"""
+    AVAILABLE = f"""
+        SELECT {", ".join("b." + column for column in BikeRepository.COLUMNS.split(", "))}
+        FROM bikes b
+        WHERE b.rental_type = :rental_type AND b.active AND b.id NOT IN ({BUSY_BIKES})
+        ORDER BY b.code LIMIT :limit"""
+    COUNT_AVAILABLE = f"""
+        SELECT rental_type, COUNT(*) FROM bikes
+        WHERE active AND id NOT IN ({BUSY_BIKES})
+        GROUP BY rental_type"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def get(self, rental_id: int) -> Optional[Rental]:
+        row = self.conn.execute(self.GET, (rental_id,)).fetchone()
+        return Rental(*row) if row else None
+
+    def open_for_bike(self, bike_id: int) -> Optional[Rental]:
+        row = self.conn.execute(self.OPEN_FOR_BIKE, (bike_id,)).fetchone()
+        return Rental(*row) if row else None
+
+    def open_for_client(self, client_id: int) -> List[Rental]:
+        return [Rental(*row) for row in self.conn.execute(self.OPEN_FOR_CLIENT, (client_id,))]
+
+    def available(self, rental_type: str, start: int, end: int, now: int, limit: int = 100) -> List[Bike]:
+        params = {"rental_type": rental_type, "start": start, "end": end, "now": now, "limit": limit}
+        return [Bike(*row) for row in self.conn.execute(self.AVAILABLE, params)]
+
+    def count_available(self, start: int, end: int, now: int) -> Dict[str, int]:
+        # rental type -> number of active bikes that are free during [start, end)
+        params = {"start": start, "end": end, "now": now}
+        return dict(self.conn.execute(self.COUNT_AVAILABLE, params).fetchall())
+
+    def add(self, bike_id: int, client_id: int, start_at: int, due_at: int) -> int:
+        # Raises sqlite3.IntegrityError when the bike already has an open rental
+        with self.conn:
+            cursor = self.conn.execute(self.INSERT, (bike_id, client_id, start_at, due_at, None))
+        return cursor.lastrowid
+
+    def add_many(self, rentals: Sequence[Tuple[int, int, int, int, Optional[int]]]) -> int:
+        # (bike_id, client_id, start_at, due_at, returned_at) rows, for history imports
+        with self.conn:
+            self.conn.executemany(self.INSERT, rentals)
+        return len(rentals)
+
+    def mark_returned(self, rental_id: int, returned_at: int) -> bool:
+        with self.conn:
+            cursor = self.conn.execute(self.RETURN, (returned_at, rental_id))
+        return cursor.rowcount > 0
+
+
+class ReportRepository:
+    # Reads the summary tables that migration 005 keeps current with triggers;
+    # none of these queries touch the clients table
+    TYPE_COUNTS = "SELECT rental_type, clients FROM client_type_counts WHERE clients > 0 ORDER BY rental_type"
+    DAILY = """
+        SELECT day, rental_type, registered, removed FROM client_daily_counts
+        WHERE day BETWEEN ? AND ? ORDER BY day, rental_type"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def clients_per_type(self) -> Dict[str, int]:
+        return dict(self.conn.execute(self.TYPE_COUNTS).fetchall())
+
+    def daily_counts(self, first_day: str, last_day: str) -> List[DailyCount]:
+        # Days without registrations or removals have no row
+        return [DailyCount(*row) for row in self.conn.execute(self.DAILY, (first_day, last_day))]
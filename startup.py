@@ -0,0 +1,92 @@
+"""Startup timing of the desktop application.
+
+main_biker_app imports this module first and marks the steps of its startup.
+With BIKE_RENTAL_STARTUP_REPORT=1 the marks are printed once the login form is
+on screen and the database is ready:
+
+    BIKE_RENTAL_STARTUP_REPORT=1 python main_biker_app.py
+
+Running this module prints which imports take the most time before the first
+frame, measured with python -X importtime in a fresh interpreter:
+
+    python startup.py [module] [--top 15]
+"""
+import os
+import sys
+import time
+from typing import List, NamedTuple
+
+STARTED = time.perf_counter()
+ENABLED = os.environ.get("BIKE_RENTAL_STARTUP_REPORT") == "1"
+
+# The report is printed once all of these have been marked
+REPORT_AFTER = ("first frame", "database ready")
+
+_marks = []
+_reported = False
+
+
+class ImportTime(NamedTuple):
+    module: str
+    depth: int  # 1 for modules imported by the measured module itself
+    self_us: int
+    cumulative_us: int
+
+
+def mark(name: str):
+    """Record that the startup step name is done, in milliseconds since STARTED."""
+    global _reported
+    _marks.append((name, (time.perf_counter() - STARTED) * 1000))
+    done = {name for name, _ in _marks}
+    if ENABLED and not _reported and done.issuperset(REPORT_AFTER):
+        _reported = True
+        print(report(), file=sys.stderr)
+
+
+def report() -> str:
+    lines = ["Startup (ms since the first import):"]
+    lines += [f"  {elapsed:8.1f}  {name}" for name, elapsed in _marks]
+    return "\n".join(lines)
+
+
+def import_times(module: str = "main_biker_app") -> List[ImportTime]:
+    """Import module in a new interpreter and return the -X importtime lines."""
+    import subprocess
+
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append(ImportTime(name.strip(), depth, int(self_us), int(cumulative_us)))
+    return times
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Toon welke imports de opstarttijd bepalen")
+    parser.add_argument("module", nargs="?", default="main_biker_app")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    total = next(t for t in times if t.module == args.module)
+    print(f"import {args.module}: {total.cumulative_us / 1000:.1f} ms")
+    print("\nDirect imports (cumulative ms):")
+    for t in sorted((t for t in times if t.depth == 1), key=lambda t: -t.cumulative_us)[:args.top]:
+        print(f"  {t.cumulative_us / 1000:8.1f}  {t.module}")
+    print("\nSlowest modules (own ms):")
+    for t in sorted(times, key=lambda t: -t.self_us)[:args.top]:
+        print(f"  {t.self_us / 1000:8.1f}  {t.module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Storage backends: the repositories of one database, on SQLite or PostgreSQL.
+
+BIKE_RENTAL_DATABASE_URL picks the database of the process:
+
+- a file path (default bike_rental.db): SQLite, the repositories of
+  repositories.py on the shared connection of get_connection,
+- a postgresql:// URL: a PostgreSQL server that several branches share, see
+  postgres_storage.py. Needs the packages psycopg and psycopg_pool.
+
+Both backends offer the same repositories with the same methods and raise the
+sqlite3 exceptions the services already handle, so nothing above this module
+knows which database it talks to.
+"""
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Iterator
+
+from repositories import (DB_PATH, BikeRepository, ClientRepository, EmployeeRepository, RentalRepository,
+                          ReportRepository, get_connection, open_connection)
+
+DATABASE_URL = os.environ.get("BIKE_RENTAL_DATABASE_URL", DB_PATH)
+
+_storages = {}  # database URL -> Storage
+_storages_lock = threading.Lock()
+
+
+def is_postgres(url: str) -> bool:
+    return url.startswith(("postgres://", "postgresql://"))
+
+
+class Storage(ABC):
+    """Repositories of one database, shared by all services of the process.
+
+    concurrent says whether the repositories may be used from several threads
+    at the same time. SQLite repositories share one connection and must only
+    be used from workers.db_executor; PostgreSQL ones take a connection from
+    the pool for every call.
+    """
+
+    concurrent = False
+    pool_size = 1
+
+    clients: ClientRepository
+    employees: EmployeeRepository
+    bikes: BikeRepository
+    rentals: RentalRepository
+    reports: ReportRepository
+
+    @abstractmethod
+    def migrate(self) -> int:
+        """Bring the schema up to date and return its version."""
+
+    @abstractmethod
+    def client_session(self, snapshot: bool = False):
+        """Context manager with a ClientRepository on a connection of its own.
+
+        For background jobs (export, import, archive) that run next to the
+        terminal's own queries. With snapshot=True every read sees the same
+        consistent state of the database until the session ends.
+        """
+
+    def interrupt(self):
+        # Aborts the query running on the shared connection, if the backend can
+        pass
+
+    def close(self):
+        pass
+
+
+class SqliteStorage(Storage):
+    def __init__(self, path: str = DB_PATH, conn: sqlite3.Connection = None):
+        self.path = path
+        self.conn = conn if conn is not None else open_connection(path)
+        self.clients = ClientRepository(self.conn)
+        self.employees = EmployeeRepository(self.conn)
+        self.bikes = BikeRepository(self.conn)
+        self.rentals = RentalRepository(self.conn)
+        self.reports = ReportRepository(self.conn)
+
+    def migrate(self) -> int:
+        from migrations import migrate
+
+        return migrate(self.conn)
+
+    def client_session(self, snapshot: bool = False):
+        return _sqlite_client_session(self.path, snapshot)
+
+    def interrupt(self):
+        self.conn.interrupt()
+
+    def close(self):
+        self.conn.close()
+
+
+def open_storage(url: str = DATABASE_URL) -> Storage:
+    """A new Storage for url; most code wants the shared one from get_storage."""
+    if is_postgres(url):
+        try:
+            from postgres_storage import PostgresStorage
+        except ImportError:
+            raise RuntimeError("Voor PostgreSQL zijn de pakketten 'psycopg' en 'psycopg_pool' nodig")
+        return PostgresStorage(url)
+    return SqliteStorage(url)
+
+
+def get_storage(url: str = DATABASE_URL) -> Storage:
+    # One Storage per database and process, created on first use. The default
+    # SQLite database uses the shared connection of repositories.get_connection
+    with _storages_lock:
+        storage = _storages.get(url)
+        if storage is None:
+            storage = SqliteStorage(url, get_connection()) if url == DB_PATH else open_storage(url)
+            _storages[url] = storage
+        return storage
+
+
+def client_session(url: str = DATABASE_URL, snapshot: bool = False):
+    """Storage.client_session of the database at url (a file path or a postgresql:// URL)."""
+    if is_postgres(url):
+        return get_storage(url).client_session(snapshot)
+    # SQLite sessions only need the path, not the shared connection
+    return _sqlite_client_session(url, snapshot)
+
+
+@contextmanager
+def _sqlite_client_session(path: str, snapshot: bool) -> Iterator[ClientRepository]:
+    conn = open_connection(path)
+    try:
+        if snapshot:
+            # In WAL mode a read transaction pins one snapshot; it starts at
+            # the first read, not at BEGIN
+            conn.execute("BEGIN")
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        yield ClientRepository(conn)
+    finally:
+        conn.close()
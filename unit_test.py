@@ -1,6 +1,34 @@
 import pytest
 
 import main_biker_app
+import asyncio
+import csv
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+
+import archive
+import backup
+import exporter
+import importer
+import metrics
+import migrations
+import repositories
+import startup
+import storage
+import validation
+import workers
+from rental_service import (AuthService, ClientCache, ClientEdits, ClientService, NotFoundError, RentalService,
+                            ReportService, ValidationError)
+from rental_service import auth as auth_module
+from rental_service.api import ApiServer
 from main_biker_app import *
 
 @pytest.mark.parametrize("input,expected", [
@@ -23,3 +51,840 @@ def test_valid_email(input, expected):
 def test_valid_rental_type(input, expected):
     is_valid = input in ["Bike", "Electric Bike"]
     assert is_valid == expected
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "test.db")
+
+
+@pytest.fixture
+def client_repo(db_path):
+    conn = repositories.open_connection(db_path)
+    migrations.migrate(conn)
+    repo = repositories.ClientRepository(conn)
+    yield repo
+    conn.close()
+
+
+def test_connection_uses_wal(client_repo):
+    assert client_repo.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_client_repository_crud(client_repo):
+    client_id = client_repo.add("Test Klant", "test@test.com", "0611111111", "Bike")
+    assert client_repo.get(client_id).email == "test@test.com"
+    assert client_repo.phone_exists("0611111111")
+    assert not client_repo.phone_exists("0611111111", exclude_id=client_id)
+
+    assert client_repo.update(client_id, "Test Klant", "nieuw@test.com", "0611111111", "Electric Bike")
+    assert client_repo.get(client_id).rental_type == "Electric Bike"
+
+    assert client_repo.remove(client_id)
+    assert client_repo.get(client_id) is None
+    assert not client_repo.remove(client_id)
+
+
+def test_client_repository_keyset_pages(client_repo):
+    first_page = client_repo.list_page(0, 4)
+    second_page = client_repo.list_page(first_page[-1].id, 4)
+    assert [c.id for c in first_page + second_page] == [c.id for c in client_repo.list_all()]
+    # And back again, for a list that dropped the first page
+    assert client_repo.list_page_before(second_page[0].id, 4) == first_page
+    assert client_repo.list_page_before(first_page[0].id, 4) == []
+
+
+def test_migrations_run_once(client_repo):
+    conn = client_repo.conn
+    assert migrations.migrate(conn) == len(migrations.MIGRATIONS)
+    client_repo.remove(1)
+    # Running again must not re-seed the removed dummy client
+    migrations.migrate(conn)
+    assert client_repo.get(1) is None
+
+
+def test_client_lookups_use_indexes(client_repo):
+    assert [c.name for c in client_repo.find_by_email("GUUS@guus.com")] == ["Guus S"]
+    assert [c.name for c in client_repo.find_by_name_prefix("em")] == ["Emma Smith"]
+    plan = client_repo.conn.execute("EXPLAIN QUERY PLAN " + client_repo.BY_EMAIL, ("x",)).fetchall()
+    assert "idx_clients_email_nocase" in plan[0][3]
+
+
+def test_client_search_is_kept_in_sync(client_repo):
+    client_id = client_repo.add("Zoë de Jong", "zoe@voorbeeld.nl", "0655555555", "Bike")
+    assert [c.id for c in client_repo.search("zoe jo")] == [client_id]
+    assert [c.id for c in client_repo.search("065555")] == [client_id]
+
+    client_repo.update(client_id, "Zoë Visser", "zoe@voorbeeld.nl", "0655555555", "Bike")
+    assert client_repo.search("jong") == []
+    assert [c.id for c in client_repo.search("visser")] == [client_id]
+
+    client_repo.remove(client_id)
+    assert client_repo.search("zoe") == []
+    assert client_repo.search("  ") == []
+
+
+def test_export_csv_in_batches(client_repo, db_path, tmp_path):
+    path = tmp_path / "clients.csv"
+    progress = []
+    count = exporter.export_clients(str(path), "csv", ["id", "name"], rental_type="Electric Bike",
+                                    progress=lambda done, total: progress.append((done, total)),
+                                    batch_size=1, db_path=db_path)
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = list(csv.reader(f))
+    assert count == 2
+    assert rows == [["ID", "Name"], ["3", "Emma Smith"], ["5", "Sarah Williams"]]
+    assert progress == [(1, 2), (2, 2)]
+
+
+def test_export_xlsx_and_cancel(client_repo, db_path, tmp_path, monkeypatch):
+    openpyxl = pytest.importorskip("openpyxl")
+    path = tmp_path / "clients.xlsx"
+    assert exporter.export_clients(str(path), "xlsx", db_path=db_path) == 6
+    sheet = openpyxl.load_workbook(path)["Clients"]
+    assert [cell.value for cell in sheet[1]] == list(exporter.EXPORT_COLUMNS.values())
+    assert sheet.max_row == 7
+
+    # Beyond the row limit of a sheet the export continues on the next one
+    monkeypatch.setattr(exporter, "XLSX_SHEET_ROWS", 4)
+    assert exporter.export_clients(str(path), "xlsx", ["id"], batch_size=3, db_path=db_path) == 6
+    workbook = openpyxl.load_workbook(path)
+    assert workbook.sheetnames == ["Clients", "Clients 2"]
+    assert [[cell.value for cell in row] for row in workbook["Clients"].iter_rows()] == [["ID"], [1], [2], [3], [4]]
+    assert [[cell.value for cell in row] for row in workbook["Clients 2"].iter_rows()] == [["ID"], [5], [6]]
+
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(exporter.ExportCancelled):
+        exporter.export_clients(str(tmp_path / "cancelled.csv"), "csv", cancel_event=cancel, db_path=db_path)
+    assert not (tmp_path / "cancelled.csv").exists()
+
+
+def test_import_xlsx_reads_numeric_phone_cells(client_repo, db_path, tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    path = tmp_path / "import.xlsx"
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["Naam", "Email", "Telefoon", "Type Fiets"])
+    # Excel keeps 0612345670 typed into a number cell as 612345670
+    sheet.append(["Anna", "anna@test.nl", 612345670, "Bike"])
+    sheet.append(["Bert", "bert@test.nl", 612345671.0, "Bike"])
+    sheet.append(["Carla", "carla@test.nl", "06-12345672", "Bike"])
+    workbook.save(path)
+
+    result = importer.import_clients(str(path), db_path=db_path)
+
+    assert result.imported == 3 and result.rejected == []
+    assert [client.phone for client in client_repo.list_all()[-3:]] == ["0612345670", "0612345671", "06-12345672"]
+
+
+def test_import_rejects_invalid_and_duplicate_rows(client_repo, db_path, tmp_path):
+    path = tmp_path / "import.csv"
+    path.write_text(
+        "Name,Email,Phone,Rental Type\n"
+        "Anna,anna@test.nl,0600000001,Bike\n"
+        "Bert,geen-email,0600000002,Bike\n"
+        "Carla,carla@test.nl,0600000001,Bike\n"
+        "Dirk,dirk@test.nl,0612345678,Bike\n"
+        "Eva,eva@test.nl,0600000003,Car\n"
+        "Fenna,fenna@test.nl,0600000004,Electric Bike\n",
+        encoding="utf-8")
+
+    report_path = str(tmp_path / "import_afgewezen.csv")
+    result = importer.import_clients(str(path), batch_size=3, db_path=db_path, report_path=report_path)
+
+    assert result.imported == 2
+    assert [(row.line, row.reason) for row in result.rejected] == [
+        (3, "Ongeldig email adres"),
+        (4, "Dit nummer komt dubbel voor in het bestand"),
+        (5, "Dit nummer is al geregistreerd"),
+        (6, "Ongeldig type fiets"),
+    ]
+    assert client_repo.count() == 8
+    # Written by the import itself, not by the window that started it
+    assert result.report_path == report_path
+    with open(report_path, newline="", encoding="utf-8-sig") as f:
+        assert [row[:2] for row in csv.reader(f)][1:] == [[str(row.line), row.reason] for row in result.rejected]
+
+
+class FakeWidget:
+    # Stands in for a Tk widget: after() callbacks are run by run_pending()
+    def __init__(self):
+        self.pending = {}
+        self.next_id = 0
+
+    def after(self, ms, callback):
+        self.next_id += 1
+        self.pending[self.next_id] = callback
+        return self.next_id
+
+    def after_cancel(self, after_id):
+        self.pending.pop(after_id, None)
+
+    def run_pending(self, runner):
+        while runner.tasks:
+            for after_id in list(self.pending):
+                self.pending.pop(after_id)()
+
+
+def test_task_runner_reports_results_in_calling_thread():
+    widget = FakeWidget()
+    busy_changes, results = [], []
+    runner = workers.TaskRunner(widget, on_busy_changed=busy_changes.append)
+
+    runner.submit(lambda: threading.current_thread().name, on_success=results.append)
+    runner.submit(lambda: 1 / 0, on_error=lambda e: results.append(type(e)), busy=False)
+    widget.run_pending(runner)
+
+    assert results[0].startswith("db-worker")
+    assert results[1] is ZeroDivisionError
+    assert busy_changes == [True, False]
+
+
+def test_task_runner_cancel_sets_event_and_skips_success():
+    widget = FakeWidget()
+    runner = workers.TaskRunner(widget)
+    started, event, outcome = threading.Event(), threading.Event(), []
+
+    def work():
+        started.set()
+        event.wait(5)
+        return "done"
+
+    task = runner.submit(work, on_success=outcome.append, on_cancelled=lambda: outcome.append("cancelled"),
+                         executor=workers.io_executor, cancel_event=event)
+    started.wait(5)
+    task.cancel()
+    widget.run_pending(runner)
+    assert outcome == ["cancelled"]
+
+
+@pytest.fixture
+def client_service(client_repo):
+    return ClientService(client_repo)
+
+
+def test_client_service_validates_before_saving(client_service):
+    with pytest.raises(ValidationError, match="email"):
+        client_service.register("Anna", "anna@", "0600000001", "Bike")
+    with pytest.raises(ValidationError, match="al geregistreerd"):
+        client_service.register("Anna", "anna@test.nl", "0612345678", "Bike")
+
+    client = client_service.register(" Anna ", "anna@test.nl", "0600000001", "Bike")
+    assert client.name == "Anna"
+    with pytest.raises(NotFoundError):
+        client_service.update(9999, "Anna", "anna@test.nl", "0600000002", "Bike")
+
+
+def test_register_after_another_terminal_took_the_phone(client_repo, db_path):
+    # The cache still says the phone is free when the other terminal registers it
+    service = ClientService(client_repo, ClientCache(client_repo.data_version, check_interval=3600))
+    assert service.is_phone_unique("0600000009")
+    other = repositories.open_connection(db_path)
+    repositories.ClientRepository(other).add("Bert", "bert@test.nl", "0600000009", "Bike")
+    other.close()
+
+    with pytest.raises(ValidationError, match="al geregistreerd"):
+        service.register("Anna", "anna@test.nl", "06-00000009", "Bike")
+    assert not service.is_phone_unique("0600000009")
+
+
+def test_api_requires_login_and_serves_clients(client_service):
+    auth = AuthService(repositories.EmployeeRepository(client_service.repository.conn))
+    server = ApiServer(client_service, auth)
+
+    async def request(reader, writer, method, path, body=None, token=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\n"
+        if token:
+            head += f"Authorization: Bearer {token}\r\n"
+        writer.write(head.encode() + b"\r\n" + data)
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while (line := await reader.readline()) != b"\r\n":
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        return status, json.loads(await reader.readexactly(length)) if length else None
+
+    async def scenario():
+        listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+        try:
+            assert (await request(reader, writer, "GET", "/clients/1"))[0] == 401
+            status, body = await request(reader, writer, "POST", "/login",
+                                         {"username": "admin", "password": "admin123"})
+            token = body["token"]
+
+            status, body = await request(reader, writer, "GET", "/clients/1", token=token)
+            assert (status, body["name"]) == (200, "Guus S")
+
+            # A negative LIMIT would return the whole table
+            for path in ("/clients?limit=-1", "/clients?limit=0", "/clients?after_id=-1",
+                         "/clients/search?q=guus&limit=-1"):
+                assert (await request(reader, writer, "GET", path, token=token))[0] == 400, path
+            status, body = await request(reader, writer, "GET", "/clients?limit=1", token=token)
+            assert (status, len(body["clients"])) == (200, 1)
+
+            new_client = {"name": "Anna", "email": "anna@test.nl", "phone": "0600000001", "rental_type": "Bike"}
+            status, body = await request(reader, writer, "POST", "/clients/batch",
+                                         {"clients": [new_client, new_client]}, token=token)
+            assert body["created"] == 1
+            assert body["rejected"] == [{"index": 1, "reason": "Dit nummer komt dubbel voor in het bestand"}]
+
+            status, body = await request(reader, writer, "POST", "/clients", new_client, token=token)
+            assert (status, body["error"]) == (400, "Dit nummer is al geregistreerd")
+            assert (await request(reader, writer, "DELETE", "/clients/9999", token=token))[0] == 404
+        finally:
+            writer.close()
+            listener.close()
+            await listener.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_api_cuts_off_slow_and_oversized_requests(client_service, monkeypatch):
+    from rental_service import api
+
+    monkeypatch.setattr(api, "HEADER_TIMEOUT", 0.2)
+    monkeypatch.setattr(api, "IDLE_TIMEOUT", 0.2)
+    server = ApiServer(client_service, AuthService(repositories.EmployeeRepository(client_service.repository.conn)))
+
+    async def exchange(address, data, wait=0):
+        reader, writer = await asyncio.open_connection(*address)
+        try:
+            writer.write(data)
+            await asyncio.sleep(wait)
+            # The server answers and closes, or just closes
+            return await asyncio.wait_for(reader.read(), 5)
+        finally:
+            writer.close()
+
+    async def scenario():
+        listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0, limit=api.MAX_HEADER_SIZE)
+        address = listener.sockets[0].getsockname()[:2]
+        try:
+            body = json.dumps({"username": "admin", "password": "admin123"}).encode()
+            chunked = (b"POST /login HTTP/1.1\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n"
+                       + b"%x\r\n" % 10 + body[:10] + b"\r\n"
+                       + b"%x;ext=1\r\n" % (len(body) - 10) + body[10:] + b"\r\n0\r\n\r\n")
+            assert b'"token"' in await exchange(address, chunked)
+
+            # Headers that never end, too many headers, a header over the line limit
+            slow = await exchange(address, b"GET /clients HTTP/1.1\r\nHost: x\r\n", wait=0.5)
+            assert slow.startswith(b"HTTP/1.1 408")
+            many = b"GET /clients HTTP/1.1\r\n" + b"X-A: b\r\n" * (api.MAX_HEADERS + 1) + b"\r\n"
+            assert (await exchange(address, many)).startswith(b"HTTP/1.1 431")
+            long = b"GET /clients HTTP/1.1\r\nX-A: " + b"a" * api.MAX_HEADER_SIZE + b"\r\n\r\n"
+            assert (await exchange(address, long)).startswith(b"HTTP/1.1 431")
+            # An idle keep-alive connection is closed without an answer
+            assert await exchange(address, b"", wait=0.5) == b""
+        finally:
+            listener.close()
+            await listener.wait_closed()
+
+    asyncio.run(scenario())
+
+
+def test_client_cache_invalidation(client_repo, db_path):
+    cache = ClientCache(client_repo.data_version, capacity=2, check_interval=0)
+    service = ClientService(client_repo, cache)
+
+    assert service.get(1).name == "Guus S"
+    assert service.get(1).name == "Guus S"
+    assert service.is_phone_unique("0600000001")
+    assert cache.stats()["hits"] == 1
+
+    # Writes through the service update the cache precisely
+    client = service.register("Anna", "anna@test.nl", "0600000001", "Bike")
+    assert not service.is_phone_unique("0600000001")
+    service.update(client.id, "Anna", "anna@test.nl", "0600000002", "Bike")
+    assert service.is_phone_unique("0600000001")
+    assert service.get(client.id).phone == "0600000002"
+
+    # Writes by another connection clear it through PRAGMA data_version
+    other = repositories.open_connection(db_path)
+    repositories.ClientRepository(other).update(1, "Guus", "guus@guus.com", "123", "Bike")
+    other.close()
+    assert service.get(1).name == "Guus"
+    assert len(cache.clients) <= 2
+
+
+def test_startup_defers_admin_imports():
+    times = {t.module: t for t in startup.import_times("main_biker_app")}
+    assert times["main_biker_app"].depth == 0
+    assert times["workers"].depth == 1
+    # Only needed for export and import, which load them on first use
+    for module in ("exporter", "importer", "openpyxl", "tkinter.filedialog"):
+        assert module not in times
+
+
+def test_rentals_availability_check_out_and_check_in(client_service):
+    conn = client_service.repository.conn
+    clock = [1_700_000_000]
+    rentals = RentalService(repositories.BikeRepository(conn), repositories.RentalRepository(conn),
+                            client_service, clock=lambda: clock[0])
+    hour = 3600
+    now = clock[0]
+    assert rentals.count_available(now, now + hour) == {"Bike": 5, "Electric Bike": 5}
+
+    rental = rentals.check_out(1, "Electric Bike", now + 3 * hour, bike_code="E001")
+    with pytest.raises(ValidationError, match="al verhuurd"):
+        rentals.check_out(2, "Electric Bike", now + hour, bike_code="E001")
+    with pytest.raises(NotFoundError):
+        rentals.check_out(9999, "Bike", now + hour)
+    assert rentals.count_available(now + hour, now + 2 * hour)["Electric Bike"] == 4
+    # Expected back by then
+    assert rentals.count_available(now + 4 * hour, now + 5 * hour)["Electric Bike"] == 5
+
+    # Overdue bikes stay busy until they are checked in
+    clock[0] = now + 4 * hour
+    assert rentals.count_available(clock[0], clock[0] + hour)["Electric Bike"] == 4
+    assert rentals.check_in("E001").returned_at == clock[0]
+    with pytest.raises(ValidationError, match="niet verhuurd"):
+        rentals.check_in("E001")
+
+    # The finished rental only counts for windows it overlaps
+    assert rentals.count_available(now + hour, now + 2 * hour)["Electric Bike"] == 4
+    assert rentals.count_available(clock[0] + 1, clock[0] + hour)["Electric Bike"] == 5
+    assert rentals.open_rentals(1) == []
+    assert rental.bike_id == rentals.bike_by_code("E001").id
+
+
+def test_report_summary_tables_follow_client_changes(client_service):
+    conn = client_service.repository.conn
+    reports = ReportService(repositories.ReportRepository(conn))
+    dashboard = reports.dashboard()
+    assert dashboard.clients_per_type == {"Bike": 4, "Electric Bike": 2}
+    assert dashboard.registered_this_week == 0  # the dummy clients have no registration date
+
+    client = client_service.register("Anna", "anna@test.nl", "0600000001", "Bike")
+    client_service.repository.add_many([("Bert", "bert@test.nl", "0600000002", "Electric Bike")])
+    client_service.update(client.id, "Anna", "anna@test.nl", "0600000001", "Electric Bike")
+    client_service.remove(2)
+
+    dashboard = reports.dashboard(days=7)
+    assert dashboard.clients_per_type == {"Bike": 3, "Electric Bike": 4}
+    assert dashboard.total == client_service.repository.count()
+    assert len(dashboard.days) == 7
+    assert (dashboard.days[-1].registered, dashboard.days[-1].removed) == (2, 1)
+    assert dashboard.growth is None
+
+    today = date.today()
+    weeks = reports.rollup(today - timedelta(days=20), today, "week")
+    assert sum(week.net for week in weeks) == 1
+    assert weeks[-1].start == today - timedelta(days=today.weekday())
+
+    # A range of days is a primary key range of the summary table
+    plan = conn.execute("EXPLAIN QUERY PLAN " + repositories.ReportRepository.DAILY, ("a", "b")).fetchall()
+    assert [row[3] for row in plan] == ["SEARCH client_daily_counts USING PRIMARY KEY (day>? AND day<?)"]
+
+
+def test_metrics_time_statements_and_log_slow_queries(client_repo, db_path, monkeypatch):
+    monkeypatch.setattr(metrics, "registry", metrics.Registry())
+    conn = sqlite3.connect(db_path, factory=metrics.InstrumentedConnection)
+    repo = repositories.ClientRepository(conn)
+    for client_id in range(1, 5):
+        repo.get(client_id)
+    monkeypatch.setattr(metrics, "SLOW_QUERY_SECONDS", 0)
+    repo.find_by_email("guus@guus.com")
+    conn.close()
+
+    summaries = {summary.name: summary for summary in metrics.registry.summaries()}
+    assert summaries[metrics.statement_key(repo.GET)].count == 4
+    slow = metrics.registry.slow_queries[-1]
+    assert "idx_clients_email_nocase" in slow.plan[0]
+
+    metrics.registry.count_error("ui")
+    text = metrics.prometheus_text()
+    assert 'bike_rental_sql_seconds_count{statement="SELECT id, name, email, phone, rental_type FROM clients WHERE id = ?"} 4' in text
+    assert 'bike_rental_errors_total{where="ui"} 1' in text
+
+
+def test_change_journal_lists_changes_of_other_terminals(client_repo, db_path):
+    service = ClientService(client_repo)
+    seq = service.latest_change()
+
+    # Another terminal with its own connection
+    other = ClientService(repositories.ClientRepository(repositories.open_connection(db_path)))
+    anna = other.register("Anna", "anna@test.nl", "0600000001", "Bike")
+    other.update(anna.id, "Anna B", "anna@test.nl", "0600000001", "Bike")
+    other.remove(1)
+
+    changes = service.changes_since(seq)
+    assert changes.complete
+    assert changes.clients == {anna.id: other.get(anna.id), 1: None}
+    assert service.changes_since(changes.seq) == (changes.seq, {}, True)
+
+    # Falling behind more than the limit or past pruned entries means a reload
+    other.register_many([(f"Klant {i}", f"k{i}@test.nl", f"07{i:08}", "Bike") for i in range(5)])
+    assert not service.changes_since(changes.seq, limit=3).complete
+    client_repo.prune_changes(keep=2)
+    behind = service.changes_since(changes.seq)
+    assert not behind.complete and behind.seq == service.latest_change()
+    other.repository.conn.close()
+
+
+def test_removed_clients_are_kept_and_archived(client_repo, db_path, tmp_path):
+    service = ClientService(client_repo)
+    anna = service.register("Anna", "anna@test.nl", "0600000001", "Bike")
+    service.remove(anna.id)
+    service.remove(2)
+    assert client_repo.get(anna.id) is None
+    # The phone of a removed client can be registered again straight away
+    service.register("Anna", "anna@test.nl", "0600000001", "Bike")
+
+    archive_path = str(tmp_path / "archive.db")
+    assert archive.archive_deleted_clients(db_path=db_path, archive_path=archive_path) == 0
+    done = []
+    moved = archive.archive_deleted_clients(older_than_days=0, batch_size=1, db_path=db_path,
+                                            archive_path=archive_path, now=time.time() + 1,
+                                            progress=lambda count, total: done.append((count, total)))
+    assert moved == 2 and done == [(1, 2), (2, 2)]
+    assert client_repo.deleted_before(int(time.time()) + 1, 10) == []
+
+    archived = archive.ClientArchive(archive_path)
+    assert archived.count() == 2
+    assert [client.name for client in archived.find_by_phone("0600000001")] == ["Anna"]
+    assert archived.get(2).email == "john.doe@example.com"
+    archived.close()
+
+
+def test_backup_copies_a_consistent_snapshot(client_repo, db_path, tmp_path):
+    backup_dir = str(tmp_path / "backups")
+    steps = []
+    path = backup.backup_database(db_path, backup_dir, pages=1, progress=lambda done, total: steps.append(done))
+    assert len(steps) > 1 and steps[-1] > steps[0]
+    copy = sqlite3.connect(path)
+    assert copy.execute("SELECT COUNT(*) FROM clients").fetchone()[0] == client_repo.count()
+    copy.close()
+
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(backup.BackupCancelled):
+        backup.backup_database(db_path, backup_dir, cancel_event=cancel_event, pages=1)
+    assert os.listdir(backup_dir) == [os.path.basename(path)]
+
+
+def test_phones_and_emails_are_compared_normalized(client_service):
+    assert validation.normalize_phone("06-12345678") == "+31612345678"
+    assert validation.normalize_phone("0031 6 1234 5678") == "+31612345678"
+    assert validation.normalize_phone("+49 151 12345678") == "+4915112345678"
+    assert validation.normalize_phone("0612345") is None
+
+    # John Doe has 0612345678
+    with pytest.raises(ValidationError, match="al geregistreerd"):
+        client_service.register("Jan", "jan@test.nl", "06-12345678", "Bike")
+    with pytest.raises(ValidationError, match="telefoonnummer"):
+        client_service.register("Jan", "jan@test.nl", "12345", "Bike")
+    created, rejected = client_service.register_many([("Jan", "jan@test.nl", "+31 6 12345678", "Bike"),
+                                                      ("Piet", "piet@test.nl", "06 1111 1111", "Bike"),
+                                                      ("Piet", "piet@test.nl", "0611111111", "Bike")])
+    assert created == 1
+    assert [row.reason for row in rejected] == ["Dit nummer is al geregistreerd",
+                                                "Dit nummer komt dubbel voor in het bestand"]
+
+    # Fuzzy duplicates: same name block and a similar name, or the same email in other case
+    duplicates = client_service.duplicates("Doe, John", "other@test.nl", "0699999999")
+    assert [client.name for client in duplicates] == ["John Doe"]
+    assert client_service.duplicates("Jon Do", "other@test.nl", "0699999999") == []
+    assert [c.name for c in client_service.duplicates("X", "EMMA.SMITH@example.com", "0699999999")] == ["Emma Smith"]
+
+
+def test_phones_shared_before_the_phone_check_are_listed(db_path):
+    # A database from before migration 008, with one phone in two notations
+    conn = repositories.open_connection(db_path)
+    for migration in migrations.MIGRATIONS[:7]:
+        migration(conn)
+    conn.execute("PRAGMA user_version = 7")
+    conn.executemany("INSERT INTO clients (name, email, phone, rental_type) VALUES (?, ?, ?, ?)",
+                     [("Oud", "oud@test.nl", "06-77777777", "Bike"), ("Nieuw", "nieuw@test.nl", "0677777777", "Bike")])
+    conn.commit()
+    migrations.migrate(conn)
+    service = ClientService(repositories.ClientRepository(conn))
+    old, new = (service.repository.find_by_email(email)[0] for email in ("oud@test.nl", "nieuw@test.nl"))
+    assert service.phone_conflicts() == [new.id]
+
+    # Saving the second client with its phone says which client has the number
+    with pytest.raises(ValidationError, match=f"ook bij klant {old.id}"):
+        service.update(new.id, "Nieuw", "nieuw@test.nl", "0677777777", "Electric Bike")
+    with pytest.raises(ValidationError, match=f"Klant {new.id}: Dit nummer staat ook bij klant {old.id}"):
+        service.apply_edits({new.id: (new, new._replace(rental_type="Electric Bike"))})
+
+    # Another number resolves it, and so does removing the older client
+    service.update(new.id, "Nieuw", "nieuw@test.nl", "0677777778", "Bike")
+    assert service.phone_conflicts() == []
+    conn.execute("UPDATE clients SET phone = '0677777777', phone_key = NULL WHERE id = ?", (new.id,))
+    conn.execute("INSERT INTO phone_conflicts (client_id, phone_key) VALUES (?, '+31677777777')", (new.id,))
+    service.remove(old.id)
+    assert service.update(new.id, "Nieuw", "nieuw@test.nl", "0677777777", "Bike").phone == "0677777777"
+    assert service.phone_conflicts() == []
+    conn.close()
+
+
+def test_auth_rehashes_caches_relogins_and_throttles(client_repo, monkeypatch):
+    monkeypatch.setattr(auth_module, "SCRYPT_N", 2 ** 10)
+    now = [1000.0]
+    employees = repositories.EmployeeRepository(client_repo.conn)
+    auth = AuthService(employees, clock=lambda: now[0])
+
+    # The sha256 hash of the seeded account is replaced on the first login
+    assert auth.login("admin", "admin123").username == "admin"
+    stored = employees.find_by_username("admin")[1]
+    assert stored.startswith("scrypt$1024$")
+    assert auth_module.verify_password("admin123", stored)
+
+    # A quick second login skips the KDF
+    checks = []
+    monkeypatch.setattr(auth_module, "verify_password", lambda *args: checks.append(args) or False)
+    assert auth.login("admin", "admin123").username == "admin"
+    assert checks == []
+    now[0] += auth_module.RELOGIN_SECONDS
+    assert auth.login("admin", "admin123") is None
+    assert len(checks) == 1
+
+    # Failed attempts lock the username, without running the KDF
+    for _ in range(auth_module.FREE_ATTEMPTS):
+        assert auth.login("employee", "fout") is None
+    with pytest.raises(auth_module.TooManyAttemptsError):
+        auth.login("employee", "fout")
+    assert len(checks) == 1 + auth_module.FREE_ATTEMPTS
+    now[0] += auth_module.LOCKOUT_SECONDS
+    assert auth.login("employee", "fout") is None
+
+    token = auth.create_session(employees.find_by_username("admin")[0])
+    assert auth.employee_for_token(token).username == "admin"
+    now[0] += auth_module.SESSION_SECONDS
+    assert auth.employee_for_token(token) is None
+
+
+def test_auth_username_flood_neither_ends_nor_spreads_lockouts(client_repo, monkeypatch):
+    monkeypatch.setattr(auth_module, "SCRYPT_N", 2 ** 10)
+    monkeypatch.setattr(auth_module, "MAX_TRACKED_USERNAMES", 3)
+    now = [1000.0]
+    auth = AuthService(repositories.EmployeeRepository(client_repo.conn), clock=lambda: now[0])
+
+    for _ in range(auth_module.FREE_ATTEMPTS):
+        auth.record_failure("admin")
+    auth.record_failure("employee")  # a typo
+    # Failures for many made-up usernames push out each other, not admin
+    for i in range(10):
+        for _ in range(auth_module.FREE_ATTEMPTS - 1):
+            auth.record_failure(f"gast{i}")
+    with pytest.raises(auth_module.TooManyAttemptsError):
+        auth.login("admin", "admin123")
+    # And they don't lock out anyone else
+    assert auth.login("employee", "employee123").username == "employee"
+    assert auth.login("nog_een_gast", "fout") is None
+    assert len(auth.failures) == 3 and "admin" in auth.failures
+
+    # Counts are forgotten FAILURE_SECONDS after the last failure
+    now[0] += auth_module.FAILURE_SECONDS
+    assert auth.login("admin", "admin123").username == "admin"
+
+
+def test_client_edits_undo_redo_and_save_in_one_transaction(client_repo, db_path):
+    service = ClientService(client_repo, ClientCache(client_repo.data_version))
+    john, emma, michael = service.get_many([2, 3, 4])
+    edits = ClientEdits()
+    edits.update([john, emma], rental_type="Electric Bike")
+    edits.remove([michael])
+    edits.update([john], email="john@test.nl")
+    assert len(edits) == 2  # emma already rents electric bikes
+
+    # Undo takes back a whole step, redo repeats it
+    assert edits.undo() == {john.id: john._replace(rental_type="Electric Bike")}
+    assert edits.undo() == {michael.id: michael}
+    assert edits.redo() == {michael.id: None}
+    edits.update([emma], rental_type="Electric Bike")  # no change, not a step
+    assert edits.can_redo
+    edits.update([emma], rental_type="Bike")
+    assert not edits.can_redo
+    edits.update([emma], rental_type="Electric Bike")  # back to how it was loaded
+    assert edits.changes() == {john.id: (john, john._replace(rental_type="Electric Bike")), michael.id: (michael, None)}
+
+    # Another terminal changes john after he was loaded: nothing is saved
+    other = repositories.ClientRepository(repositories.open_connection(db_path))
+    other.update(john.id, "John D.", john.email, john.phone, "Bike")
+    with pytest.raises(ValidationError, match="andere kassa"):
+        service.apply_edits(edits.changes())
+    assert client_repo.get(michael.id) == michael
+    other.conn.close()
+
+    edits.clear()
+    john = service.get(john.id)
+    edits.update([john, emma], phone="0611111111")
+    with pytest.raises(ValidationError, match="dubbel"):
+        service.apply_edits(edits.changes())
+    edits.undo()
+    edits.update([john], phone="0687654321")  # emma's phone
+    with pytest.raises(ValidationError, match="al geregistreerd"):
+        service.apply_edits(edits.changes())
+    edits.update([emma], name="Emma S")
+    edits.remove([emma])  # frees the phone
+    saved = service.apply_edits(edits.changes())
+    assert saved == {emma.id: None, john.id: john._replace(phone="0687654321")}
+    assert service.get(john.id).phone == "0687654321" and client_repo.get(emma.id) is None
+    assert [client.id for client in client_repo.deleted_before(int(time.time()) + 1, 10)] == [emma.id]
+
+
+def test_sqlite_storage_serves_services_and_sessions(db_path, tmp_path):
+    sqlite_storage = storage.SqliteStorage(db_path)
+    assert sqlite_storage.migrate() == len(migrations.MIGRATIONS)
+    assert not sqlite_storage.concurrent and not storage.is_postgres(db_path)
+    assert storage.is_postgres("postgresql://kassa@server/fietsen")
+
+    # A backend without client sessions fails when it is created, not when a job needs one
+    class Incomplete(storage.Storage):
+        def migrate(self):
+            return 0
+
+    with pytest.raises(TypeError, match="client_session"):
+        Incomplete()
+
+    service = ClientService(sqlite_storage.clients)
+    anna = service.register("Anna", "anna@test.nl", "0600000001", "Bike")
+    with storage.client_session(db_path, snapshot=True) as snapshot:
+        service.remove(anna.id)
+        # The session still reads the state from before the removal
+        assert snapshot.get(anna.id) == anna
+    assert sqlite_storage.clients.get(anna.id) is None
+    assert AuthService(sqlite_storage.employees).login("admin", "admin123").is_admin
+    with pytest.raises(ValueError, match="pg_dump"):
+        backup.backup_database("postgresql://kassa@server/fietsen", str(tmp_path / "backups"))
+    sqlite_storage.close()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="module")
+def postgres_url(tmp_path_factory):
+    """BIKE_RENTAL_TEST_DATABASE_URL, or a throwaway server when initdb and pg_ctl are installed.
+
+    initdb refuses to run as root; run the tests as another user, or start a
+    server yourself and point BIKE_RENTAL_TEST_DATABASE_URL at it (see readme.txt).
+    """
+    pytest.importorskip("psycopg")
+    pytest.importorskip("psycopg_pool")
+    url = os.environ.get("BIKE_RENTAL_TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    initdb, pg_ctl = shutil.which("initdb"), shutil.which("pg_ctl")
+    if initdb is None or pg_ctl is None:
+        pytest.skip("PostgreSQL is not available, set BIKE_RENTAL_TEST_DATABASE_URL")
+    data = tmp_path_factory.mktemp("pgdata")
+    port = _free_port()
+    # A database in SQL_ASCII would hand out text as bytes
+    subprocess.run([initdb, "-D", str(data), "-U", "postgres", "--auth=trust", "-E", "UTF8", "--locale=C"],
+                   check=True, capture_output=True)
+    subprocess.run([pg_ctl, "-D", str(data), "-l", str(data / "server.log"), "-w", "start",
+                    "-o", f"-p {port} -k {data} -c listen_addresses=''"], check=True, capture_output=True)
+    try:
+        yield f"postgresql://postgres@/postgres?host={data}&port={port}"
+    finally:
+        subprocess.run([pg_ctl, "-D", str(data), "-m", "fast", "stop"], capture_output=True)
+
+
+@pytest.fixture
+def postgres_storage(postgres_url):
+    # Every test gets a schema of its own, so a shared server stays clean
+    import psycopg
+
+    schema = f"bike_rental_test_{uuid.uuid4().hex[:12]}"
+    with psycopg.connect(postgres_url, autocommit=True) as conn:
+        conn.execute(f"CREATE SCHEMA {schema}")
+    separator = "&" if "?" in postgres_url else "?"
+    pg_storage = storage.open_storage(f"{postgres_url}{separator}options=-csearch_path%3D{schema}")
+    yield pg_storage
+    pg_storage.close()
+    with psycopg.connect(postgres_url, autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA {schema} CASCADE")
+
+
+def test_postgres_storage_matches_sqlite(postgres_storage, tmp_path):
+    import postgres_storage as postgres_module
+
+    assert postgres_storage.migrate() == postgres_storage.migrate() == len(postgres_module.MIGRATIONS)
+    assert postgres_storage.concurrent
+    clients = postgres_storage.clients
+    service = ClientService(clients, ClientCache(clients.data_version))
+    assert clients.count() == 6 and service.phone_conflicts() == []
+    first_page = clients.list_page(0, 3)
+    assert clients.list_page_before(clients.list_page(first_page[-1].id, 3)[0].id, 3) == first_page
+
+    seq = service.latest_change()
+    anna = service.register("Anna de Vries", "Anna@Test.nl", "06-00000001", "Bike")
+    with pytest.raises(ValidationError, match="al geregistreerd"):
+        service.register("Anna", "anna@test.nl", "0600000001", "Bike")
+    assert clients.find_by_email("anna@test.nl") == [anna]
+    assert clients.find_by_name_prefix("anna d") == [anna]
+    assert clients.search("vri anna")[0] == anna
+    assert clients.duplicate_candidates("de Vries, Anna", "", "", 10) == [anna]
+
+    # Bulk registrations are loaded with COPY
+    count, rejected = service.register_many([(f"Klant {i}", f"k{i}@test.nl", f"07{i:08}", "Electric Bike")
+                                             for i in range(10)] + [("Dubbel", "d@test.nl", "0600000001", "Bike")])
+    assert count == 10 and len(rejected) == 1
+    changes = service.changes_since(seq)
+    assert changes.complete and anna.id in changes.clients and len(changes.clients) == 11
+
+    service.remove(anna.id)
+    assert clients.get(anna.id) is None and clients.count_deleted_before(int(time.time()) + 1) == 1
+    reports = postgres_storage.reports.clients_per_type()
+    assert reports == {"Bike": 4, "Electric Bike": 12}
+
+    # Queued edits are saved with executemany in one transaction
+    k0, k1 = clients.find_by_email("k0@test.nl")[0], clients.find_by_email("k1@test.nl")[0]
+    saved = service.apply_edits({k0.id: (k0, k0._replace(rental_type="Bike")), k1.id: (k1, None)})
+    assert saved == {k1.id: None, k0.id: k0._replace(rental_type="Bike")}
+    with pytest.raises(ValidationError, match="andere kassa"):
+        service.apply_edits({k0.id: (k0, k0._replace(name="Klant nul"))})
+
+    # Export reads through a server-side cursor in a snapshot session
+    path = tmp_path / "clients.csv"
+    assert exporter.export_clients(str(path), "csv", ["id", "name"], batch_size=4, db_path=postgres_storage.url) == 15
+
+    now = 1_700_000_000
+    rentals = RentalService(postgres_storage.bikes, postgres_storage.rentals, service, clock=lambda: now)
+    rental = rentals.check_out(1, "Bike", now + 3600, bike_code="B001")
+    with pytest.raises(ValidationError, match="al verhuurd"):
+        rentals.check_out(2, "Bike", now + 3600, bike_code="B001")
+    assert rentals.check_in("B001").returned_at is not None and rental.returned_at is None
+
+    auth = AuthService(postgres_storage.employees)
+    assert auth.login("employee", "employee123").username == "employee"
+    assert postgres_storage.employees.find_by_username("employee")[1].startswith("scrypt$")
+
+
+def test_postgres_change_journal_doesnt_block_writers(postgres_storage):
+    import psycopg
+
+    postgres_storage.migrate()
+    clients = postgres_storage.clients
+    service = ClientService(clients)
+    since, version = service.latest_change(), clients.data_version()
+
+    with psycopg.connect(postgres_storage.url) as slow:
+        slow.execute("UPDATE clients SET name = 'Traag' WHERE id = 1")
+        # Another writer doesn't wait for the open transaction...
+        with psycopg.connect(postgres_storage.url, autocommit=True) as fast:
+            fast.execute("SET lock_timeout = '2s'")
+            fast.execute("UPDATE clients SET name = 'Snel' WHERE id = 2")
+        # ...but its entry is only listed once the older transaction has
+        # ended, so a terminal can't move past the entry of the slow writer
+        assert service.changes_since(since).clients == {} and clients.data_version() == version
+        slow.commit()
+
+    changes = service.changes_since(since)
+    assert changes.complete and {i: c.name for i, c in changes.clients.items()} == {1: "Traag", 2: "Snel"}
+    assert service.changes_since(changes.seq).clients == {} and clients.data_version() != version
+
+    # Terminals behind the pruned entries reload
+    service.update(3, "Emma", "emma@test.nl", "0600000003", "Bike")
+    assert clients.prune_changes(1) > 0
+    assert not service.changes_since(since).complete
+    assert service.changes_since(changes.seq).complete
@@ -0,0 +1,83 @@
+"""Validation and normalization rules for client data, shared by the form, the bulk import and the API.
+
+Besides the checks, this module computes the keys that are stored next to
+each client (migration 008) so duplicates are found with an index lookup:
+
+- phone_key: the phone number in E.164 form, "06-12345678" -> "+31612345678",
+- email_key: the email address in lowercase,
+- name_key: the blocking key for fuzzy duplicate detection, the first letters
+  of every word of the name without accents, sorted. "Piet Jansen" and
+  "Jansen, Pieter" share the block "jan pie"; similar_names then decides
+  which of the clients in a block are likely the same person.
+"""
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Optional, Tuple
+
+RENTAL_TYPES = ["Bike", "Electric Bike"]
+
+# Compiled once instead of on every check
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+PHONE_SEPARATORS = re.compile(r"[\s\-./()]")
+E164_PATTERN = re.compile(r"^\+[1-9]\d{7,14}$")
+NAME_WORD = re.compile(r"[a-z0-9]+")
+
+# National numbers ("06...") are Dutch; a Dutch number has 9 digits after +31
+COUNTRY_PREFIX = "+31"
+DUTCH_NUMBER_LENGTH = len(COUNTRY_PREFIX) + 9
+
+NAME_BLOCK_LENGTH = 3
+SIMILAR_NAME_RATIO = 0.9
+
+
+def is_valid_email(email):
+    return EMAIL_PATTERN.match(email) is not None
+
+
+def is_valid_rental_type(rental_type):
+    return rental_type in RENTAL_TYPES
+
+
+def normalize_phone(phone: str) -> Optional[str]:
+    """The phone number in E.164 form, or None when it isn't a valid number."""
+    number = PHONE_SEPARATORS.sub("", phone)
+    if number.startswith("00"):
+        number = "+" + number[2:]
+    elif number.startswith("0"):
+        number = COUNTRY_PREFIX + number[1:]
+    if E164_PATTERN.match(number) is None:
+        return None
+    if number.startswith(COUNTRY_PREFIX) and len(number) != DUTCH_NUMBER_LENGTH:
+        return None
+    return number
+
+
+def phone_key(phone: str) -> str:
+    # Numbers registered before validation of phones only lose their separators
+    return normalize_phone(phone) or PHONE_SEPARATORS.sub("", phone)
+
+
+def email_key(email: str) -> str:
+    return email.strip().lower()
+
+
+def normalize_name(name: str) -> str:
+    # Lowercase ASCII words: accents dropped, punctuation removed
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode().lower()
+    return " ".join(NAME_WORD.findall(ascii_name))
+
+
+def name_key(name: str) -> str:
+    return " ".join(sorted(word[:NAME_BLOCK_LENGTH] for word in normalize_name(name).split()))
+
+
+def client_keys(name: str, email: str, phone: str) -> Tuple[str, str, str]:
+    """(phone_key, email_key, name_key) of a client."""
+    return phone_key(phone), email_key(email), name_key(name)
+
+
+def similar_names(a: str, b: str) -> bool:
+    # Word order doesn't matter: "Jansen, Piet" is "Piet Jansen"
+    a, b = (" ".join(sorted(normalize_name(name).split())) for name in (a, b))
+    return SequenceMatcher(None, a, b).ratio() >= SIMILAR_NAME_RATIO
@@ -0,0 +1,190 @@
+"""Background execution for the Tk user interface.
+
+Tk may only be used from the main thread, so database queries and file work run
+on worker threads and their results are handed back to the main thread. A
+TaskRunner belongs to one window: it polls for finished tasks with after() and
+calls the success or error callback in the main thread.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import metrics
+from storage import get_storage
+
+# Everything that uses the shared connection runs on this one thread, so the
+# connection is never used by two threads at the same time (see storage.Storage)
+db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-worker")
+
+# File work (export, import) uses its own connections and runs here
+io_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="io-worker")
+
+# Password hashing (scrypt, see rental_service.auth) takes a moment on purpose;
+# it runs here so it doesn't hold up the database thread
+kdf_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kdf-worker")
+
+# Poll interval while tasks are running, about 60 frames per second
+POLL_MS = 16
+
+_running_db_task = None
+_running_db_task_lock = threading.Lock()
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, fn, args, on_success, on_error, on_cancelled, busy, executor, cancel_event):
+        self.fn = fn
+        self.args = args
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_cancelled = on_cancelled
+        self.busy = busy
+        self.executor = executor
+        self.cancel_event = cancel_event
+        self.future = None
+        self.cancelled = False
+
+    def run(self):
+        # Runs in the worker thread
+        if self.cancelled:
+            raise TaskCancelled()
+        if metrics.ENABLED:
+            start = time.perf_counter()
+            try:
+                return self.run_fn()
+            finally:
+                metrics.observe("task", metrics.handler_name(self.fn), time.perf_counter() - start)
+        return self.run_fn()
+
+    def run_fn(self):
+        global _running_db_task
+        if self.executor is not db_executor:
+            return self.fn(*self.args)
+        with _running_db_task_lock:
+            _running_db_task = self
+        try:
+            return self.fn(*self.args)
+        finally:
+            with _running_db_task_lock:
+                _running_db_task = None
+
+    def cancel(self):
+        self.cancelled = True
+        if self.cancel_event is not None:
+            # Long running file work checks this event between batches
+            self.cancel_event.set()
+        if self.future is None or self.future.cancel():
+            return
+        # Already running: abort the query if it is this task's query
+        with _running_db_task_lock:
+            if _running_db_task is self:
+                get_storage().interrupt()
+
+
+class TaskRunner:
+    def __init__(self, widget, on_busy_changed=None, on_error=None):
+        self.widget = widget
+        self.on_busy_changed = on_busy_changed
+        self.default_on_error = on_error
+        self.results = queue.Queue()
+        self.tasks = set()
+        self.after_id = None
+        self.closed = False
+
+    @property
+    def busy(self):
+        return any(task.busy for task in self.tasks)
+
+    def submit(self, fn, *args, on_success=None, on_error=None, on_cancelled=None, busy=True,
+               executor=db_executor, cancel_event=None):
+        """Run fn(*args) in the background and return the Task.
+
+        on_success(result) and on_error(exception) are called in the main
+        thread. A cancelled task calls on_cancelled() instead, once it has
+        actually stopped. Tasks with busy=True mark the window as busy while
+        they run. Queries on the shared connection are interrupted when
+        cancelled; other work should watch cancel_event, which is set on cancel.
+        """
+        was_busy = self.busy
+        task = Task(fn, args, on_success, on_error or self.default_on_error, on_cancelled, busy, executor,
+                    cancel_event)
+        self.tasks.add(task)
+        task.future = executor.submit(task.run)
+        task.future.add_done_callback(lambda future: self.results.put((task, future)))
+        if self.busy != was_busy and self.on_busy_changed is not None:
+            self.on_busy_changed(True)
+        self.schedule_poll()
+        return task
+
+    def post(self, callback, *args):
+        # Thread-safe: call callback(*args) in the main thread, used for progress updates
+        self.results.put((None, (callback, args)))
+
+    def schedule_poll(self):
+        if self.after_id is None and not self.closed:
+            self.after_id = self.widget.after(POLL_MS, self.poll)
+
+    def poll(self):
+        self.after_id = None
+        was_busy = self.busy
+        while True:
+            try:
+                task, outcome = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.closed:
+                return
+            if task is None:
+                callback, args = outcome
+                self.call(callback, *args)
+            else:
+                self.finish(task, outcome)
+
+        if self.busy != was_busy and self.on_busy_changed is not None:
+            self.on_busy_changed(self.busy)
+        if self.tasks:
+            self.schedule_poll()
+
+    def finish(self, task, future):
+        self.tasks.discard(task)
+        if task.cancelled or future.cancelled():
+            if task.on_cancelled is not None:
+                self.call(task.on_cancelled)
+            return
+        try:
+            result = future.result()
+        except (TaskCancelled, CancelledError):
+            return
+        except Exception as e:
+            if task.on_error is not None:
+                self.call(task.on_error, e)
+            return
+        if task.on_success is not None:
+            self.call(task.on_success, result)
+
+    def call(self, callback, *args):
+        # Callbacks run inside poll(); time each of them on its own
+        if not metrics.ENABLED:
+            return callback(*args)
+        start = time.perf_counter()
+        try:
+            return callback(*args)
+        finally:
+            metrics.observe("handler", metrics.handler_name(callback), time.perf_counter() - start)
+
+    def cancel_all(self, busy_only=False):
+        for task in list(self.tasks):
+            if task.busy or not busy_only:
+                task.cancel()
+
+    def close(self):
+        # Call before the window is destroyed: drops all pending results
+        self.closed = True
+        self.cancel_all()
+        if self.after_id is not None:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None